@@ -0,0 +1,73 @@
+"""
+Benchmark of the message splitter against the previous one,
+on synthetic /mymusic-like outputs of 1 MB, and bigger ones to show how both of them scale.
+
+Usage, from the repository root:
+    python benchmarks/message_splitter.py
+"""
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src'))
+
+from bot.reply import MessageSplitter, ReplyMixin  # noqa: E402
+
+MAX_LENGTH = ReplyMixin.MAX_RESPONSE_LENGTH
+MEGABYTE = 1024 * 1024
+SIZES = (1, 4, 16)
+NUMBER = 3
+
+
+def build_message(size: int) -> str:
+    """Lines with a link and an open <strong> tag every few lines, like the /mymusic output"""
+    lines = []
+    length = 0
+    index = 0
+    while length < size:
+        if index % 10 == 0:
+            line = f'<strong>Artist number {index}</strong>'
+        else:
+            line = f'    <a href="https://open.spotify.com/album/{index:022d}">Album number {index}</a> by <b>user</b>'
+        lines.append(line)
+        length += len(line) + 1
+        index += 1
+    return '\n'.join(lines)
+
+
+def legacy_split(message):
+    """The splitter as it was before the single-pass one"""
+    parts = []
+    while len(message) > 0:
+        if len(message) > MAX_LENGTH:
+            part = message[:MAX_LENGTH]
+            first_lnbr = part.rfind('\n')
+            if first_lnbr != -1:
+                parts.append(part[:first_lnbr])
+                message = message[(first_lnbr + 1):]
+            else:
+                parts.append(part)
+                message = message[MAX_LENGTH:]
+        else:
+            parts.append(message)
+            break
+    return parts
+
+
+def split(message):
+    return MessageSplitter(MAX_LENGTH).split(message)
+
+
+def main():
+    for size in SIZES:
+        message = build_message(size * MEGABYTE)
+        for message_name, message in ((f'{size} MB of lines', message),
+                                      (f'{size} MB single line', message.replace('\n', ' '))):
+            print(f'{message_name}:')
+            for name, function in (('legacy splitter', legacy_split), ('single-pass splitter', split)):
+                elapsed = timeit.timeit(lambda: function(message), number=NUMBER)
+                parts = function(message)
+                print(f'{name:>22}: {elapsed / NUMBER * 1000:.1f}ms per message, {len(parts)} parts')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,88 @@
+"""
+Micro-benchmark of the single-pass Spotify url parser against the previous
+url helpers (extract the first url, validate it, get its type, clean it and get its id).
+
+Usage, from the repository root:
+    python benchmarks/spotify_url_parser.py
+"""
+import os
+import re
+import sys
+import timeit
+from typing import Optional
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src'))
+
+from bot.music.spotify import SpotifyUtils  # noqa: E402
+
+MESSAGES = [
+    'Check this out https://open.spotify.com/track/4uLU6hMCjMI75M1A2tKUQC?si=4b1c2a3d4e5f',
+    'https://open.spotify.com/intl-es/album/1DFixLWuPkv3KT3TnV35m3?si=abc',
+    'New album from them! https://open.spotify.com/artist/0OdUWJ0sBjDrqHygGUXeCF',
+    'no links in this message, just talking about music',
+]
+NUMBER = 100000
+
+
+class LegacySpotifyUtils:
+    """The url helpers as they were before the single-pass parser"""
+    SPOTIFY_LINK_URL = 'open.spotify.com'
+    SPOTIFY_SHORTCUT_LINK_URL = 'spotify.link'
+
+    @staticmethod
+    def extract_url_from_message(text):
+        link = re.search(r'(?P<url>https?://[^\s]+)', text)
+        if link is not None:
+            return link.group('url')
+        return ''
+
+    @classmethod
+    def is_valid_url(cls, url: str) -> bool:
+        return cls.SPOTIFY_LINK_URL in url or cls.SPOTIFY_SHORTCUT_LINK_URL in url
+
+    @staticmethod
+    def get_link_type_from_url(url: str) -> Optional[str]:
+        if 'artist' in url:
+            return 'artist'
+        elif 'album' in url:
+            return 'album'
+        elif 'track' in url:
+            return 'track'
+        return None
+
+    @staticmethod
+    def clean_url(url: str) -> str:
+        if url.rfind('?') > -1:
+            return url[:url.rfind('?')]
+        return url
+
+    @staticmethod
+    def get_entity_id_from_url(url: str) -> str:
+        return url[url.rfind('/') + 1:]
+
+
+def legacy(message):
+    url = LegacySpotifyUtils.extract_url_from_message(message)
+    if not url or not LegacySpotifyUtils.is_valid_url(url):
+        return None
+    link_type = LegacySpotifyUtils.get_link_type_from_url(url)
+    cleaned_url = LegacySpotifyUtils.clean_url(url)
+    return link_type, LegacySpotifyUtils.get_entity_id_from_url(cleaned_url), cleaned_url
+
+
+def single_pass(message):
+    link = SpotifyUtils.parse_url(message)
+    if link is None:
+        return None
+    return link.link_type, link.entity_id, link.url
+
+
+def main():
+    for name, function in (('legacy helpers', legacy), ('single-pass parser', single_pass)):
+        elapsed = timeit.timeit(lambda: [function(message) for message in MESSAGES], number=NUMBER)
+        per_message = elapsed / (NUMBER * len(MESSAGES)) * 1e9
+        print(f'{name:>20}: {elapsed:.3f}s total, {per_message:.0f}ns per message')
+
+
+if __name__ == '__main__':
+    main()
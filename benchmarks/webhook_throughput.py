@@ -0,0 +1,159 @@
+"""
+End-to-end throughput of the bot in webhook mode, without Telegram.
+Recorded updates are posted to the webhook, and the replies of the handlers are received by a stub Bot API,
+while a stub MusicBucket API answers the backend requests.
+The send rate limits are lifted, as the replies do not go to Telegram.
+Every update of the recorded updates file has to get exactly one reply.
+
+Usage, from the repository root:
+    python benchmarks/webhook_throughput.py [--updates 2000] [--concurrency 50] [--chats 500]
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import sys
+import time
+
+from aiohttp import ClientSession, web
+
+SRC_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src')
+sys.path.insert(0, SRC_DIR)
+
+HOST = '127.0.0.1'
+BOT_API_PORT = 8091
+MUSICBUCKET_API_PORT = 8092
+WEBHOOK_PORT = 8093
+SECRET_TOKEN = 'benchmark'
+UPDATES_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'webhook_updates.json')
+
+# The bot settings are read when its modules are imported
+os.environ['TOKEN'] = '123456:benchmark'
+os.environ['API_URL'] = f'http://{HOST}:{MUSICBUCKET_API_PORT}/'
+
+from bot.metrics import metrics  # noqa: E402
+from bot.scheduler import SendScheduler, send_scheduler  # noqa: E402
+from bot.webhook import WebhookServer  # noqa: E402
+from main import build_application  # noqa: E402
+
+BOT = {'id': 123456, 'is_bot': True, 'first_name': 'MusicBucket', 'username': 'musicbucket_bot'}
+
+
+class StubBotAPI:
+    """Answers the Bot API methods that the handlers call, counting the sent messages"""
+
+    def __init__(self, expected_replies: int):
+        self.expected_replies = expected_replies
+        self.replies = 0
+        self.done = asyncio.Event()
+
+    def build_app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post('/bot{token}/{method}', self.handle)
+        return app
+
+    async def handle(self, request: web.Request) -> web.Response:
+        method = request.match_info['method'].lower()
+        data = await request.post()
+        if method == 'getme':
+            result = BOT
+        elif method in ('sendmessage', 'sendphoto', 'sendaudio'):
+            result = {
+                'message_id': 1,
+                'date': int(time.time()),
+                'chat': {'id': int(data.get('chat_id', 0)), 'type': 'private'},
+                'from': BOT,
+                'text': data.get('text', ''),
+            }
+            self.replies += 1
+            if self.replies >= self.expected_replies:
+                self.done.set()
+        else:
+            result = True
+        return web.json_response({'ok': True, 'result': result})
+
+
+async def stub_musicbucket_api(request: web.Request) -> web.Response:
+    if request.method == 'GET':
+        return web.json_response([])
+    return web.json_response({'id': 1})
+
+
+async def start_site(app: web.Application, port: int) -> web.AppRunner:
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, HOST, port).start()
+    return runner
+
+
+def build_updates(recorded_updates, count: int, chats: int):
+    """Copies of the recorded updates with their own update and message ids, spread among `chats` chats"""
+    for index in range(count):
+        update = json.loads(json.dumps(recorded_updates[index % len(recorded_updates)]))
+        update['update_id'] = index + 1
+        message = update['message']
+        message['message_id'] = index + 1
+        chat_id = index % chats + 1
+        message['chat']['id'] = -chat_id if message['chat']['type'] != 'private' else chat_id
+        yield update
+
+
+async def run(count: int, concurrency: int, chats: int):
+    with open(UPDATES_FILE) as updates_file:
+        recorded_updates = json.load(updates_file)
+
+    bot_api = StubBotAPI(expected_replies=count)
+    musicbucket_api = web.Application()
+    musicbucket_api.router.add_route('*', '/{path:.*}', stub_musicbucket_api)
+    runners = [
+        await start_site(bot_api.build_app(), BOT_API_PORT),
+        await start_site(musicbucket_api, MUSICBUCKET_API_PORT),
+    ]
+
+    application = build_application(base_url=f'http://{HOST}:{BOT_API_PORT}/bot')
+    webhook = WebhookServer(application, listen=HOST, port=WEBHOOK_PORT, path='/telegram', secret_token=SECRET_TOKEN)
+    await webhook.start(set_webhook=False)
+
+    semaphore = asyncio.Semaphore(concurrency)
+    url = f'http://{HOST}:{WEBHOOK_PORT}/telegram'
+    headers = {WebhookServer.SECRET_TOKEN_HEADER: SECRET_TOKEN}
+    try:
+        async with ClientSession() as session:
+            async def post(update):
+                async with semaphore:
+                    async with session.post(url, json=update, headers=headers) as response:
+                        response.raise_for_status()
+
+            start = time.perf_counter()
+            await asyncio.gather(*[post(update) for update in build_updates(recorded_updates, count, chats)])
+            received = time.perf_counter() - start
+            await asyncio.wait_for(bot_api.done.wait(), timeout=max(60, count / 10))
+            replied = time.perf_counter() - start
+    finally:
+        await webhook.stop()
+        for runner in runners:
+            await runner.cleanup()
+
+    print(f'{count} updates, {concurrency} concurrent posts, {chats} chats')
+    print(f'Received: {received:.2f} s ({count / received:.0f} updates/s)')
+    print(f'Replied: {replied:.2f} s ({count / replied:.0f} updates/s)')
+    print(json.dumps(metrics.snapshot(), indent=2))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--updates', type=int, default=2000)
+    parser.add_argument('--concurrency', type=int, default=50)
+    parser.add_argument('--chats', type=int, default=500)
+    args = parser.parse_args()
+
+    logging.disable(logging.INFO)
+    SendScheduler.GLOBAL_RATE = SendScheduler.PRIVATE_CHAT_RATE = SendScheduler.GROUP_CHAT_RATE = 1e9
+    SendScheduler.CHAT_BURST = 1e9
+    send_scheduler.__init__()
+    asyncio.run(run(args.updates, args.concurrency, args.chats))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,16 +1,45 @@
+import json
+import logging
+import mimetypes
 from collections import OrderedDict
 from os import getenv
+from tempfile import SpooledTemporaryFile
+from typing import Optional
 
-import requests
+import aiohttp
 from dotenv import load_dotenv
 
 from bot import utils
+from bot.cache import LRUCache
+from bot.metrics import metrics
+from bot.single_flight import SingleFlight
 
 load_dotenv()
 
+log = logging.getLogger(__name__)
+
 
 class APIClientException(Exception):
-    pass
+
+    def __init__(self, *args, status_code: Optional[int] = None, text: str = ''):
+        super().__init__(*args)
+        self.status_code = status_code
+        self.text = text
+
+
+class SpooledResponseFile(SpooledTemporaryFile):
+    """
+    Spooled temporary file with the content of a response.
+    Its name is built from the response content type, as file uploads use it to guess the mime type
+    """
+
+    def __init__(self, content_type: str, max_size: int):
+        super().__init__(max_size=max_size)
+        self._name = f'file{mimetypes.guess_extension(content_type) or ""}'
+
+    @property
+    def name(self) -> str:
+        return self._name
 
 
 class BaseAPIClient:
@@ -21,34 +50,153 @@ class BaseAPIClient:
     url = f'{getenv("API_URL")}'
     token = getenv('API_TOKEN')
 
+    # Keep-alive connection pool shared by every API client of the app
+    POOL_SIZE = int(getenv('API_POOL_SIZE', 100))
+    TIMEOUT = int(getenv('API_TIMEOUT', 30))
+    _session: Optional[aiohttp.ClientSession] = None
+
+    # Streamed responses are kept in memory up to this size, and moved to disk when they are bigger
+    STREAM_MEMORY_THRESHOLD = int(getenv('API_STREAM_MEMORY_THRESHOLD', 1024 * 1024))
+    STREAM_CHUNK_SIZE = 64 * 1024
+
+    # Response cache shared by every API client, keyed by (url, params).
+    # The TTL of every endpoint is set by the client method that calls it
+    cache = LRUCache(
+        max_entries=int(getenv('API_CACHE_MAX_ENTRIES', 2048)),
+        max_bytes=int(getenv('API_CACHE_MAX_BYTES', 32 * 1024 * 1024)),
+    )
+    # Identical GETs in flight at the same time are sent only once
+    single_flight = SingleFlight()
+
+    @classmethod
+    async def open_session(cls, application=None):
+        """
+        Opens the app-scoped HTTP session.
+        It is meant to be used as the ApplicationBuilder post_init callback
+        """
+        if cls._session is None or cls._session.closed:
+            BaseAPIClient._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=cls.POOL_SIZE),
+                timeout=aiohttp.ClientTimeout(total=cls.TIMEOUT),
+            )
+        return BaseAPIClient._session
+
+    @classmethod
+    async def close_session(cls, application=None):
+        """
+        Closes the app-scoped HTTP session.
+        It is meant to be used as the ApplicationBuilder post_shutdown callback
+        """
+        if BaseAPIClient._session is not None and not BaseAPIClient._session.closed:
+            await BaseAPIClient._session.close()
+        BaseAPIClient._session = None
+
     def _get_url(self, endpoint_url: str):
         """This method must be implemented in all the API Classes that inherits from this"""
         raise NotImplementedError
 
-    def process_request(self, url, method='get', params=None, data=None, json=None, headers=None, is_json=True,
-                        extra_snake_case=False, auth=None, files=None):
+    async def process_request(self, url, method='get', params=None, data=None, json=None, headers=None,
+                              is_json=True, extra_snake_case=False, auth=None, files=None, cache_ttl=None,
+                              stream=False):
+        """
+        Sends a request to the API.
+        GET responses are cached for `cache_ttl` seconds when it is given,
+        and identical GETs that are already in flight are awaited instead of being sent again.
+        With `stream`, the binary response is written in chunks to a spooled temporary file that is returned
+        """
+        cache_key = None
+        if cache_ttl and method == 'get':
+            cache_key = self._get_cache_key(url, params, is_json, extra_snake_case)
+            cached_response = self.cache.get(cache_key)
+            if cached_response is not None:
+                return cached_response
+
         if not headers:
             headers = {}
-        if not files:
-            files = {}
         if self.token:
             headers['Authorization'] = 'Token {}'.format(self.token)
+        if auth is not None:
+            auth = aiohttp.BasicAuth(*auth)
+        if files:
+            data = self._build_form_data(data, files)
+        elif isinstance(data, dict):
+            data = self._drop_none_values(data)
+        params = self._drop_none_values(params)
+        if stream:
+            return await self._send_stream_request(url, method, params, data, json, headers, auth)
+
+        async def send_request():
+            return await self._send_request(
+                url, method, params, data, json, headers, auth, is_json, extra_snake_case, cache_key, cache_ttl
+            )
 
-        response = requests.request(
-            method=method, url=url, params=params, data=data, json=json,
-            auth=auth, headers=headers, files=files,
-        )
-        processed_response = self.process_response(response, is_json, extra_snake_case)
+        if method == 'get':
+            single_flight_key = (
+                self._get_cache_key(url, params, is_json, extra_snake_case),
+                tuple(sorted(headers.items())),
+                auth,
+            )
+            return await self.single_flight.do(single_flight_key, send_request)
+        return await send_request()
+
+    async def _send_request(self, url, method, params, data, json, headers, auth, is_json, extra_snake_case,
+                            cache_key, cache_ttl):
+        session = await self.open_session()
+        async with session.request(
+                method=method, url=url, params=params, data=data, json=json,
+                auth=auth, headers=headers,
+        ) as response:
+            processed_response = await self.process_response(response, is_json, extra_snake_case)
+            # The body is already buffered, read() does not hit the network again
+            size = len(await response.read())
+        if cache_key is not None and processed_response is not None:
+            self.cache.set(cache_key, processed_response, ttl=cache_ttl, size=size)
         return processed_response
 
-    def process_response(self, response, is_json, extra_snake_case):
-        try:
-            response.raise_for_status()
-        except Exception as e:
-            raise APIClientException(e) from e
-        if is_json and response.content:
-            return self._format_response(response.json(object_pairs_hook=OrderedDict), extra_snake_case)
-        return response.content
+    async def _send_stream_request(self, url, method, params, data, json, headers, auth) -> SpooledResponseFile:
+        """
+        The response is kept in memory while it is smaller than STREAM_MEMORY_THRESHOLD, and on disk when it is bigger.
+        The caller must close the returned file
+        """
+        session = await self.open_session()
+        async with session.request(
+                method=method, url=url, params=params, data=data, json=json,
+                auth=auth, headers=headers,
+        ) as response:
+            if response.status >= 400:
+                await self.process_response(response, False, False)
+            spooled_file = SpooledResponseFile(response.content_type, self.STREAM_MEMORY_THRESHOLD)
+            size = 0
+            # Most bytes that the spooled file held in memory. It is whole in memory until a write makes it
+            # bigger than the threshold, and then it rolls over to disk
+            spooled_memory = 0
+            try:
+                async for chunk in response.content.iter_chunked(self.STREAM_CHUNK_SIZE):
+                    spooled_file.write(chunk)
+                    size += len(chunk)
+                    if spooled_memory <= self.STREAM_MEMORY_THRESHOLD:
+                        spooled_memory = size
+            except BaseException:
+                spooled_file.close()
+                raise
+        spooled_file.seek(0)
+        metrics.observe('api_client.stream.size_bytes', size)
+        metrics.observe('api_client.stream.spooled_memory_bytes', spooled_memory)
+        log.debug(f'Streamed "{url}". Size: {size} bytes. Spooled in memory: {spooled_memory} bytes')
+        return spooled_file
+
+    async def process_response(self, response, is_json, extra_snake_case):
+        content = await response.read()
+        if response.status >= 400:
+            text = content.decode(errors='replace')
+            raise APIClientException(
+                f'{response.status} {response.reason} for url: {response.url}',
+                status_code=response.status,
+                text=text,
+            )
+        if is_json and content:
+            return self._format_response(json.loads(content, object_pairs_hook=OrderedDict), extra_snake_case)
+        return content
 
     def _format_response(self, response, extra_snake_case):
         if isinstance(response, dict):
@@ -64,3 +212,32 @@ class BaseAPIClient:
         if isinstance(response, list):
             return [self._format_response(item, extra_snake_case) for item in response]
         return response
+
+    @classmethod
+    def invalidate_cache(cls, url_prefix: str) -> int:
+        """Drops the cached responses of every url that starts with the given prefix"""
+        return cls.cache.invalidate(lambda key: key[0].startswith(url_prefix))
+
+    @classmethod
+    def _get_cache_key(cls, url, params, is_json, extra_snake_case):
+        params = tuple(sorted((k, str(v)) for k, v in (cls._drop_none_values(params) or {}).items()))
+        return url, params, is_json, extra_snake_case
+
+    @staticmethod
+    def _drop_none_values(values):
+        """aiohttp does not accept None values, requests silently skipped them"""
+        if not values:
+            return values
+        return {k: v for k, v in values.items() if v is not None}
+
+    def _build_form_data(self, data, files) -> aiohttp.FormData:
+        form_data = aiohttp.FormData()
+        for key, value in (self._drop_none_values(data) or {}).items():
+            form_data.add_field(key, str(value))
+        for key, value in files.items():
+            form_data.add_field(key, value)
+        return form_data
+
+
+metrics.add_source('api_client.cache', BaseAPIClient.cache.stats)
+metrics.add_source('api_client.single_flight', BaseAPIClient.single_flight.stats)
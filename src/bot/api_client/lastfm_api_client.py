@@ -1,6 +1,6 @@
 from typing import Optional, List, Dict
 
-from bot.api_client.api_client import BaseAPIClient
+from bot.api_client.api_client import BaseAPIClient, SpooledResponseFile
 
 
 class LastfmAPIClient(BaseAPIClient):
@@ -19,40 +19,54 @@ class LastfmAPIClient(BaseAPIClient):
         PERIOD_6MONTHS,
         PERIOD_12MONTHS,
     )
+    # Seconds that a top albums/artists/tracks response is cached, by period.
+    # The longer the period, the slower its top changes
+    PERIOD_CACHE_TTLS = {
+        PERIOD_OVERALL: 6 * 60 * 60,
+        PERIOD_12MONTHS: 3 * 60 * 60,
+        PERIOD_6MONTHS: 2 * 60 * 60,
+        PERIOD_3MONTHS: 60 * 60,
+        PERIOD_1MONTH: 30 * 60,
+        PERIOD_7DAYS: 10 * 60,
+    }
     _url = 'lastfm/'
 
-    def get_now_playing(self, user_id: str) -> {}:
+    async def get_now_playing(self, user_id: str) -> {}:
         url = self._get_url(f'now-playing/{user_id}/')
-        return self.process_request(url)
+        return await self.process_request(url)
 
-    def get_top_albums(self, user_id: str, period: str = PERIOD_7DAYS) -> Dict:
+    async def get_top_albums(self, user_id: str, period: str = PERIOD_7DAYS) -> Dict:
         url = self._get_url(f'users/{user_id}/top-albums/')
         params = {'period': period}
-        return self.process_request(url, params=params)
+        return await self.process_request(url, params=params, cache_ttl=self.PERIOD_CACHE_TTLS.get(period))
 
-    def get_top_artists(self, user_id: str, period: str = PERIOD_7DAYS) -> Dict:
+    async def get_top_artists(self, user_id: str, period: str = PERIOD_7DAYS) -> Dict:
         url = self._get_url(f'users/{user_id}/top-artists/')
         params = {'period': period}
-        return self.process_request(url, params=params)
+        return await self.process_request(url, params=params, cache_ttl=self.PERIOD_CACHE_TTLS.get(period))
 
-    def get_top_tracks(self, user_id: str, period: str = PERIOD_7DAYS) -> Dict:
+    async def get_top_tracks(self, user_id: str, period: str = PERIOD_7DAYS) -> Dict:
         url = self._get_url(f'users/{user_id}/top-tracks/')
         params = {'period': period}
-        return self.process_request(url, params=params)
+        return await self.process_request(url, params=params, cache_ttl=self.PERIOD_CACHE_TTLS.get(period))
 
-    def get_collage(self, user_id: str, rows: Optional[int] = 5, cols: Optional[int] = 5,
-                    period: Optional[str] = PERIOD_7DAYS) -> bytes:
+    async def get_collage(self, user_id: str, rows: Optional[int] = 5, cols: Optional[int] = 5,
+                    period: Optional[str] = PERIOD_7DAYS) -> SpooledResponseFile:
+        """Returns the collage image as a file, that the caller must close"""
         url = self._get_url(f'collage/{user_id}/')
         params = {'rows': rows, 'cols': cols, 'period': period}
-        return self.process_request(url, params=params, is_json=False)
+        return await self.process_request(url, params=params, is_json=False, stream=True)
 
-    def set_lastfm_user(self, user_id: str, lastfm_username: str) -> Dict:
+    async def set_lastfm_user(self, user_id: str, lastfm_username: str) -> Dict:
         url = self._get_url(f'users/set-lastfm-user/')
         data = {
             'username': lastfm_username,
             'user_id': user_id,
         }
-        return self.process_request(url, method='post', data=data)
+        lastfm_user = await self.process_request(url, method='post', data=data)
+        # Cached tops of the user belong to its previous Last.fm username
+        self.invalidate_cache(self._get_url(f'users/{user_id}/'))
+        return lastfm_user
 
     def _get_url(self, endpoint_url) -> str:
         return f'{super().url}{self._url}{endpoint_url}'
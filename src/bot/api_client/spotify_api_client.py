@@ -5,9 +5,11 @@ from bot.api_client.api_client import BaseAPIClient
 
 
 class SpotifyAPIClient(BaseAPIClient):
+    SAVED_LINKS_CACHE_TTL = 5 * 60
+    FOLLOWED_ARTISTS_CACHE_TTL = 5 * 60
     _url = 'spotify/'
 
-    def search(self, query: str, entity_type: str) -> []:
+    async def search(self, query: str, entity_type: str) -> []:
         """
         Searches for a list of coincidences in Spotify
         :param query: query string term
@@ -19,65 +21,73 @@ class SpotifyAPIClient(BaseAPIClient):
             'entity_type': entity_type,
             'query': query
         }
-        return self.process_request(url, params=params)
+        return await self.process_request(url, params=params)
 
-    def get_artist(self, artist_id: str) -> OrderedDict:
+    async def get_artist(self, artist_id: str) -> OrderedDict:
         url = self._get_url(f'artists/{artist_id}/')
-        return self.process_request(url)
+        return await self.process_request(url)
 
-    def create_artist(self, artist_id: str) -> OrderedDict:
+    async def create_artist(self, artist_id: str) -> OrderedDict:
         url = self._get_url('artists/')
         data = {'spotify_id': artist_id}
-        return self.process_request(url, method='post', data=data)
+        return await self.process_request(url, method='post', data=data)
 
-    def create_album(self, album_id: str) -> OrderedDict:
+    async def create_album(self, album_id: str) -> OrderedDict:
         url = self._get_url('albums/')
         data = {'spotify_id': album_id}
-        return self.process_request(url, method='post', data=data)
+        return await self.process_request(url, method='post', data=data)
 
-    def create_track(self, track_id: str) -> OrderedDict:
+    async def create_track(self, track_id: str) -> OrderedDict:
         url = self._get_url('tracks/')
         data = {'spotify_id': track_id}
-        return self.process_request(url, method='post', data=data)
+        return await self.process_request(url, method='post', data=data)
 
-    def get_saved_links(self, user_id: str) -> []:
+    async def get_saved_links(self, user_id: str) -> []:
         url = self._get_url('saved-links/')
         params = {'user__telegram_id': user_id}
-        return self.process_request(url, params=params)
+        return await self.process_request(url, params=params, cache_ttl=self.SAVED_LINKS_CACHE_TTL)
 
-    def create_saved_link(self, link_id: int, user_id: int):
+    async def create_saved_link(self, link_id: int, user_id: int):
         url = self._get_url(f'saved-links/')
         data = {
             'link_id': link_id,
             'user_id': user_id,
         }
-        return self.process_request(url, method='post', data=data)
+        saved_link = await self.process_request(url, method='post', data=data)
+        self.invalidate_cache(self._get_url('saved-links/'))
+        return saved_link
 
-    def delete_saved_link(self, saved_link_id: int) -> OrderedDict:
+    async def delete_saved_link(self, saved_link_id: int) -> OrderedDict:
         url = self._get_url(f'saved-links/{saved_link_id}/')
-        return self.process_request(url, method='delete')
+        response = await self.process_request(url, method='delete')
+        self.invalidate_cache(self._get_url('saved-links/'))
+        return response
 
-    def get_followed_artists(self, user_id: str) -> []:
+    async def get_followed_artists(self, user_id: str) -> []:
         url = self._get_url('followed-artists/')
         params = {'user__telegram_id': user_id}
-        return self.process_request(url, params=params)
+        return await self.process_request(url, params=params, cache_ttl=self.FOLLOWED_ARTISTS_CACHE_TTL)
 
-    def create_followed_artist(self, artist_id: int, user_id: int) -> OrderedDict:
+    async def create_followed_artist(self, artist_id: int, user_id: int) -> OrderedDict:
         url = self._get_url('followed-artists/')
         data = {
             'artist_id': artist_id,
             'user_id': user_id,
         }
-        return self.process_request(url, method='post', json=data)
+        followed_artist = await self.process_request(url, method='post', json=data)
+        self.invalidate_cache(self._get_url('followed-artists/'))
+        return followed_artist
 
-    def delete_followed_artist(self, followed_artist_id: int) -> OrderedDict:
+    async def delete_followed_artist(self, followed_artist_id: int) -> OrderedDict:
         url = self._get_url(f'followed-artists/{followed_artist_id}/')
-        return self.process_request(url, method='delete')
+        response = await self.process_request(url, method='delete')
+        self.invalidate_cache(self._get_url('followed-artists/'))
+        return response
 
-    def check_new_music_releases(self, user_id: int) -> List:
+    async def check_new_music_releases(self, user_id: int) -> List:
         url = self._get_url(f'followed-artists/check-new-music-releases/')
         params = {'user__telegram_id': user_id}
-        return self.process_request(url, params=params)
+        return await self.process_request(url, params=params)
 
     def _get_url(self, endpoint_url: str) -> str:
         return f'{super().url}{self._url}{endpoint_url}'
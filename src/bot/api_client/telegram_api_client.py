@@ -1,6 +1,6 @@
 import datetime
 from collections import OrderedDict
-from typing import List, Dict
+from typing import AsyncIterator, Dict
 
 from telegram import User as TgUser
 from telegram import Chat as TgChat
@@ -9,9 +9,11 @@ from bot.api_client.api_client import BaseAPIClient
 
 
 class TelegramAPIClient(BaseAPIClient):
+    STATS_CACHE_TTL = 60
+    SENT_LINKS_PAGE_SIZE = 100
     _url = 'telegram/'
 
-    def create_user(self, user: TgUser) -> OrderedDict:
+    async def create_user(self, user: TgUser) -> OrderedDict:
         url = self._get_url('users/')
         data = {
             'telegram_id': user.id,
@@ -19,18 +21,18 @@ class TelegramAPIClient(BaseAPIClient):
             'first_name': user.first_name,
             'link': user.link,
         }
-        return self.process_request(url, method='post', data=data)
+        return await self.process_request(url, method='post', data=data)
 
-    def create_chat(self, chat: TgChat)  -> OrderedDict:
+    async def create_chat(self, chat: TgChat)  -> OrderedDict:
         url = self._get_url('chats/')
         data = {
             'telegram_id': chat.id,
             'name': chat.title or chat.username or chat.first_name,
             'chat_type': chat.type,
         }
-        return self.process_request(url, method='post', data=data)
+        return await self.process_request(url, method='post', data=data)
 
-    def create_sent_link(self, spotify_url: str, user_id: str, chat_id: str) -> OrderedDict:
+    async def create_sent_link(self, spotify_url: str, user_id: str, chat_id: str) -> OrderedDict:
         """
         We do not create links directly, so we create a sent-spotify-link sending the
         link url because if it doesn't exist in the DB, it creates automatically
@@ -45,11 +47,32 @@ class TelegramAPIClient(BaseAPIClient):
             'sent_by_id': user_id,
             'chat_id': chat_id,
         }
-        return self.process_request(url, method='post', data=data)
+        return await self.process_request(url, method='post', data=data)
 
-    def get_sent_links(self, chat_id: str = None, user_id: str = None, user_username: str = None,
-                       since_date: datetime.date = None) -> List:
+    async def iter_sent_links(self, page_size: int = SENT_LINKS_PAGE_SIZE, offset: int = 0, chat_id: str = None,
+                              user_id: str = None, user_username: str = None,
+                              since_date: datetime.date = None) -> AsyncIterator[OrderedDict]:
+        """
+        Yields the sent links, fetching a page of them only when the previous one is consumed.
+        Callers that stop early do not fetch the rest, and only a page of them is in memory at a time
+        """
         url = self._get_url('sent-spotify-links/')
+        params = self._get_sent_links_params(chat_id, user_id, user_username, since_date)
+        params.update({'limit': page_size, 'offset': offset})
+        while url:
+            response = await self.process_request(url, params=params)
+            if isinstance(response, list):
+                # The API does not paginate this list
+                for sent_link in response[offset:]:
+                    yield sent_link
+                return
+            for sent_link in response.get('results', []):
+                yield sent_link
+            # The next page url has all the query params, with its offset or cursor
+            url, params = response.get('next'), None
+
+    def _get_sent_links_params(self, chat_id: str = None, user_id: str = None, user_username: str = None,
+                               since_date: datetime.date = None) -> Dict:
         params = {}
         if chat_id:
             params.update({'chat__telegram_id': chat_id})
@@ -59,11 +82,11 @@ class TelegramAPIClient(BaseAPIClient):
             params.update({'sent_by__username': user_username})
         if since_date:
             params.update({'sent_at__gte': since_date.strftime(self.DATE_FORMAT)})
-        return self.process_request(url, params=params)
+        return params
 
-    def get_stats(self, chat_id: str) -> Dict:
+    async def get_stats(self, chat_id: str) -> Dict:
         url = self._get_url(f'stats/{chat_id}/')
-        return self.process_request(url)
+        return await self.process_request(url, cache_ttl=self.STATS_CACHE_TTL)
 
     def _get_url(self, endpoint_url: str) -> str:
         return f'{super().url}{self._url}{endpoint_url}'
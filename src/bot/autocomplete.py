@@ -0,0 +1,133 @@
+import bisect
+import logging
+import time
+from os import getenv
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from bot.music.music import LinkType
+
+log = logging.getLogger(__name__)
+
+
+class AutocompleteEntry(NamedTuple):
+    """An artist, album or track that the bot has already seen, as an inline result shows it"""
+    entity_type: str
+    spotify_id: str
+    name: str
+    description: str
+    url: str
+    thumb_url: str = ''
+
+
+class AutocompleteIndex:
+    """
+    In-process prefix index of the names of the known entities, to answer the inline searches
+    without the backend. Its rows are sorted by name in an array that is searched with bisect.
+    Every word of a name starts a row, so the names are found by any of their words.
+    Entities are ranked by how many times they have been shared. On every compaction the weights
+    decay, the least shared entities over the size bound are dropped and the array is rebuilt
+    """
+    MAX_ENTRIES = int(getenv('AUTOCOMPLETE_MAX_ENTRIES', 20000))
+    COMPACTION_INTERVAL = int(getenv('AUTOCOMPLETE_COMPACTION_INTERVAL', 60 * 60))
+    COMPACTED_SIZE_RATIO = 0.9
+
+    def __init__(self, max_entries: int = MAX_ENTRIES, compaction_interval: float = COMPACTION_INTERVAL):
+        self.max_entries = max_entries
+        self.compaction_interval = compaction_interval
+        # Entries and weights by (entity type, spotify id)
+        self._entries: Dict[Tuple[str, str], AutocompleteEntry] = {}
+        self._weights: Dict[Tuple[str, str], float] = {}
+        # Sorted (normalized name suffix, key) rows. Rows of dropped or renamed entries
+        # stay until the next compaction, and they are skipped by the searches
+        self._rows: List[Tuple[str, Tuple[str, str]]] = []
+        self._compacted_at = time.monotonic()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def add(self, entry: AutocompleteEntry, weight: float = 1):
+        """
+        Adds the entity, or updates it and adds `weight` to it if it is known.
+        The fields that the entry lacks are kept from the known entity, like the thumbnails
+        of the search results, which the links of the backend do not have
+        """
+        if not entry.spotify_id or not entry.name:
+            return
+        key = (entry.entity_type, entry.spotify_id)
+        previous_entry = self._entries.get(key)
+        if previous_entry is not None:
+            entry = entry._replace(**{
+                field: value for field, value in previous_entry._asdict().items()
+                if value and not getattr(entry, field)
+            })
+        self._entries[key] = entry
+        self._weights[key] = self._weights.get(key, 0) + weight
+        if previous_entry is None or previous_entry.name != entry.name:
+            for row in self._get_rows(entry.name, key):
+                bisect.insort(self._rows, row)
+        if len(self._entries) > self.max_entries or \
+                time.monotonic() - self._compacted_at > self.compaction_interval:
+            self.compact()
+
+    def search(self, entity_type: str, query: str, limit: int) -> List[AutocompleteEntry]:
+        """The entities of the type with a word that starts with the query, the most shared first"""
+        prefix = normalize(query)
+        if not prefix:
+            return []
+        keys = {}
+        index = bisect.bisect_left(self._rows, (prefix,))
+        while index < len(self._rows) and self._rows[index][0].startswith(prefix):
+            key = self._rows[index][1]
+            if key[0] == entity_type and key in self._entries and key not in keys:
+                # Skips the rows of the previous name of a renamed entity
+                if f' {normalize(self._entries[key].name)}'.endswith(f' {self._rows[index][0]}'):
+                    keys[key] = self._weights[key]
+            index += 1
+        ranked_keys = sorted(keys, key=keys.get, reverse=True)[:limit]
+        return [self._entries[key] for key in ranked_keys]
+
+    def compact(self):
+        for key in self._weights:
+            self._weights[key] /= 2
+        if len(self._entries) > self.max_entries:
+            # Some room is left, so the next entities do not compact the index again right away
+            kept_entries = int(self.max_entries * self.COMPACTED_SIZE_RATIO)
+            dropped_keys = sorted(self._weights, key=self._weights.get)[:len(self._entries) - kept_entries]
+            for key in dropped_keys:
+                del self._entries[key]
+                del self._weights[key]
+        self._rows = sorted(
+            row for key, entry in self._entries.items() for row in self._get_rows(entry.name, key)
+        )
+        self._compacted_at = time.monotonic()
+        log.debug(f'Autocomplete index compacted to {len(self._entries)} entities and {len(self._rows)} rows')
+
+    @staticmethod
+    def _get_rows(name: str, key: Tuple[str, str]) -> List[Tuple[str, Tuple[str, str]]]:
+        words = normalize(name).split(' ')
+        return [(' '.join(words[index:]), key) for index in range(len(words))]
+
+
+def normalize(text: str) -> str:
+    return ' '.join(text.lower().split())
+
+
+def get_link_entry(link: Dict) -> Optional[AutocompleteEntry]:
+    """The entry of the artist, album or track of a link of the backend"""
+    link_type = link.get('link_type')
+    entity = link.get(link_type) if link_type else None
+    if not entity:
+        return None
+    url = link.get('url') or ''
+    spotify_id = entity.get('spotify_id') or url.split('?')[0].rstrip('/').rsplit('/', 1)[-1]
+    artists = ', '.join(artist.get('name') for artist in entity.get('artists') or [] if artist)
+    if link_type == LinkType.ARTIST.value:
+        description = ', '.join(genre.get('name') for genre in entity.get('genres') or [])
+    elif link_type == LinkType.TRACK.value and entity.get('album'):
+        description = f'{artists} - {entity["album"].get("name")}'
+    else:
+        description = artists
+    return AutocompleteEntry(link_type, spotify_id, entity.get('name') or '', description, url)
+
+
+autocomplete_index = AutocompleteIndex()
@@ -4,8 +4,8 @@ from telegram import InlineKeyboardButton, InlineKeyboardMarkup, Update
 from telegram.ext import CallbackContext
 
 from bot.api_client.spotify_api_client import SpotifyAPIClient
-from bot.api_client.telegram_api_client import TelegramAPIClient
-from bot.models import Link
+from bot.models import SaveTelegramEntityMixin
+from bot.rendering import get_link_fragments
 
 
 class BaseButton:
@@ -28,20 +28,18 @@ class SaveLinkButton(BaseButton):
         """Handles the pulsation of the button"""
         query = update.callback_query
         link_id = cls.get_callback_data(query.data)
-        user = cls._save_user(query.from_user)
-        cls._save_link(link_id, user.get('id'))
+        user = await cls._save_user(query.from_user)
+        await cls._save_link(link_id, user.get('id'))
         return
 
     @staticmethod
-    def _save_user(user):
-        telegram_api_client = TelegramAPIClient()
-        create_user_response = telegram_api_client.create_user(user)
-        return create_user_response
+    async def _save_user(user):
+        return await SaveTelegramEntityMixin.save_user(user)
 
     @staticmethod
-    def _save_link(link_id: int, user_id: int) -> OrderedDict:
+    async def _save_link(link_id: int, user_id: int) -> OrderedDict:
         spotify_api_client = SpotifyAPIClient()
-        create_saved_link_response = spotify_api_client.create_saved_link(link_id, user_id)
+        create_saved_link_response = await spotify_api_client.create_saved_link(link_id, user_id)
         return create_saved_link_response
 
     @classmethod
@@ -49,6 +47,16 @@ class SaveLinkButton(BaseButton):
         keyboard = [[InlineKeyboardButton("Save", callback_data=f'{cls.CALLBACK_NAME}:{link_id}')]]
         return InlineKeyboardMarkup(keyboard)
 
+    @classmethod
+    def get_links_keyboard_markup(cls, links) -> InlineKeyboardMarkup:
+        """A Save button for each one of the links"""
+        keyboard = []
+        for link in links:
+            keyboard.append([InlineKeyboardButton(
+                f'Save {get_link_fragments(link).name}', callback_data=f'{cls.CALLBACK_NAME}:{link.get("id")}'
+            )])
+        return InlineKeyboardMarkup(keyboard)
+
 
 class DeleteSavedLinkButton(BaseButton):
     """
@@ -62,7 +70,7 @@ class DeleteSavedLinkButton(BaseButton):
         query = update.callback_query
         saved_link_id = cls.get_callback_data(query.data)
         if saved_link_id:
-            SpotifyAPIClient().delete_saved_link(saved_link_id)
+            await SpotifyAPIClient().delete_saved_link(saved_link_id)
         await context.bot.edit_message_reply_markup(
             chat_id=query.message.chat_id,
             message_id=query.message.message_id
@@ -74,7 +82,7 @@ class DeleteSavedLinkButton(BaseButton):
         for saved_link in saved_links:
             link = saved_link.get('link')
             keyboard.append([InlineKeyboardButton(
-                Link.get_name(link), callback_data=f'{cls.CALLBACK_NAME}:{saved_link.get("id")}'
+                get_link_fragments(link).name, callback_data=f'{cls.CALLBACK_NAME}:{saved_link.get("id")}'
             )])
         keyboard.append([InlineKeyboardButton(
             'Cancel', callback_data=f'{cls.CALLBACK_NAME}:'
@@ -94,7 +102,7 @@ class UnfollowArtistButton(BaseButton):
         query = update.callback_query
         followed_artist_id = cls.get_callback_data(query.data)
         if followed_artist_id:
-            SpotifyAPIClient().delete_followed_artist(followed_artist_id)
+            await SpotifyAPIClient().delete_followed_artist(followed_artist_id)
         await context.bot.edit_message_reply_markup(
             chat_id=query.message.chat_id,
             message_id=query.message.message_id
@@ -0,0 +1,170 @@
+import json
+import logging
+import os
+import time
+from collections import OrderedDict
+from os import getenv
+from typing import Any, Callable, Dict, Hashable, List, Optional
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+log = logging.getLogger(__name__)
+
+# Folder of the cache files that survive restarts
+CACHE_DIR = getenv('CACHE_DIR', 'cache')
+
+
+class LRUCache:
+    """
+    In-process cache bounded by entry count and, optionally, by byte size.
+    Entries can expire after a TTL, set globally or per entry.
+    The least recently used entries are evicted first
+    """
+    _MISSING = object()
+
+    def __init__(self, max_entries: int = 1024, max_bytes: Optional[int] = None, ttl: Optional[float] = None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        # key -> (value, expires_at, size)
+        self._entries: OrderedDict = OrderedDict()
+        self.size_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        entry = self._entries.get(key, self._MISSING)
+        if entry is self._MISSING:
+            self.misses += 1
+            return default
+        value, expires_at, _ = entry
+        if expires_at is not None and expires_at <= time.monotonic():
+            self.pop(key)
+            self.misses += 1
+            return default
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None, size: int = 0):
+        ttl = ttl if ttl is not None else self.ttl
+        expires_at = time.monotonic() + ttl if ttl is not None else None
+        if key in self._entries:
+            self.pop(key)
+        if self.max_bytes is not None and size > self.max_bytes:
+            # It would evict the whole cache and still not fit
+            return
+        self._entries[key] = (value, expires_at, size)
+        self.size_bytes += size
+        self._evict()
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        entry = self._entries.pop(key, self._MISSING)
+        if entry is self._MISSING:
+            return default
+        self.size_bytes -= entry[2]
+        return entry[0]
+
+    def invalidate(self, predicate: Callable[[Hashable], bool]) -> int:
+        """Removes every entry whose key matches the predicate"""
+        keys = [key for key in self._entries if predicate(key)]
+        for key in keys:
+            self.pop(key)
+        return len(keys)
+
+    def clear(self):
+        self._entries.clear()
+        self.size_bytes = 0
+
+    def stats(self) -> Dict:
+        return {
+            'entries': len(self._entries),
+            'size_bytes': self.size_bytes,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+        }
+
+    def _evict(self):
+        while len(self._entries) > self.max_entries or (
+                self.max_bytes is not None and self.size_bytes > self.max_bytes
+        ):
+            _, (_, _, size) = self._entries.popitem(last=False)
+            self.size_bytes -= size
+            self.evictions += 1
+
+    def __contains__(self, key: Hashable) -> bool:
+        entry = self._entries.get(key, self._MISSING)
+        if entry is self._MISSING:
+            return False
+        expires_at = entry[1]
+        return expires_at is None or expires_at > time.monotonic()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+class PersistentLRUCache(LRUCache):
+    """
+    LRUCache whose entries survive restarts, stored as JSON in a file.
+    Keys must be strings and values JSON serializable. Entries do not expire,
+    so it is meant for mappings that never change
+    """
+    _instances: List['PersistentLRUCache'] = []
+
+    def __init__(self, path: str, max_entries: int = 1024, save_every: int = 50):
+        super().__init__(max_entries=max_entries)
+        self.path = path
+        self.save_every = save_every
+        self._unsaved_changes = 0
+        self.load()
+        PersistentLRUCache._instances.append(self)
+
+    def set(self, key: str, value: Any, ttl: Optional[float] = None, size: int = 0):
+        super().set(key, value, size=size)
+        self._unsaved_changes += 1
+        if self._unsaved_changes >= self.save_every:
+            self.save()
+
+    def pop(self, key: str, default: Any = None) -> Any:
+        if key in self._entries:
+            self._unsaved_changes += 1
+        return super().pop(key, default)
+
+    def load(self):
+        try:
+            with open(self.path) as cache_file:
+                entries = json.load(cache_file)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError):
+            log.warning(f'Could not load the cache file "{self.path}"', exc_info=True)
+            return
+        # Entries are stored from the least to the most recently used
+        for key, value in entries:
+            super().set(key, value)
+
+    def save(self):
+        entries = [[key, value] for key, (value, _, _) in self._entries.items()]
+        directory = os.path.dirname(self.path)
+        try:
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            temporary_path = f'{self.path}.tmp'
+            with open(temporary_path, 'w') as cache_file:
+                json.dump(entries, cache_file)
+            os.replace(temporary_path, self.path)
+        except OSError:
+            log.warning(f'Could not save the cache file "{self.path}"', exc_info=True)
+            return
+        self._unsaved_changes = 0
+
+    @classmethod
+    def save_all(cls):
+        """Saves every persistent cache with unsaved changes. Meant to be called on shutdown"""
+        for cache in cls._instances:
+            if cache._unsaved_changes:
+                cache.save()
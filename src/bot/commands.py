@@ -1,27 +1,31 @@
 import datetime
 import logging
+import time
 from collections import defaultdict, OrderedDict
-from typing import Dict, Optional, Tuple, Any, List
+from os import getenv
+from typing import Dict, Optional, Tuple, Any, List, Union
 
 from telegram import Update
 from telegram import User as TgUser
+from telegram.error import BadRequest
 from telegram.ext import CallbackContext, ContextTypes
 from telegram.ext import CallbackContext, ContextTypes
 
-from bot.api_client.api_client import APIClientException
+from bot.api_client.api_client import APIClientException, SpooledResponseFile
 from bot.api_client.lastfm_api_client import LastfmAPIClient
 from bot.api_client.spotify_api_client import SpotifyAPIClient
 from bot.api_client.telegram_api_client import TelegramAPIClient
 from bot.buttons import DeleteSavedLinkButton, UnfollowArtistButton
-from bot import emojis
+from bot.cache import LRUCache
 from bot.logger import LoggerMixin
 from bot.messages import UrlProcessor
-from bot.models import Link, SaveTelegramEntityMixin, Artist, Album, Track, \
+from bot.models import SaveTelegramEntityMixin, Artist, Album, Track, \
     User
 from bot.music.music import LinkType
 from bot.music.spotify import SpotifyUtils
+from bot.pagination import SentLinksPageView
+from bot.rendering import MessageBuilder, RowTemplate, escape, format_date, get_link_fields
 from bot.reply import ReplyMixin, ReplyType
-from bot.utils import OUTPUT_DATE_FORMAT
 
 log = logging.getLogger(__name__)
 
@@ -154,7 +158,7 @@ class Command(ReplyMixin, SaveTelegramEntityMixin, LoggerMixin):
     async def run(self):
         self.log_command(self.COMMAND, self.args, self.update)
         response, reply_markup = await self.get_response()
-        await self.reply(
+        return await self.reply(
             self.update,
             self.context,
             response,
@@ -172,6 +176,35 @@ class Command(ReplyMixin, SaveTelegramEntityMixin, LoggerMixin):
         raise NotImplementedError()
 
 
+class SentLinksPageMixin:
+    """
+    Shows the sent links in a single message, one page at a time,
+    with Prev/Next buttons that turn the pages editing the message
+    """
+    _page_view: Optional[SentLinksPageView] = None
+
+    async def run(self):
+        message = await super().run()
+        if self._page_view is not None and message is not None:
+            self._page_view.register(message.chat_id, message.message_id)
+        return message
+
+    async def _get_response(self) -> Tuple[Any, Optional[Any]]:
+        filters = self._get_sent_links_filters()
+        if filters is None:
+            return self.help_message, None
+        self._page_view = SentLinksPageView(filters, self._build_page_message)
+        return await self._page_view.get_page(0)
+
+    def _get_sent_links_filters(self) -> Optional[Dict]:
+        """Returns the filters of the sent links, or None if the command arguments are not valid"""
+        raise NotImplementedError()
+
+    @classmethod
+    def _build_page_message(cls, sent_links: List) -> MessageBuilder:
+        raise NotImplementedError()
+
+
 class StartCommand(Command):
     """
     Command /start
@@ -238,7 +271,7 @@ class HelpCommand(Command):
         return msg
 
 
-class MusicCommand(Command):
+class MusicCommand(SentLinksPageMixin, Command):
     """
     Command /music
     Gets the links sent by all the users of the chat in the last week
@@ -247,55 +280,28 @@ class MusicCommand(Command):
     COMMAND = 'music'
     DAYS = 7
     LAST_WEEK = datetime.datetime.now() - datetime.timedelta(days=DAYS)
+    USER_ROW = RowTemplate('- {emoji} <strong>{user}:</strong>')
+    LINK_ROW = RowTemplate('    {emoji} <a href="{url}">{name}</a> {genres}')
 
-    def __init__(self, update: Update, context: CallbackContext):
-        super().__init__(update, context)
-        self.telegram_api_client = TelegramAPIClient()
-
-    async def _get_response(self) -> Tuple[Any, Optional[Any]]:
+    def _get_sent_links_filters(self) -> Optional[Dict]:
+        filters = {'chat_id': self.update.message.chat_id, 'since_date': self.LAST_WEEK}
         if self.args:
-            links = self._get_links_from_user()
-        else:
-            links = self._get_links()
-        last_week_links = self._group_links_by_user(links)
-        return self._build_message(last_week_links), None
+            filters['user_username'] = self.args[0].replace('@', '')
+        return filters
 
-    @staticmethod
-    def _build_message(last_week_links) -> str:
-        msg = '<strong>Music from the last week:</strong> \n'
+    @classmethod
+    def _build_page_message(cls, sent_links: List) -> MessageBuilder:
+        return cls._build_message(cls._group_links_by_user(sent_links))
+
+    @classmethod
+    def _build_message(cls, last_week_links) -> MessageBuilder:
+        message = MessageBuilder('<strong>Music from the last week:</strong> ')
         for user, sent_links in last_week_links.items():
-            msg += '- {} <strong>{}:</strong>\n'.format(
-                User.EMOJI,
-                user
-            )
+            message.add_row(cls.USER_ROW, emoji=User.EMOJI, user=user)
             for sent_link in sent_links:
-                link = sent_link.get('link')
-                genres = Link.get_genres(link)
-                msg += '    {} <a href="{}">{}</a> {}\n'.format(
-                    emojis.get_music_emoji(link.get('link_type')),
-                    link.get('url'),
-                    Link.get_name(link),
-                    '({})'.format(', '.join(genres)) if genres else ''
-                )
-            msg += '\n'
-        return msg
-
-    def _get_links(self) -> List[Dict]:
-        links = self.telegram_api_client.get_sent_links(
-            chat_id=self.update.message.chat_id,
-            since_date=self.LAST_WEEK
-        )
-        return links
-
-    def _get_links_from_user(self) -> List[Dict]:
-        username = self.args[0]
-        username = username.replace('@', '')
-        links = self.telegram_api_client.get_sent_links(
-            chat_id=self.update.message.chat_id,
-            user_username=username,
-            since_date=self.LAST_WEEK
-        )
-        return links
+                message.add_row(cls.LINK_ROW, **get_link_fields(sent_link.get('link')))
+            message.add_line()
+        return message
 
     @staticmethod
     def _group_links_by_user(links) -> Dict:
@@ -308,52 +314,41 @@ class MusicCommand(Command):
         return dict(last_week_links)
 
 
-class MusicFromBeginningCommand(Command):
+class MusicFromBeginningCommand(SentLinksPageMixin, Command):
     """
     Command /music_from_beginning @username
     Gets the links sent by an specific username of the chat from the beginning
     """
     COMMAND = 'music_from_beginning'
+    USER_ROW = RowTemplate('- {emoji} <strong>{user}:</strong>')
+    LINK_ROW = RowTemplate('    {emoji}  [{date}] <a href="{url}">{name}</a> {genres}')
 
-    def __init__(self, update: Update, context: CallbackContext):
-        super().__init__(update, context)
-        self.telegram_api_client = TelegramAPIClient()
+    @property
+    def help_message(self) -> str:
+        return 'Command usage /music_from_beginning @username'
 
-    async def _get_response(self) -> Tuple[Any, Optional[Any]]:
-        if self.args:
-            links = self._get_links_from_user()
-            all_time_links = self._group_links_by_user(links)
-            return self._build_message(all_time_links), None
-        else:
-            msg = 'Command usage /music_from_beginning @username'
-            return msg, None
+    def _get_sent_links_filters(self) -> Optional[Dict]:
+        if not self.args:
+            return None
+        return {'chat_id': self.update.message.chat_id, 'user_username': self.args[0].replace('@', '')}
 
-    @staticmethod
-    def _build_message(all_time_links) -> str:
-        msg = '<strong>Music from the beginning of time:</strong> \n'
+    @classmethod
+    def _build_page_message(cls, sent_links: List) -> MessageBuilder:
+        return cls._build_message(cls._group_links_by_user(sent_links))
+
+    @classmethod
+    def _build_message(cls, all_time_links) -> MessageBuilder:
+        message = MessageBuilder('<strong>Music from the beginning of time:</strong> ')
         for user, sent_links in all_time_links.items():
-            msg += '- {} <strong>{}:</strong>\n'.format(User.EMOJI, user)
+            message.add_row(cls.USER_ROW, emoji=User.EMOJI, user=user)
             for sent_link in sent_links:
-                link = sent_link.get('link')
-                genres = Link.get_genres(link)
-                msg += '    {}  <a href="{}">{}</a> {}\n'.format(
-                    emojis.get_music_emoji(link.get('link_type')),
-                    f'[{datetime.datetime.fromisoformat(sent_link.get("sent_at")).strftime(OUTPUT_DATE_FORMAT)}]',
-                    link.get('url'),
-                    Link.get_name(link),
-                    '({})'.format(', '.join(genres)) if genres else ''
+                message.add_row(
+                    cls.LINK_ROW,
+                    date=format_date(sent_link.get('sent_at')),
+                    **get_link_fields(sent_link.get('link'))
                 )
-            msg += '\n'
-        return msg
-
-    def _get_links_from_user(self) -> List[Dict]:
-        username = self.args[0]
-        username = username.replace('@', '')
-        links = self.telegram_api_client.get_sent_links(
-            chat_id=self.update.message.chat_id,
-            user_username=username
-        )
-        return links
+            message.add_line()
+        return message
 
     @staticmethod
     def _group_links_by_user(links) -> Dict:
@@ -366,47 +361,33 @@ class MusicFromBeginningCommand(Command):
         return dict(all_time_links)
 
 
-class MyMusicCommand(Command):
+class MyMusicCommand(SentLinksPageMixin, Command):
     """
     Command /mymusic
     It can only be called from a private conversation
     Returns a list of the links sent by the caller user in all the chats from the beginning of time
     """
     COMMAND = 'mymusic'
+    LINK_ROW = RowTemplate('    {emoji}  [{date}@{chat}] <a href="{url}">{name}</a> {genres}')
 
-    def __init__(self, update: Update, context: CallbackContext):
-        super().__init__(update, context)
-        self.telegram_api_client = TelegramAPIClient()
+    def _get_sent_links_filters(self) -> Optional[Dict]:
+        return {'user_id': self.update.message.from_user.id}
 
-    async def _get_response(self) -> Tuple[Any, Optional[Any]]:
-        all_time_links = self._get_all_time_links_from_user()
-        return self._build_message(all_time_links), None
+    @classmethod
+    def _build_page_message(cls, sent_links: List) -> MessageBuilder:
+        return cls._build_message(sent_links)
 
-    @staticmethod
-    def _build_message(all_time_links) -> str:
-        msg = '<strong>Music sent in all your chats from the beginning of time:</strong> \n'
+    @classmethod
+    def _build_message(cls, all_time_links) -> MessageBuilder:
+        message = MessageBuilder('<strong>Music sent in all your chats from the beginning of time:</strong> ')
         for sent_link in all_time_links:
-            link = sent_link.get('link')
-            genres = Link.get_genres(link)
-            msg += '    {}  {} <a href="{}">{}</a> {}\n'.format(
-                emojis.get_music_emoji(link.get('type')),
-                '[{}@{}]'.format(
-                    datetime.datetime.fromisoformat(
-                        sent_link.get('sent_at')).strftime(OUTPUT_DATE_FORMAT),
-                    sent_link.get('chat').get('name')
-                ),
-                link.get('url'),
-                Link.get_name(link),
-                '({})'.format(', '.join(genres)) if genres else ''
+            message.add_row(
+                cls.LINK_ROW,
+                date=format_date(sent_link.get('sent_at')),
+                chat=sent_link.get('chat').get('name'),
+                **get_link_fields(sent_link.get('link'))
             )
-        msg += '\n'
-        return msg
-
-    def _get_all_time_links_from_user(self) -> List[Dict]:
-        links = self.telegram_api_client.get_sent_links(
-            user_id=self.update.message.from_user.id
-        )
-        return links
+        return message
 
 
 class NowPlayingCommand(Command):
@@ -423,7 +404,7 @@ class NowPlayingCommand(Command):
         self.spotify_api_client = SpotifyAPIClient()
 
     async def _get_response(self) -> Tuple[Any, Optional[Any]]:
-        now_playing_data = self.lastfm_api_client.get_now_playing(
+        now_playing_data = await self.lastfm_api_client.get_now_playing(
             self.update.message.from_user.id)
         msg = self._build_message(now_playing_data)
 
@@ -441,14 +422,14 @@ class NowPlayingCommand(Command):
             return f'There is no Last.fm username for your user. Please set your username with:\n' \
                    f'<i>/lastfmset username</i>'
         if not now_playing_data.get('is_playing_now'):
-            return f'<b>{lastfm_user.get("username")}</b> is not currently playing music'
+            return f'<b>{escape(lastfm_user.get("username"))}</b> is not currently playing music'
 
-        artist_name = now_playing_data.get('artist_name')
-        album_name = now_playing_data.get('album_name')
-        track_name = now_playing_data.get('track_name')
-        cover = now_playing_data.get('cover')
+        artist_name = escape(now_playing_data.get('artist_name'))
+        album_name = escape(now_playing_data.get('album_name'))
+        track_name = escape(now_playing_data.get('track_name'))
+        cover = escape(now_playing_data.get('cover'))
 
-        msg = f"<b>{lastfm_user.get('username')}</b>'s now playing:\n"
+        msg = f"<b>{escape(lastfm_user.get('username'))}</b>'s now playing:\n"
         msg += f"{Track.EMOJI} {track_name}\n"
         if album_name:
             msg += f"{Album.EMOJI} {album_name}\n"
@@ -459,7 +440,8 @@ class NowPlayingCommand(Command):
         return msg
 
     async def _save_link(self, url):
-        url_processor = UrlProcessor(self.update, self.context, url, self)
+        link = SpotifyUtils.parse_url(url)
+        url_processor = UrlProcessor(self.update, self.context, [link] if link else [], self)
         await url_processor.process()
 
 
@@ -470,6 +452,18 @@ class CollageCommand(Command):
     """
     COMMAND = 'collage'
 
+    # Telegram file ids of the sent collages, by (user, rows, cols, period, time bucket).
+    # Collages of longer periods change slower, so they are reused for longer
+    PERIOD_TIME_BUCKETS = {
+        LastfmAPIClient.PERIOD_7DAYS: 60 * 60,
+        LastfmAPIClient.PERIOD_1MONTH: 3 * 60 * 60,
+        LastfmAPIClient.PERIOD_3MONTHS: 6 * 60 * 60,
+        LastfmAPIClient.PERIOD_6MONTHS: 12 * 60 * 60,
+        LastfmAPIClient.PERIOD_12MONTHS: 24 * 60 * 60,
+        LastfmAPIClient.PERIOD_OVERALL: 24 * 60 * 60,
+    }
+    _collages = LRUCache(max_entries=int(getenv('COLLAGES_CACHE_SIZE', 5000)))
+
     def __init__(self, update, context):
         super().__init__(update, context)
         self.lastfm_api_client = LastfmAPIClient()
@@ -477,22 +471,61 @@ class CollageCommand(Command):
     async def run(self):
         """Need to override the method because the response type must be an Image"""
         self.log_command(self.COMMAND, self.args, self.update)
+        cache_key, time_bucket = self._get_cache_key()
+        if cache_key and await self._reply_cached_collage(cache_key):
+            return
         response, reply_markup = await self.get_response()
-        if type(response) == bytes:
+        if isinstance(response, SpooledResponseFile):
             # we have an image
-            await self.reply(self.update, self.context, message="", image=response,
-                       reply_type=ReplyType.IMAGE,
-                       disable_web_page_preview=not self.WEB_PAGE_PREVIEW,
-                       reply_markup=reply_markup)
+            with response:
+                message = await self.reply(self.update, self.context, message="", image=response,
+                                           reply_type=ReplyType.IMAGE,
+                                           disable_web_page_preview=not self.WEB_PAGE_PREVIEW,
+                                           reply_markup=reply_markup)
+            if cache_key and message and message.photo:
+                self._collages.set(cache_key, message.photo[-1].file_id, ttl=time_bucket)
         else:
             # we have an error message
             await self.reply(self.update, self.context, response,
                        disable_web_page_preview=not self.WEB_PAGE_PREVIEW,
                        reply_markup=reply_markup)
 
+    async def _reply_cached_collage(self, cache_key: Tuple) -> bool:
+        """Replies the collage already sent to Telegram, if any, without rendering nor uploading it again"""
+        file_id = self._collages.get(cache_key)
+        if not file_id:
+            return False
+        try:
+            await self.reply(self.update, self.context, message="", image=file_id,
+                             reply_type=ReplyType.IMAGE)
+        except BadRequest:
+            log.warning(f'Collage file id "{file_id}" rejected')
+            self._collages.pop(cache_key)
+            return False
+        return True
+
+    def _get_cache_key(self) -> Tuple[Optional[Tuple], Optional[float]]:
+        """
+        Returns the cache key of the requested collage and the seconds of its time bucket.
+        The key is None if the arguments are not valid
+        """
+        try:
+            rows = int(self.args[0]) if len(self.args) > 0 else 5
+            cols = int(self.args[1]) if len(self.args) > 1 else 5
+        except ValueError:
+            return None, None
+        period = self.args[2] if len(self.args) > 2 else LastfmAPIClient.PERIOD_7DAYS
+        time_bucket = self.PERIOD_TIME_BUCKETS.get(period)
+        if not time_bucket:
+            return None, None
+        # File ids are only reused within the same time bucket
+        now = time.time()
+        cache_key = (self.update.message.from_user.id, rows, cols, period, int(now // time_bucket))
+        return cache_key, time_bucket - now % time_bucket
+
     async def _get_response(self) -> Tuple[Any, Optional[Any]]:
         try:
-            collage_image_data = self.lastfm_api_client.get_collage(
+            collage_image_data = await self.lastfm_api_client.get_collage(
                 self.update.message.from_user.id, *self.args[0:3])
         except APIClientException:
             # TODO: Check if the APIClientException is a 404
@@ -520,6 +553,7 @@ class TopAlbumsCommand(Command):
     Gets the Last.fm top albums of the given user
     """
     COMMAND = 'topalbums'
+    ROW = RowTemplate('- {emoji} <strong>{artist}</strong> - <strong>{title}</strong>. {scrobbles} scrobbles')
 
     def __init__(self, update: Update, context: CallbackContext):
         super().__init__(update, context)
@@ -530,17 +564,17 @@ class TopAlbumsCommand(Command):
             period = self.args[0]
             if not period in self.lastfm_api_client.PERIODS:
                 return self.help_message, None
-            top_albums_data = self.lastfm_api_client.get_top_albums(
+            top_albums_data = await self.lastfm_api_client.get_top_albums(
                 user_id=self.update.message.from_user.id,
                 period=period
             )
         else:
-            top_albums_data = self.lastfm_api_client.get_top_albums(
+            top_albums_data = await self.lastfm_api_client.get_top_albums(
                 user_id=self.update.message.from_user.id)
         return self._build_message(top_albums_data), None
 
-    @staticmethod
-    def _build_message(top_albums_data: Dict) -> str:
+    @classmethod
+    def _build_message(cls, top_albums_data: Dict) -> Union[str, MessageBuilder]:
         lastfm_user = top_albums_data.get('lastfm_user')
         if not lastfm_user or not lastfm_user.get('username'):
             return f'There is no Last.fm username for your user. Please set your username with:\n' \
@@ -548,10 +582,18 @@ class TopAlbumsCommand(Command):
         top_albums = top_albums_data.get('top_albums', [])
         if not top_albums:
             return "You have not top albums"
-        msg = f"<strong>{lastfm_user.get('username')}</strong>'s top albums of the period: \n"
+        message = MessageBuilder(
+            f"<strong>{escape(lastfm_user.get('username'))}</strong>'s top albums of the period: "
+        )
         for album in top_albums[:10]:
-            msg += f"- {Album.EMOJI} <strong>{album['artist']}</strong> - <strong>{album['title']}</strong>. {album['scrobbles']} scrobbles\n"
-        return msg
+            message.add_row(
+                cls.ROW,
+                emoji=Album.EMOJI,
+                artist=album['artist'],
+                title=album['title'],
+                scrobbles=album['scrobbles']
+            )
+        return message
 
     @property
     def help_message(self) -> str:
@@ -564,6 +606,7 @@ class TopArtistsCommand(Command):
     Gets the Last.fm top artists of the given user
     """
     COMMAND = 'topartists'
+    ROW = RowTemplate('- {emoji} <strong>{name}</strong>. {scrobbles} scrobbles')
 
     def __init__(self, update: Update, context: CallbackContext):
         super().__init__(update, context)
@@ -574,17 +617,17 @@ class TopArtistsCommand(Command):
             period = self.args[0]
             if period not in self.lastfm_api_client.PERIODS:
                 return self.help_message, None
-            top_artists_data = self.lastfm_api_client.get_top_artists(
+            top_artists_data = await self.lastfm_api_client.get_top_artists(
                 user_id=self.update.message.from_user.id,
                 period=period
             )
         else:
-            top_artists_data = self.lastfm_api_client.get_top_artists(
+            top_artists_data = await self.lastfm_api_client.get_top_artists(
                 user_id=self.update.message.from_user.id)
         return self._build_message(top_artists_data), None
 
-    @staticmethod
-    def _build_message(top_artists_data: Dict) -> str:
+    @classmethod
+    def _build_message(cls, top_artists_data: Dict) -> Union[str, MessageBuilder]:
         lastfm_user = top_artists_data.get('lastfm_user')
         if not lastfm_user or not lastfm_user.get('username'):
             return f'There is no Last.fm username for your user. Please set your username with:\n' \
@@ -592,10 +635,17 @@ class TopArtistsCommand(Command):
         top_artists = top_artists_data.get('top_artists', [])
         if not top_artists:
             return "You have not top artists"
-        msg = f"<strong>{lastfm_user.get('username')}</strong>'s top artists of the period: \n"
+        message = MessageBuilder(
+            f"<strong>{escape(lastfm_user.get('username'))}</strong>'s top artists of the period: "
+        )
         for artist in top_artists[:10]:
-            msg += f"- {Artist.EMOJI} <strong>{artist['name']}</strong>. {artist['scrobbles']} scrobbles\n"
-        return msg
+            message.add_row(
+                cls.ROW,
+                emoji=Artist.EMOJI,
+                name=artist['name'],
+                scrobbles=artist['scrobbles']
+            )
+        return message
 
     @property
     def help_message(self) -> str:
@@ -608,6 +658,7 @@ class TopTracksCommand(Command):
     Gets the Last.fm top albums of the given user
     """
     COMMAND = 'toptracks'
+    ROW = RowTemplate('- {emoji} <strong>{artist}</strong> - <strong>{title}</strong>. {scrobbles} scrobbles')
 
     def __init__(self, update: Update, context: CallbackContext):
         super().__init__(update, context)
@@ -618,17 +669,17 @@ class TopTracksCommand(Command):
             period = self.args[0]
             if period not in self.lastfm_api_client.PERIODS:
                 return self.help_message, None
-            top_tracks_data = self.lastfm_api_client.get_top_tracks(
+            top_tracks_data = await self.lastfm_api_client.get_top_tracks(
                 user_id=self.update.message.from_user.id,
                 period=period
             )
         else:
-            top_tracks_data = self.lastfm_api_client.get_top_tracks(
+            top_tracks_data = await self.lastfm_api_client.get_top_tracks(
                 user_id=self.update.message.from_user.id)
         return self._build_message(top_tracks_data), None
 
-    @staticmethod
-    def _build_message(top_tracks_data: Dict) -> str:
+    @classmethod
+    def _build_message(cls, top_tracks_data: Dict) -> Union[str, MessageBuilder]:
         lastfm_user = top_tracks_data.get('lastfm_user')
         if not lastfm_user or not lastfm_user.get('username'):
             return f'There is no Last.fm username for your user. Please set your username with:\n' \
@@ -636,10 +687,18 @@ class TopTracksCommand(Command):
         top_tracks = top_tracks_data.get('top_tracks', [])
         if not top_tracks:
             return "You have not top tracks"
-        msg = f"<strong>{lastfm_user.get('username')}</strong>'s top tracks of the period: \n"
+        message = MessageBuilder(
+            f"<strong>{escape(lastfm_user.get('username'))}</strong>'s top tracks of the period: "
+        )
         for track in top_tracks[:10]:
-            msg += f"- {Album.EMOJI} <strong>{track['artist']}</strong> - <strong>{track['title']}</strong>. {track['scrobbles']} scrobbles\n"
-        return msg
+            message.add_row(
+                cls.ROW,
+                emoji=Album.EMOJI,
+                artist=track['artist'],
+                title=track['title'],
+                scrobbles=track['scrobbles']
+            )
+        return message
 
     @property
     def help_message(self) -> str:
@@ -663,24 +722,27 @@ class LastFMSetCommand(Command):
         return 'Command usage: /lastfmset username'
 
     async def _get_response(self) -> Tuple[Any, Optional[Any]]:
-        lastfm_username = self._set_lastfm_username(
+        lastfm_username = await self._set_lastfm_username(
             self.update.message.from_user)
         return self._build_message(lastfm_username), None
 
-    def _set_lastfm_username(self, user: TgUser) -> Optional[str]:
+    async def _set_lastfm_username(self, user: TgUser) -> Optional[str]:
         if not self.args:
             return None
         username = self.args[0]
         username = username.replace('@', '')
-        user = self.telegram_api_client.create_user(user)
-        lastfm_user = self.lastfm_api_client.set_lastfm_user(user.get('id'),
+        user = await self.save_user(user)
+        lastfm_user = await self.lastfm_api_client.set_lastfm_user(user.get('id'),
                                                              username)
+        # The collages of the previous Last.fm username are not valid anymore
+        telegram_id = self.update.message.from_user.id
+        CollageCommand._collages.invalidate(lambda key: key[0] == telegram_id)
         return lastfm_user.get('username')
 
     def _build_message(self, lastfm_username: str) -> str:
         if not lastfm_username:
             return self.help_message
-        return f"<strong>{lastfm_username}</strong>'s Last.fm username set correctly"
+        return f"<strong>{escape(lastfm_username)}</strong>'s Last.fm username set correctly"
 
 
 class SavedLinksCommand(Command):
@@ -689,29 +751,30 @@ class SavedLinksCommand(Command):
     Shows a list of the links that the user saved
     """
     COMMAND = 'savedlinks'
+    LINK_ROW = RowTemplate('- {emoji} <a href="{url}">{name}</a> ({genre_names}). Saved at: {date}')
 
     def __init__(self, update: Update, context: CallbackContext):
         super().__init__(update, context)
         self.spotify_api_client = SpotifyAPIClient()
 
     async def _get_response(self) -> Tuple[Any, Optional[Any]]:
-        saved_links_response = self.spotify_api_client.get_saved_links(
+        saved_links_response = await self.spotify_api_client.get_saved_links(
             self.update.message.from_user.id)
         return self._build_message(saved_links_response), None
 
-    @staticmethod
-    def _build_message(saved_links_response: {}) -> str:
+    @classmethod
+    def _build_message(cls, saved_links_response: {}) -> Union[str, MessageBuilder]:
         if not saved_links_response:
             return 'You have not saved links'
 
-        msg = '<strong>Saved links:</strong> \n'
+        message = MessageBuilder('<strong>Saved links:</strong> ')
         for saved_link in saved_links_response:
-            link = saved_link.get('link')
-            genres = Link.get_genres(link)
-            msg += f'- {emojis.get_music_emoji(link.get("link_type"))} <a href="{link.get("url")}">{Link.get_name(link)}</a> ' \
-                   f'({", ".join(genres) if genres else ""}). ' \
-                   f'Saved at: {datetime.datetime.fromisoformat(saved_link.get("saved_at")).strftime(OUTPUT_DATE_FORMAT)}\n'
-        return msg
+            message.add_row(
+                cls.LINK_ROW,
+                date=format_date(saved_link.get('saved_at')),
+                **get_link_fields(saved_link.get('link'))
+            )
+        return message
 
 
 class DeleteSavedLinksCommand(Command):
@@ -727,13 +790,13 @@ class DeleteSavedLinksCommand(Command):
         self.spotify_api_client = SpotifyAPIClient()
 
     async def _get_response(self) -> Tuple[Any, Optional[Any]]:
-        keyboard = self._build_keyboard()
+        keyboard = await self._build_keyboard()
         if not keyboard:
             return 'You have not saved links', None
         return 'Choose a saved link to delete:', keyboard
 
-    def _build_keyboard(self):
-        saved_links_response = self.spotify_api_client.get_saved_links(
+    async def _build_keyboard(self):
+        saved_links_response = await self.spotify_api_client.get_saved_links(
             self.update.message.from_user.id)
         if not saved_links_response:
             return None
@@ -753,6 +816,7 @@ class FollowedArtistsCommand(FollowArtistMixin, Command):
     Shows a list of the followed artists the request's user
     """
     COMMAND = 'followedartists'
+    ARTIST_ROW = RowTemplate('- {emoji} <a href="{url}">{name}</a> Followed at: {date}')
 
     def __init__(self, update: Update, context: CallbackContext):
         super().__init__(update, context)
@@ -760,21 +824,25 @@ class FollowedArtistsCommand(FollowArtistMixin, Command):
         self.spotify_api_client = SpotifyAPIClient()
 
     async def _get_response(self) -> Tuple[Any, Optional[Any]]:
-        followed_artists_response = self.spotify_api_client.get_followed_artists(
+        followed_artists_response = await self.spotify_api_client.get_followed_artists(
             self.update.message.from_user.id)
         return self._build_message(followed_artists_response), None
 
-    def _build_message(self, followed_artists_response) -> str:
+    def _build_message(self, followed_artists_response) -> Union[str, MessageBuilder]:
         if not followed_artists_response:
             return self.not_following_any_artist_message
 
-        msg = '<strong>Following artists:</strong> \n'
+        message = MessageBuilder('<strong>Following artists:</strong> ')
         for followed_artist in followed_artists_response:
             artist = followed_artist.get('artist')
-            msg += f'- {Artist.EMOJI} ' \
-                   f'<a href="{artist.get("url")}">{artist.get("name")}</a> ' \
-                   f'Followed at: {datetime.datetime.fromisoformat(followed_artist.get("followed_at")).strftime(OUTPUT_DATE_FORMAT)}\n'
-        return msg
+            message.add_row(
+                self.ARTIST_ROW,
+                emoji=Artist.EMOJI,
+                url=artist.get('url'),
+                name=artist.get('name'),
+                date=format_date(followed_artist.get('followed_at'))
+            )
+        return message
 
 
 class FollowArtistCommand(Command):
@@ -794,34 +862,30 @@ class FollowArtistCommand(Command):
             return self.help_message, None
         url = self.args[0]
         try:
-            spotify_artist_id = self._extract_artist_id_from_url(url)
+            spotify_artist_id = await self._extract_artist_id_from_url(url)
         except ValueError:
             log.warning('Error trying to process artist url')
             return self.error_invalid_link_message, None
-        user = self.save_user(self.update.message.from_user)
-        artist = self.spotify_api_client.get_artist(spotify_artist_id)
+        user = await self.save_user(self.update.message.from_user)
+        artist = await self.spotify_api_client.get_artist(spotify_artist_id)
         try:
-            followed_artist_response = self.spotify_api_client.create_followed_artist(
+            followed_artist_response = await self.spotify_api_client.create_followed_artist(
                 artist.get('id'), user.get('id'))
         except APIClientException as e:
-            response = e.args[0].response
-            if response.status_code == 400 and "unique" in response.text:
+            if e.status_code == 400 and "unique" in e.text:
                 return self.already_following_this_artist_message, None
             raise e
         return self._build_message(followed_artist_response), None
 
-    def _extract_artist_id_from_url(self, url: str) -> str:
-        url = self._url_cleaning_and_validations(url)
-        return SpotifyUtils.get_entity_id_from_url(url)
-
     @staticmethod
-    def _url_cleaning_and_validations(url: str) -> str:
-        if not SpotifyUtils.is_valid_url(url):
+    async def _extract_artist_id_from_url(url: str) -> str:
+        link = SpotifyUtils.parse_url(url)
+        if link is None:
             raise ValueError
-        if SpotifyUtils.get_link_type_from_url(url) != LinkType.ARTIST.value:
+        link = await SpotifyUtils.resolve_link(link)
+        if link is None or link.link_type != LinkType.ARTIST.value:
             raise ValueError
-        cleaned_url = SpotifyUtils.clean_url(url)
-        return cleaned_url
+        return link.entity_id
 
     @property
     def already_following_this_artist_message(self) -> str:
@@ -838,7 +902,7 @@ class FollowArtistCommand(Command):
     @staticmethod
     def _build_message(followed_artist_response: OrderedDict) -> str:
         artist = followed_artist_response.get('artist')
-        msg = f'<strong>Followed artist:</strong> {artist.get("name")}. \n'
+        msg = f'<strong>Followed artist:</strong> {escape(artist.get("name"))}. \n'
         msg += 'You will be aware of it\'s albums releases'
         return msg
 
@@ -855,13 +919,13 @@ class UnfollowArtistsCommand(FollowArtistMixin, Command):
         self.spotify_api_client = SpotifyAPIClient()
 
     async def _get_response(self) -> Tuple[Any, Optional[Any]]:
-        keyboard = self._build_keyboard()
+        keyboard = await self._build_keyboard()
         if not keyboard:
             return self.not_following_any_artist_message, None
         return 'Choose an artist to unfollow:', keyboard
 
-    def _build_keyboard(self):
-        followed_artists = self.spotify_api_client.get_followed_artists(
+    async def _build_keyboard(self):
+        followed_artists = await self.spotify_api_client.get_followed_artists(
             self.update.message.from_user.id)
         if not followed_artists:
             return None
@@ -874,27 +938,33 @@ class CheckArtistsNewMusicReleasesCommand(FollowArtistMixin, Command):
     Shows a list of buttons with followed artists for checking their new album releases when clicking
     """
     COMMAND = 'checkartistsnewmusicreleases'
+    ALBUM_ROW = RowTemplate('    - <a href="{url}">{artist} - {name} ({album_type})</a> Released at: {date} ')
 
     def __init__(self, update: Update, context: CallbackContext):
         super().__init__(update, context)
         self.spotify_api_client = SpotifyAPIClient()
 
     async def _get_response(self) -> Tuple[Any, Optional[Any]]:
-        new_music_releases_response = self.spotify_api_client.check_new_music_releases(
+        new_music_releases_response = await self.spotify_api_client.check_new_music_releases(
             self.update.message.from_user.id)
         if not new_music_releases_response:
             return self.no_new_music_message, None
         message = self._build_message(new_music_releases_response), None
         return message
 
-    @staticmethod
-    def _build_message(new_music_releases_response: List) -> str:
-        msg = 'Found new music: \n'
+    @classmethod
+    def _build_message(cls, new_music_releases_response: List) -> MessageBuilder:
+        message = MessageBuilder('Found new music: ')
         for new_album in new_music_releases_response:
-            new_album_first_artist = new_album.get('artists')[0]
-            msg += f'    - <a href="{new_album.get("url")}">{new_album_first_artist.get("name")} - {new_album.get("name")} ({new_album.get("album_type")})</a> ' \
-                   f'Released at: {datetime.datetime.fromisoformat(new_album.get("release_date")).strftime(OUTPUT_DATE_FORMAT)} \n'
-        return msg
+            message.add_row(
+                cls.ALBUM_ROW,
+                url=new_album.get('url'),
+                artist=new_album.get('artists')[0].get('name'),
+                name=new_album.get('name'),
+                album_type=new_album.get('album_type'),
+                date=format_date(new_album.get('release_date'))
+            )
+        return message
 
     @property
     def no_new_music_message(self) -> str:
@@ -907,25 +977,29 @@ class StatsCommand(Command):
     Shows the links sent count for every user in the current chat
     """
     COMMAND = 'stats'
+    USER_ROW = RowTemplate('- {emoji} <strong>{user}:</strong> {count}')
+    GENRES_ROW = RowTemplate(' <strong>Most sent genres:</strong> {genres}')
 
     def __init__(self, update: Update, context: CallbackContext):
         super().__init__(update, context)
         self.telegram_api_client = TelegramAPIClient()
 
     async def _get_response(self) -> Tuple[Any, Optional[Any]]:
-        stats = self.telegram_api_client.get_stats(self.update.message.chat_id)
+        stats = await self.telegram_api_client.get_stats(self.update.message.chat_id)
         return self._build_message(stats), None
 
-    @staticmethod
-    def _build_message(stats: Dict) -> str:
-        msg = '<strong>Links sent by the users from the beginning in this chat:</strong> \n'
+    @classmethod
+    def _build_message(cls, stats: Dict) -> MessageBuilder:
+        message = MessageBuilder('<strong>Links sent by the users from the beginning in this chat:</strong> ')
         users = stats.get('users_with_chat_link_count', [])
         most_sent_genres = stats.get('most_sent_genres', [])
         for user in users:
-            msg += '- {} <strong>{}:</strong> {}\n'.format(
-                User.EMOJI,
-                user.get('username') or user.get('first_name'),
-                user.get('sent_links_chat__count')
+            message.add_row(
+                cls.USER_ROW,
+                emoji=User.EMOJI,
+                user=user.get('username') or user.get('first_name'),
+                count=user.get('sent_links_chat__count')
             )
-        msg += f'\n <strong>Most sent genres:</strong> {", ".join(most_sent_genres)}'
-        return msg
+        message.add_line()
+        message.add_row(cls.GENRES_ROW, genres=', '.join(most_sent_genres))
+        return message
@@ -0,0 +1,119 @@
+import asyncio
+import functools
+import logging
+import time
+from contextlib import asynccontextmanager
+from os import getenv
+from typing import Any, Awaitable, Callable, Dict, Hashable, Iterable, List, Optional
+
+from telegram import Update
+from telegram.ext import Application
+
+from bot.metrics import metrics
+
+log = logging.getLogger(__name__)
+
+
+class _ConcurrencyClass:
+
+    def __init__(self, name: str, max_concurrency: int):
+        self.name = name
+        self.max_concurrency = max_concurrency
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self.queued = 0
+        self.running = 0
+
+    @property
+    def semaphore(self) -> asyncio.Semaphore:
+        # Created on first use, inside the loop of the bot,
+        # as on Python 3.9 it binds to the loop that is current when it is created
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        return self._semaphore
+
+    def update_gauges(self):
+        metrics.set_gauge(f'update_executor.{self.name}.queued', self.queued)
+        metrics.set_gauge(f'update_executor.{self.name}.running', self.running)
+
+
+class UpdateExecutor:
+    """
+    Runs the handlers of the updates one at a time per chat, in the order the updates arrive,
+    so the replies of a chat keep its order, and caps how many handlers run at the same time.
+    Heavy handlers have their own, smaller cap, so they can not take the place of the cheap ones.
+    The handlers of the updates without a chat, like the inline queries, are only capped
+    """
+    MAX_CONCURRENCY = int(getenv('HANDLERS_MAX_CONCURRENCY', 64))
+    HEAVY_MAX_CONCURRENCY = int(getenv('HEAVY_HANDLERS_MAX_CONCURRENCY', 4))
+
+    def __init__(self, max_concurrency: int = MAX_CONCURRENCY, heavy_max_concurrency: int = HEAVY_MAX_CONCURRENCY):
+        self._light = _ConcurrencyClass('light', max_concurrency)
+        self._heavy = _ConcurrencyClass('heavy', heavy_max_concurrency)
+        # Lock of every chat with handlers running or waiting, and how many of them there are
+        self._chats: Dict[Hashable, List] = {}
+
+    def wrap(self, callback: Callable[[Update, Any], Awaitable], heavy: bool = False) -> Callable:
+        """Returns the handler callback that runs `callback` in the executor"""
+        concurrency_class = self._heavy if heavy else self._light
+
+        @functools.wraps(callback)
+        async def run(update: object, context: Any):
+            chat = update.effective_chat if isinstance(update, Update) else None
+            return await self.run(concurrency_class, chat.id if chat else None, lambda: callback(update, context))
+
+        return run
+
+    def install(self, application: Application, heavy_callbacks: Iterable[Callable] = ()):
+        """Runs the callbacks of every handler of the application in the executor"""
+        heavy_callbacks = set(heavy_callbacks)
+        for handlers in application.handlers.values():
+            for handler in handlers:
+                handler.callback = self.wrap(handler.callback, heavy=handler.callback in heavy_callbacks)
+
+    async def run(self, concurrency_class: _ConcurrencyClass, chat_id: Optional[Hashable],
+                  callback: Callable[[], Awaitable]) -> Any:
+        start = time.monotonic()
+        concurrency_class.queued += 1
+        concurrency_class.update_gauges()
+        is_queued = True
+        try:
+            # The chat turn is taken before the slot. The handlers after a heavy one in its chat wait
+            # for it anyway to keep their order, and the handlers waiting for their turn do not hold
+            # the slots that the other chats could use
+            async with self._chat_turn(chat_id), concurrency_class.semaphore:
+                concurrency_class.queued -= 1
+                concurrency_class.running += 1
+                is_queued = False
+                concurrency_class.update_gauges()
+                metrics.observe(f'update_executor.{concurrency_class.name}.wait', time.monotonic() - start)
+                try:
+                    return await callback()
+                finally:
+                    concurrency_class.running -= 1
+                    concurrency_class.update_gauges()
+        finally:
+            if is_queued:
+                # Cancelled while it was waiting
+                concurrency_class.queued -= 1
+                concurrency_class.update_gauges()
+
+    @asynccontextmanager
+    async def _chat_turn(self, chat_id: Optional[Hashable]):
+        """Waits for the previous handlers of the chat, as the lock lets its waiters in in order"""
+        if chat_id is None:
+            yield
+            return
+        chat = self._chats.get(chat_id)
+        if chat is None:
+            chat = self._chats[chat_id] = [asyncio.Lock(), 0]
+        chat[1] += 1
+        try:
+            async with chat[0]:
+                yield
+        finally:
+            chat[1] -= 1
+            if chat[1] == 0:
+                del self._chats[chat_id]
+
+
+update_executor = UpdateExecutor()
@@ -1,17 +1,24 @@
+import asyncio
 import logging
-import re
 from collections import OrderedDict
+from os import getenv
+from typing import List, Set
 
 from telegram import Update
 from telegram.ext import ContextTypes
 
 from bot import emojis
+from bot.autocomplete import autocomplete_index, get_link_entry
 from bot.buttons import SaveLinkButton
+from bot.cache import LRUCache
 from bot.logger import LoggerMixin
 from bot.models import Link, SaveTelegramEntityMixin, Album, Artist, Track
 from bot.music.music import LinkType
-from bot.music.spotify import SpotifyUtils
+from bot.music.spotify import SpotifyLink, SpotifyUtils
+from bot.pipeline import Pipeline
+from bot.rendering import escape
 from bot.reply import ReplyMixin, ReplyType
+from bot.search import SearchInline
 
 log = logging.getLogger(__name__)
 
@@ -23,9 +30,9 @@ class MessageProcessor:
         if not update.message:
             return
         message = update.message.text
-        url = UrlProcessor.extract_url_from_message(message)
-        if url:
-            url_processor = UrlProcessor(update, context, url)
+        links = UrlProcessor.extract_links_from_message(message)
+        if links:
+            url_processor = UrlProcessor(update, context, links)
             await url_processor.process()
 
 
@@ -35,60 +42,115 @@ class UrlProcessor(
     SpotifyUtils,
     SaveTelegramEntityMixin
 ):
+    # Max links of a message that are processed, and how many of them at the same time
+    MAX_LINKS_PER_MESSAGE = 20
+    MAX_CONCURRENT_LINKS = 5
 
-    def __init__(self, update, context, url, command=None):
+    # Links sent in a chat in the last DUPLICATE_LINK_WINDOW seconds, by (chat id, link url).
+    # When they are sent again, the reply is built from the previous sent link without waiting
+    # for the backend. The sent link is still created with the same request, in the background
+    DUPLICATE_LINK_WINDOW = int(getenv('DUPLICATE_LINK_WINDOW', 10 * 60))
+    _recent_links = LRUCache(max_entries=int(getenv('RECENT_LINKS_MAX_ENTRIES', 5000)), ttl=DUPLICATE_LINK_WINDOW)
+    _background_tasks: Set[asyncio.Task] = set()
+
+    def __init__(self, update, context, links: List[SpotifyLink], command=None):
         self.update = update
         self.context = context
-        self.url = url
+        self.links = links
         self.command = command
 
     async def process(self):
-        is_valid = self.is_valid_url(self.url)
-        self.log_url_processing(self.url, is_valid, self.update)
+        is_valid = bool(self.links)
+        self.log_url_processing(', '.join(link.url for link in self.links), is_valid, self.update)
         if is_valid:
-            cleaned_url = self.clean_url(self.url)
-            user = await self.save_user(self.update.message.from_user)
-            chat = await self.save_chat(self.update.message.chat)
-            sent_link = await self.save_link(
-                cleaned_url,
-                user.get('id'),
-                chat.get('id')
-            )
-            return await self._build_message(sent_link)
+            pipeline = self._build_pipeline()
+            await pipeline.run()
+            log.debug(f'URLs: "{len(self.links)}". Timings: {pipeline.timings}')
+
+    def _build_pipeline(self) -> Pipeline:
+        """
+        Link ingest steps. Saving the user and the chat and resolving the links
+        do not depend on each other, so they run concurrently.
+        The links of the message are resolved and saved concurrently too, with a limit
+        """
+        message = self.update.message
+        semaphore = asyncio.Semaphore(self.MAX_CONCURRENT_LINKS)
+        repeated_links = set()
+
+        async def resolve_link(link):
+            async with semaphore:
+                return await self.resolve_link(link)
+
+        async def save_link(link, user, chat):
+            recent_link_key = (message.chat_id, link.url)
+            recent_sent_link = self._recent_links.get(recent_link_key)
+            if recent_sent_link is not None:
+                repeated_links.add(link)
+                self._run_in_background(self.save_link(link.url, user.get('id'), chat.get('id')))
+                return recent_sent_link
+            async with semaphore:
+                # Links of chosen inline results can have their entity being created
+                await SearchInline.wait_for_prefetch(link.link_type, link.entity_id)
+                sent_link = await self.save_link(link.url, user.get('id'), chat.get('id'))
+            if self.DUPLICATE_LINK_WINDOW:
+                self._recent_links.set(recent_link_key, sent_link)
+            return sent_link
+
+        async def resolve_links():
+            resolved_links = await self._gather_successful(*(resolve_link(link) for link in self.links))
+            # Different shortcuts can point to the same link.
+            # Shortcuts that do not point to an artist, an album or a track are skipped
+            return list(OrderedDict.fromkeys(link for link in resolved_links if link is not None))
+
+        async def save_user():
+            return await self.save_user(message.from_user)
+
+        async def save_chat():
+            return await self.save_chat(message.chat)
+
+        async def save_links(links, user, chat):
+            sent_links = await self._gather_successful(*(save_link(link, user, chat) for link in links))
+            for sent_link in sent_links:
+                entry = get_link_entry(sent_link.get('link') or {})
+                if entry is not None:
+                    autocomplete_index.add(entry)
+            return sent_links
 
-    async def _build_message(self, sent_link: OrderedDict):
+        async def reply(sent_links):
+            if len(sent_links) == 1:
+                # The audio preview of a repeated link was already sent to the chat a while ago
+                return await self._build_message(sent_links[0], send_preview=not repeated_links)
+            if sent_links:
+                return await self._build_multiple_links_message(sent_links)
+
+        return Pipeline('url_processor').add_step(
+            'links', resolve_links
+        ).add_step(
+            'user', save_user
+        ).add_step(
+            'chat', save_chat
+        ).add_step(
+            'sent_links', save_links, depends_on=('links', 'user', 'chat')
+        ).add_step(
+            'reply', reply, depends_on=('sent_links',)
+        )
+
+    async def _build_message(self, sent_link: OrderedDict, send_preview: bool = True):
         from bot.commands import NowPlayingCommand
         msg = '<strong>Saved: </strong>'
         link = sent_link.get('link')
-        genres = ', '.join(Link.get_genres(link))
-
-        if link.get('link_type') == LinkType.ARTIST.value:
-            msg += '{} <strong>{}</strong>\n'.format(
-                Artist.EMOJI,
-                link.get('artist').get('name')
-            )
-        elif link.get('link_type') == LinkType.ALBUM.value:
-            msg += '{} <strong>{}</strong> - <strong>{}</strong>\n'.format(
-                Album.EMOJI,
-                link.get('album').get('artists')[0].get('name'),
-                link.get('album').get('name')
-            )
-        elif link.get('link_type') == LinkType.TRACK.value:
-            msg += '{} {} by <strong>{}</strong>\n'.format(
-                Track.EMOJI,
-                link.get('track').get('name'),
-                link.get('track').get('artists')[0].get('name'),
-            )
+        genres = escape(', '.join(Link.get_genres(link)))
+        msg += self._build_link_description(link)
         # Only show the link if the processed url comes from a /np command
         if isinstance(self.command, NowPlayingCommand):
-            msg += f'{link.get("url")} \n'
+            msg += f'{escape(link.get("url"))} \n'
 
         msg += '<strong>Genres:</strong> {}'.format(
             genres if genres else 'N/A')
         save_link_button_keyboard_markup = SaveLinkButton.get_keyboard_markup(
             link.get('id'))
         preview_track = sent_link.get('spotify_preview_track', None)
-        if preview_track and preview_track.get('preview_url'):
+        if send_preview and preview_track and preview_track.get('preview_url'):
             performer = preview_track.get('artists')[0].get('name', 'unknown')
             title = preview_track.get('name', 'unknown')
             await self.reply(
@@ -109,11 +171,74 @@ class UrlProcessor(
                 reply_markup=save_link_button_keyboard_markup
             )
 
+    async def _build_multiple_links_message(self, sent_links: List[OrderedDict]):
+        """A single reply for all the links of a message, without audio previews"""
+        msg = '<strong>Saved:</strong>\n'
+        links = [sent_link.get('link') for sent_link in sent_links]
+        for link in links:
+            genres = escape(', '.join(Link.get_genres(link)))
+            msg += self._build_link_description(link).rstrip('\n')
+            msg += ' ({})\n'.format(genres) if genres else '\n'
+        await self.reply(
+            self.update,
+            self.context,
+            msg,
+            reply_markup=SaveLinkButton.get_links_keyboard_markup(links),
+            disable_web_page_preview=True
+        )
+
     @staticmethod
-    def extract_url_from_message(text):
-        """Gets the first url of a message"""
-        link = re.search("(?P<url>https?://[^\s]+)", text)
-        if link is not None:
-            url = link.group('url')
-            return url
+    def _build_link_description(link: OrderedDict) -> str:
+        """The emoji and the escaped names of the link"""
+        if link.get('link_type') == LinkType.ARTIST.value:
+            return '{} <strong>{}</strong>\n'.format(
+                Artist.EMOJI,
+                escape(link.get('artist').get('name'))
+            )
+        elif link.get('link_type') == LinkType.ALBUM.value:
+            return '{} <strong>{}</strong> - <strong>{}</strong>\n'.format(
+                Album.EMOJI,
+                escape(link.get('album').get('artists')[0].get('name')),
+                escape(link.get('album').get('name'))
+            )
+        elif link.get('link_type') == LinkType.TRACK.value:
+            return '{} {} by <strong>{}</strong>\n'.format(
+                Track.EMOJI,
+                escape(link.get('track').get('name')),
+                escape(link.get('track').get('artists')[0].get('name')),
+            )
         return ''
+
+    @classmethod
+    def extract_links_from_message(cls, text: str) -> List[SpotifyLink]:
+        """Gets the Spotify links of a message, without duplicates"""
+        links = OrderedDict.fromkeys(cls.find_links(text))
+        return list(links)[:cls.MAX_LINKS_PER_MESSAGE]
+
+    @classmethod
+    def _run_in_background(cls, coroutine):
+        """Runs a coroutine without waiting for it, logging its errors"""
+        task = asyncio.ensure_future(coroutine)
+        # The event loop only keeps weak references to the tasks
+        cls._background_tasks.add(task)
+        task.add_done_callback(cls._on_background_task_done)
+
+    @classmethod
+    def _on_background_task_done(cls, task: asyncio.Task):
+        cls._background_tasks.discard(task)
+        if not task.cancelled() and task.exception():
+            log.error('Error in a background task', exc_info=task.exception())
+
+    @staticmethod
+    async def _gather_successful(*coroutines) -> List:
+        """
+        Runs the coroutines concurrently and returns the results of the successful ones,
+        so a failing link does not prevent the others from being processed
+        """
+        results = []
+        for result in await asyncio.gather(*coroutines, return_exceptions=True):
+            if isinstance(result, Exception):
+                log.error('Error processing a link', exc_info=result)
+            else:
+                results.append(result)
+        return results
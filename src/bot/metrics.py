@@ -0,0 +1,76 @@
+import asyncio
+import json
+import logging
+from collections import defaultdict
+from os import getenv
+from typing import Callable, Dict, Optional
+
+log = logging.getLogger(__name__)
+
+
+class Metrics:
+    """
+    In-process counters, gauges and timings of the bot.
+    Gauges keep the last value set, and timings keep the count, total and max of the observed values.
+    Sources are the stats of other components, like the caches, that are read on every snapshot.
+    Snapshots are logged every LOG_INTERVAL seconds and served by the webhook
+    """
+    LOG_INTERVAL = int(getenv('METRICS_LOG_INTERVAL', 5 * 60))
+
+    def __init__(self):
+        self.counters: Dict[str, int] = defaultdict(int)
+        self.gauges: Dict[str, float] = {}
+        self.timings: Dict[str, Dict[str, float]] = {}
+        self.sources: Dict[str, Callable[[], Dict]] = {}
+        self._log_task: Optional[asyncio.Task] = None
+
+    def increment(self, name: str, value: int = 1):
+        self.counters[name] += value
+
+    def set_gauge(self, name: str, value: float):
+        self.gauges[name] = value
+
+    def observe(self, name: str, value: float):
+        timing = self.timings.get(name)
+        if timing is None:
+            timing = self.timings[name] = {'count': 0, 'total': 0.0, 'max': 0.0}
+        timing['count'] += 1
+        timing['total'] += value
+        timing['max'] = max(timing['max'], value)
+
+    def add_source(self, name: str, stats: Callable[[], Dict]):
+        self.sources[name] = stats
+
+    def snapshot(self) -> Dict:
+        return {
+            'counters': dict(self.counters),
+            'gauges': dict(self.gauges),
+            'timings': {
+                name: dict(timing, avg=timing['total'] / timing['count'])
+                for name, timing in self.timings.items()
+            },
+            'sources': {name: stats() for name, stats in self.sources.items()},
+        }
+
+    def start_logging(self, interval: float = LOG_INTERVAL):
+        """Logs a snapshot every `interval` seconds, until it is stopped. A zero interval disables it"""
+        if interval and self._log_task is None:
+            self._log_task = asyncio.ensure_future(self._log_periodically(interval))
+
+    def stop_logging(self):
+        if self._log_task is not None:
+            self._log_task.cancel()
+            self._log_task = None
+
+    async def _log_periodically(self, interval: float):
+        while True:
+            await asyncio.sleep(interval)
+            log.info(f'Metrics: {json.dumps(self.snapshot(), sort_keys=True)}')
+
+    def reset(self):
+        self.counters.clear()
+        self.gauges.clear()
+        self.timings.clear()
+
+
+metrics = Metrics()
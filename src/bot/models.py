@@ -1,13 +1,17 @@
 import logging
 import datetime
 from collections import OrderedDict
+from os import getenv
+from typing import Tuple
 
 import emoji
 from emoji import emojize
 
 from bot.api_client.spotify_api_client import SpotifyAPIClient
 from bot.api_client.telegram_api_client import TelegramAPIClient
+from bot.cache import LRUCache
 from bot.music.music import LinkType
+from bot.single_flight import SingleFlight
 
 log = logging.getLogger(__name__)
 
@@ -92,40 +96,65 @@ class Link:
 
 
 class SaveTelegramEntityMixin:
+    # Backend responses of the saved Telegram users and chats by Telegram id,
+    # along with a fingerprint of the data we sent to create them
+    KNOWN_ENTITY_TTL = int(getenv('KNOWN_ENTITY_TTL', 24 * 60 * 60))
+    _known_entities = LRUCache(max_entries=int(getenv('KNOWN_ENTITY_MAX_ENTRIES', 10000)), ttl=KNOWN_ENTITY_TTL)
+    _known_entities_single_flight = SingleFlight()
 
     @staticmethod
     async def save_link(url: str, user_id: str, chat_id: str) -> OrderedDict:
         telegram_api_client = TelegramAPIClient()
-        save_link_response = telegram_api_client.create_sent_link(url, user_id,
+        save_link_response = await telegram_api_client.create_sent_link(url, user_id,
                                                                   chat_id)
         return save_link_response
 
-    @staticmethod
-    async def save_chat(chat):
+    @classmethod
+    async def save_chat(cls, chat):
         telegram_api_client = TelegramAPIClient()
-        create_chat_response = telegram_api_client.create_chat(chat)
+        fingerprint = (chat.title, chat.username, chat.first_name, chat.type)
+        create_chat_response = await cls._save_known_entity(
+            ('chat', chat.id), fingerprint, lambda: telegram_api_client.create_chat(chat)
+        )
         return create_chat_response
 
-    @staticmethod
-    async def save_user(user):
+    @classmethod
+    async def save_user(cls, user):
         telegram_api_client = TelegramAPIClient()
-        create_user_response = telegram_api_client.create_user(user)
+        fingerprint = (user.username, user.first_name)
+        create_user_response = await cls._save_known_entity(
+            ('user', user.id), fingerprint, lambda: telegram_api_client.create_user(user)
+        )
         return create_user_response
 
+    @classmethod
+    async def _save_known_entity(cls, key: Tuple, fingerprint: Tuple, create) -> OrderedDict:
+        """
+        Saves a Telegram user or chat only if it is not known yet,
+        the data we send about it changed or the known entry expired.
+        Otherwise, the previous backend response is returned
+        """
+        known_entity = cls._known_entities.get(key)
+        if known_entity is not None and known_entity[0] == fingerprint:
+            return known_entity[1]
+        response = await cls._known_entities_single_flight.do((key, fingerprint), create)
+        cls._known_entities.set(key, (fingerprint, response))
+        return response
+
     @staticmethod
     async def save_artist(artist_id: str):
         spotify_api_client = SpotifyAPIClient()
-        create_artist_response = spotify_api_client.create_artist(artist_id)
+        create_artist_response = await spotify_api_client.create_artist(artist_id)
         return create_artist_response
 
     @staticmethod
     async def save_album(album_id: str):
         spotify_api_client = SpotifyAPIClient()
-        create_album_response = spotify_api_client.create_album(album_id)
+        create_album_response = await spotify_api_client.create_album(album_id)
         return create_album_response
 
     @staticmethod
     async def save_track(track_id: str):
         spotify_api_client = SpotifyAPIClient()
-        create_track_response = spotify_api_client.create_track(track_id)
+        create_track_response = await spotify_api_client.create_track(track_id)
         return create_track_response
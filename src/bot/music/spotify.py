@@ -1,50 +1,124 @@
 import logging
-from typing import Optional
+import os
+import re
+from os import getenv
+from typing import Iterator, NamedTuple, Optional
+from urllib.parse import urljoin, urlparse
 
-import requests
-
-from bot.music.music import LinkType
+from bot.api_client.api_client import BaseAPIClient
+from bot.cache import CACHE_DIR, PersistentLRUCache
+from bot.music.music import StreamingServiceType
+from bot.single_flight import SingleFlight
 
 log = logging.getLogger(__name__)
 
+SPOTIFY_SERVICE = StreamingServiceType.SPOTIFY.value
+
+
+class SpotifyLink(NamedTuple):
+    """
+    A Spotify link parsed from a url or an uri.
+    Shortcut links have no type nor id until they are resolved
+    """
+    service: str
+    link_type: Optional[str]
+    entity_id: Optional[str]
+    url: str
+
+    @property
+    def is_shortcut(self) -> bool:
+        return self.link_type is None
+
 
 class SpotifyUtils:
     SPOTIFY_LINK_URL = 'open.spotify.com'
     SPOTIFY_SHORTCUT_LINK_URL = 'spotify.link'
+    MAX_SHORTCUT_REDIRECTS = 5
+
+    # Matches, in a single pass:
+    # open.spotify.com urls, with optional locale (intl-xx) or embed prefix and query string,
+    # spotify: uris and spotify.link shortcut urls
+    LINK_REGEX = re.compile(
+        r'(?:open\.spotify\.com/(?:intl-[\w-]+/|embed/)?|spotify:)'
+        r'(?P<link_type>artist|album|track)[/:](?P<entity_id>[A-Za-z0-9]+)'
+        r'|spotify\.link/(?P<shortcut_id>[A-Za-z0-9]+)'
+    )
+
+    # Shortcut urls never change their target, so the resolved ones are kept across restarts
+    _shortcut_urls = PersistentLRUCache(
+        os.path.join(CACHE_DIR, 'spotify_shortcut_urls.json'),
+        max_entries=int(getenv('SPOTIFY_SHORTCUT_URLS_CACHE_SIZE', 10000)),
+    )
+    _shortcut_urls_single_flight = SingleFlight()
+
+    @classmethod
+    def parse_url(cls, text: str) -> Optional[SpotifyLink]:
+        """Returns the first Spotify link of a text, if any"""
+        # Most messages have no links at all, so a substring search skips the regex
+        # or, at least, the text before the first "spotify" ("open." is the longest prefix)
+        start = text.find('spotify')
+        if start == -1:
+            return None
+        match = cls.LINK_REGEX.search(text, max(start - 5, 0))
+        if match is None:
+            return None
+        return cls._build_link(match)
+
+    @classmethod
+    def find_links(cls, text: str) -> Iterator[SpotifyLink]:
+        """Yields every Spotify link of a text"""
+        start = text.find('spotify')
+        if start == -1:
+            return
+        for match in cls.LINK_REGEX.finditer(text, max(start - 5, 0)):
+            yield cls._build_link(match)
+
+    @classmethod
+    async def resolve_link(cls, link: SpotifyLink) -> Optional[SpotifyLink]:
+        """Returns the link that a shortcut link points to, or the link itself"""
+        if not link.is_shortcut:
+            return link
+        url = await cls.get_url_from_shortcut_url(link.url)
+        return cls.parse_url(url)
+
+    @classmethod
+    def _build_link(cls, match: re.Match) -> SpotifyLink:
+        link_type, entity_id, shortcut_id = match.groups()
+        if link_type is None:
+            return SpotifyLink(SPOTIFY_SERVICE, None, None, f'https://{cls.SPOTIFY_SHORTCUT_LINK_URL}/{shortcut_id}')
+        return SpotifyLink(SPOTIFY_SERVICE, link_type, entity_id, f'https://{cls.SPOTIFY_LINK_URL}/{link_type}/{entity_id}')
 
     @classmethod
-    def clean_url(cls, url: str) -> str:
-        """Receives a Spotify url and returns it cleaned"""
-        if cls.SPOTIFY_SHORTCUT_LINK_URL in url:
-            url = cls.get_url_from_shortcut_url(url)
-        if url.rfind('?') > -1:
-            return url[:url.rfind('?')]
+    async def get_url_from_shortcut_url(cls, shortcut_url: str) -> str:
+        url = cls._shortcut_urls.get(shortcut_url)
+        if url is None:
+            url = await cls._shortcut_urls_single_flight.do(
+                shortcut_url, lambda: cls._resolve_shortcut_url(shortcut_url)
+            )
         return url
 
     @classmethod
-    def is_valid_url(cls, url: str) -> bool:
-        """Check if a message contains a Spotify Link"""
-        return (
-                cls.SPOTIFY_LINK_URL in url
-                or cls.SPOTIFY_SHORTCUT_LINK_URL in url
-        )
-
-    @staticmethod
-    def get_link_type_from_url(url: str) -> Optional[str]:
-        """Resolves the Spotify link type"""
-        if 'artist' in url:
-            return LinkType.ARTIST.value
-        elif 'album' in url:
-            return LinkType.ALBUM.value
-        elif 'track' in url:
-            return LinkType.TRACK.value
-        return None
-
-    @staticmethod
-    def get_entity_id_from_url(url: str) -> str:
-        return url[url.rfind('/') + 1:]
-
-    @staticmethod
-    def get_url_from_shortcut_url(shortcut_url: str) -> str:
-        response = requests.get(shortcut_url)
-        return response.url
+    async def _resolve_shortcut_url(cls, shortcut_url: str) -> str:
+        """
+        Follows the redirects of a shortcut url until it reaches an open.spotify.com url,
+        reading only the Location headers and never the response bodies
+        """
+        session = await BaseAPIClient.open_session()
+        url = shortcut_url
+        for _ in range(cls.MAX_SHORTCUT_REDIRECTS):
+            location = None
+            # Some redirect services do not answer HEAD requests,
+            # so GET is tried too, closing the response before its body is read
+            for method in ('head', 'get'):
+                async with session.request(method, url, allow_redirects=False) as response:
+                    location = response.headers.get('Location')
+                if location:
+                    break
+            if not location:
+                break
+            url = urljoin(url, location)
+            if urlparse(url).netloc == cls.SPOTIFY_LINK_URL:
+                cls._shortcut_urls.set(shortcut_url, url)
+                return url
+        log.warning(f'Could not resolve the Spotify shortcut url "{shortcut_url}"')
+        return url
@@ -0,0 +1,144 @@
+import logging
+from os import getenv
+from typing import Callable, Dict, List, Optional, Tuple, Union
+
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup, Update
+from telegram.constants import ParseMode
+from telegram.error import BadRequest
+from telegram.ext import CallbackContext
+
+from bot.api_client.telegram_api_client import TelegramAPIClient
+from bot.buttons import BaseButton
+from bot.cache import LRUCache
+from bot.reply import MessageSplitter, ReplyMixin
+from bot.rendering import MessageBuilder
+
+log = logging.getLogger(__name__)
+
+
+class SentLinksPageView:
+    """
+    A list of sent links shown one page at a time in a single message.
+    Pages are fetched from the API when they are turned to, and kept while the view lives.
+    Rows that do not fit in the message of a page go to the next one
+    """
+    PAGE_SIZE = int(getenv('SENT_LINKS_PAGE_SIZE', 20))
+    MAX_CACHED_PAGES = 10
+
+    # Views by (chat id, message id) of the message that shows them
+    _views = LRUCache(
+        max_entries=int(getenv('SENT_LINKS_PAGE_VIEWS_CACHE_SIZE', 5000)),
+        ttl=int(getenv('SENT_LINKS_PAGE_VIEW_TTL', 24 * 60 * 60)),
+    )
+
+    def __init__(self, filters: Dict, render: Callable[[List], Union[str, MessageBuilder]]):
+        """
+        :param filters: iter_sent_links filters of the sent links
+        :param render: builds the message of a page from its sent links
+        """
+        self.filters = filters
+        self.render = render
+        # Offset of the first sent link of every page known so far
+        self._page_offsets = [0]
+        self._pages = LRUCache(max_entries=self.MAX_CACHED_PAGES)
+
+    def has_next_page(self, page: int) -> bool:
+        return page + 1 < len(self._page_offsets)
+
+    async def get_page(self, page: int) -> Tuple[str, Optional[InlineKeyboardMarkup]]:
+        """Returns the message and the keyboard of a page"""
+        # Pages are turned one at a time, so only the next of the known pages can be new
+        page = max(0, min(page, len(self._page_offsets) - 1))
+        message = self._pages.get(page)
+        if message is None:
+            message = await self._fetch_page(page)
+            self._pages.set(page, message)
+        return message, PageButton.get_keyboard_markup(page, self.has_next_page(page))
+
+    def register(self, chat_id: int, message_id: int):
+        """Keeps the view of the message, so its buttons can turn its pages"""
+        if self.has_next_page(0):
+            self._views.set((chat_id, message_id), self)
+
+    @classmethod
+    def get(cls, chat_id: int, message_id: int) -> Optional['SentLinksPageView']:
+        return cls._views.get((chat_id, message_id))
+
+    async def _fetch_page(self, page: int) -> str:
+        offset = self._page_offsets[page]
+        sent_links = []
+        has_next_page = False
+        # A sent link more than a page tells whether there is a next page, in the same request
+        sent_links_iterator = TelegramAPIClient().iter_sent_links(
+            page_size=self.PAGE_SIZE + 1, offset=offset, **self.filters
+        )
+        try:
+            async for sent_link in sent_links_iterator:
+                if len(sent_links) == self.PAGE_SIZE:
+                    has_next_page = True
+                    break
+                sent_links.append(sent_link)
+        finally:
+            await sent_links_iterator.aclose()
+
+        message = self._build_page_message(page, sent_links, has_next_page)
+        while len(message) > ReplyMixin.MAX_RESPONSE_LENGTH and len(sent_links) > 1:
+            sent_links.pop()
+            has_next_page = True
+            message = self._build_page_message(page, sent_links, has_next_page)
+        if len(message) > ReplyMixin.MAX_RESPONSE_LENGTH:
+            # A single row that does not fit
+            message = MessageSplitter(ReplyMixin.MAX_RESPONSE_LENGTH).split(message)[0]
+        if has_next_page and not self.has_next_page(page):
+            self._page_offsets.append(offset + len(sent_links))
+        return message
+
+    def _build_page_message(self, page: int, sent_links: List, has_next_page: bool) -> str:
+        message = self.render(sent_links)
+        if isinstance(message, MessageBuilder):
+            if page > 0 or has_next_page:
+                message.add_line(f'<i>Page {page + 1}</i>')
+            message = message.build()
+        return message
+
+
+class PageButton(BaseButton):
+    """
+    Defines the Prev/Next buttons of a sent links page view, which edit the message in place
+    """
+    CALLBACK_NAME = 'sent_links_page'
+
+    @classmethod
+    async def handle(cls, update: Update, context: CallbackContext):
+        """Handles the pulsation of the button"""
+        query = update.callback_query
+        view = SentLinksPageView.get(query.message.chat_id, query.message.message_id)
+        if view is None:
+            await query.answer('This list has expired. Please, run the command again')
+            await query.edit_message_reply_markup()
+            return
+        page = int(cls.get_callback_data(query.data))
+        message, reply_markup = await view.get_page(page)
+        try:
+            await ReplyMixin._send(update, lambda: query.edit_message_text(
+                message,
+                parse_mode=ParseMode.HTML,
+                reply_markup=reply_markup,
+                disable_web_page_preview=True
+            ))
+        except BadRequest as e:
+            # Double clicks try to edit the message with the same content
+            if 'not modified' not in str(e):
+                raise
+        await query.answer()
+
+    @classmethod
+    def get_keyboard_markup(cls, page: int, has_next_page: bool) -> Optional[InlineKeyboardMarkup]:
+        buttons = []
+        if page > 0:
+            buttons.append(InlineKeyboardButton('« Prev', callback_data=f'{cls.CALLBACK_NAME}:{page - 1}'))
+        if has_next_page:
+            buttons.append(InlineKeyboardButton('Next »', callback_data=f'{cls.CALLBACK_NAME}:{page + 1}'))
+        if not buttons:
+            return None
+        return InlineKeyboardMarkup([buttons])
@@ -0,0 +1,60 @@
+import asyncio
+import logging
+import time
+from typing import Any, Awaitable, Callable, Dict, Iterable, Tuple
+
+from bot.metrics import metrics
+
+log = logging.getLogger(__name__)
+
+
+class Pipeline:
+    """
+    Runs async steps as soon as the steps they depend on are done,
+    so the steps that do not depend on each other run concurrently.
+    Every step receives the results of its dependencies as keyword arguments
+    and its duration is recorded in the metrics as `<pipeline>.<step>`
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self._steps: Dict[str, Tuple[Callable[..., Awaitable[Any]], Tuple[str, ...]]] = {}
+        self.timings: Dict[str, float] = {}
+
+    def add_step(self, name: str, function: Callable[..., Awaitable[Any]], depends_on: Iterable[str] = ()):
+        depends_on = tuple(depends_on)
+        for dependency in depends_on:
+            if dependency not in self._steps:
+                raise ValueError(f'Step "{name}" depends on "{dependency}", that has to be added before')
+        self._steps[name] = (function, depends_on)
+        return self
+
+    async def run(self) -> Dict[str, Any]:
+        start = time.perf_counter()
+        tasks: Dict[str, asyncio.Task] = {}
+        for name in self._steps:
+            tasks[name] = asyncio.ensure_future(self._run_step(name, tasks))
+        try:
+            await asyncio.gather(*tasks.values())
+        except BaseException:
+            for task in tasks.values():
+                task.cancel()
+            # Wait for the cancellations, so no step keeps running or fails unnoticed
+            await asyncio.gather(*tasks.values(), return_exceptions=True)
+            raise
+        finally:
+            self._observe('total', time.perf_counter() - start)
+        return {name: task.result() for name, task in tasks.items()}
+
+    async def _run_step(self, name: str, tasks: Dict[str, asyncio.Task]) -> Any:
+        function, depends_on = self._steps[name]
+        kwargs = {dependency: await tasks[dependency] for dependency in depends_on}
+        start = time.perf_counter()
+        try:
+            return await function(**kwargs)
+        finally:
+            self._observe(name, time.perf_counter() - start)
+
+    def _observe(self, step: str, elapsed: float):
+        self.timings[step] = elapsed
+        metrics.observe(f'{self.name}.{step}', elapsed)
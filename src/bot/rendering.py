@@ -0,0 +1,129 @@
+import datetime
+import html
+from functools import lru_cache
+from os import getenv
+from string import Formatter
+from typing import Any, Dict, Iterator, List, NamedTuple, Optional
+
+from bot import emojis
+from bot.cache import LRUCache
+from bot.models import Link
+from bot.utils import OUTPUT_DATE_FORMAT
+
+
+class Markup(str):
+    """A string that is already HTML, so it is not escaped again"""
+
+
+def escape(value: Any) -> str:
+    if isinstance(value, Markup):
+        return value
+    return html.escape(str(value)) if value is not None else ''
+
+
+def format_date(iso_date: str) -> str:
+    """Formats an ISO date or datetime with the output date format"""
+    if not iso_date:
+        return ''
+    # Only the day is formatted, so rows sent the same day share the cached result
+    return _format_day(iso_date[:10])
+
+
+@lru_cache(maxsize=4096)
+def _format_day(iso_day: str) -> str:
+    try:
+        return datetime.date.fromisoformat(iso_day).strftime(OUTPUT_DATE_FORMAT)
+    except ValueError:
+        # Release dates can have only the year or the month
+        return iso_day
+
+
+class LinkFragments(NamedTuple):
+    """The rendered parts of a link, shared by every message and keyboard that shows it"""
+    # Plain text name, for the buttons
+    name: str
+    # Escaped emoji, url, name, genres in parentheses and genre names, for the row templates
+    fields: Dict[str, Markup]
+
+
+# Rendered fragments by (link id, link updated at). The TTL bounds how long a link
+# whose update time is not known keeps stale genres
+_link_fragments = LRUCache(
+    max_entries=int(getenv('LINK_FRAGMENTS_CACHE_SIZE', 20000)),
+    ttl=int(getenv('LINK_FRAGMENTS_TTL', 24 * 60 * 60)),
+)
+
+
+def get_link_fragments(link: Dict) -> LinkFragments:
+    link_id = link.get('id')
+    cache_key = (link_id, link.get('updated_at'))
+    fragments = _link_fragments.get(cache_key) if link_id is not None else None
+    if fragments is None:
+        name = Link.get_name(link)
+        genres = Link.get_genres(link)
+        fragments = LinkFragments(name, {
+            'emoji': Markup(escape(emojis.get_music_emoji(link.get('link_type')))),
+            'url': Markup(escape(link.get('url'))),
+            'name': Markup(escape(name)),
+            'genres': Markup(escape(f'({", ".join(genres)})' if genres else '')),
+            'genre_names': Markup(escape(', '.join(genres))),
+        })
+        if link_id is not None:
+            _link_fragments.set(cache_key, fragments)
+    return fragments
+
+
+def get_link_fields(link: Dict) -> Dict[str, Markup]:
+    """Fields of a link for the row templates: its emoji, url, name, genres and genre_names"""
+    return get_link_fragments(link).fields
+
+
+class RowTemplate:
+    """
+    Template of a message row, in str.format syntax without format specs, parsed once.
+    The values of its fields are HTML-escaped when it is rendered, unless they are Markup
+    """
+
+    def __init__(self, template: str):
+        self.template = template
+        self._parts = []
+        for literal, field_name, format_spec, conversion in Formatter().parse(template):
+            if format_spec or conversion:
+                raise ValueError(f'Format specs are not supported: "{template}"')
+            self._parts.append((literal, field_name))
+
+    def render(self, fields: Dict[str, Any]) -> str:
+        return ''.join([
+            literal + escape(fields[field_name]) if field_name is not None else literal
+            for literal, field_name in self._parts
+        ])
+
+
+class MessageBuilder:
+    """
+    Builds a HTML message line by line.
+    The reply splits its lines in parts directly, so big messages are never joined as a whole
+    """
+
+    def __init__(self, title: Optional[str] = None):
+        self._lines: List[str] = []
+        if title is not None:
+            self.add_line(title)
+
+    def add_line(self, line: str = '') -> 'MessageBuilder':
+        """Adds a line of HTML as it is"""
+        self._lines.append(line)
+        return self
+
+    def add_row(self, template: RowTemplate, **fields) -> 'MessageBuilder':
+        self._lines.append(template.render(fields))
+        return self
+
+    def build(self) -> str:
+        return '\n'.join(self._lines)
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._lines)
+
+    def __len__(self) -> int:
+        return len(self._lines)
@@ -1,9 +1,16 @@
+import itertools
 import logging
-import time
+import os
+import re
 from enum import Enum
-from typing import List
+from os import getenv
+from typing import Iterable, Iterator, List, Tuple, Union
 
-from telegram.constants import ParseMode
+from telegram.constants import ChatType, ParseMode
+from telegram.error import BadRequest
+
+from bot.cache import CACHE_DIR, PersistentLRUCache
+from bot.scheduler import send_scheduler
 
 log = logging.getLogger(__name__)
 
@@ -14,95 +21,384 @@ class ReplyType(Enum):
     AUDIO = 2
 
 
+class MessageSplitter:
+    """
+    Splits a HTML message into parts of up to `max_length` characters, walking it only once.
+    Parts are split at line boundaries outside any tag whenever it is possible.
+    Otherwise, the open tags are closed at the end of a part and reopened at the beginning of the next one.
+    Lines that do not fit in a part are cut between tags and entities.
+    Unclosed tags of malformed messages are dropped when too many of them pile up
+    """
+    TAG_REGEX = re.compile(r'<(/?)([a-zA-Z][a-zA-Z0-9-]*)([^>]*)>')
+    # Open tags that are reopened in the next part, and the share of a part that they can take
+    MAX_OPEN_TAGS = 16
+    MAX_OPEN_TAGS_SHARE = 0.75
+    # Lines of a message given as its lines are joined in chunks of about this many parts
+    CHUNK_PARTS = 16
+    # Cuts tried at the end of a part without line boundaries before looking for one tag by tag
+    HARD_CUT_ATTEMPTS = 3
+
+    def __init__(self, max_length: int):
+        self.max_length = max_length
+
+    def split(self, message: Union[str, Iterable[str]]) -> List[str]:
+        parts = []
+        # Tags open at the beginning of the part, as (name, opening tag)
+        open_tags: List[Tuple[str, str]] = []
+        text = ''
+        start = 0
+        chunks = self._iter_chunks(message)
+        chunk = next(chunks, None)
+        while chunk is not None:
+            # Only the text that is not in a part yet is kept, so a message given as its lines is never whole
+            text = f'{text[start:]}\n{chunk}' if text else chunk
+            start = 0
+            chunk = next(chunks, None)
+            is_last_chunk = chunk is None
+            while start < len(text):
+                opening_tags = ''.join(tag for _, tag in open_tags)
+                available = self.max_length - len(opening_tags)
+                if len(text) - start <= available:
+                    if not is_last_chunk:
+                        break
+                    cut = next_start = len(text)
+                    part_open_tags = self._get_open_tags_after(open_tags, text, start, cut)
+                else:
+                    cut, next_start, part_open_tags = self._find_cut(text, start, available, open_tags)
+                closing_tags = ''.join(f'</{name}>' for name, _ in reversed(part_open_tags))
+                parts.append(opening_tags + text[start:cut] + closing_tags)
+                open_tags = self._cap_open_tags(part_open_tags)
+                start = next_start
+            if start >= len(text):
+                text = ''
+        return parts
+
+    def _iter_chunks(self, message: Union[str, Iterable[str]]) -> Iterator[str]:
+        if isinstance(message, str):
+            if message:
+                yield message
+            return
+        chunk_length = self.max_length * self.CHUNK_PARTS
+        lines = []
+        length = 0
+        for line in message:
+            lines.append(line)
+            length += len(line) + 1
+            if length >= chunk_length:
+                yield '\n'.join(lines)
+                lines = []
+                length = 0
+        if lines and (length > 1 or len(lines) > 1):
+            yield '\n'.join(lines)
+
+    def _cap_open_tags(self, open_tags: List[Tuple[str, str]]) -> List[Tuple[str, str]]:
+        """Drops the outermost open tags while reopening and closing them takes too much of a part"""
+        open_tags = open_tags[-self.MAX_OPEN_TAGS:]
+        max_tags_length = self.max_length * self.MAX_OPEN_TAGS_SHARE
+        tags_length = sum(len(tag) + len(name) + 3 for name, tag in open_tags)
+        while open_tags and tags_length > max_tags_length:
+            name, tag = open_tags.pop(0)
+            tags_length -= len(tag) + len(name) + 3
+        return open_tags
+
+    def _find_cut(self, message: str, start: int, available: int, open_tags: List[Tuple[str, str]]):
+        """
+        Returns where the part that begins at `start` ends, where the next one begins
+        and the tags that are open at the end of the part
+        """
+        # The line separator at the cut is dropped
+        cut = message.rfind('\n', start + 1, start + available + 1)
+        if cut == -1:
+            cut, part_open_tags = self._find_hard_cut(message, start, available, open_tags)
+            if cut != -1:
+                return cut, cut, part_open_tags
+        else:
+            part_open_tags = self._get_open_tags_after(open_tags, message, start, cut)
+            if cut - start + self._get_closing_length(part_open_tags) > available:
+                # The closing tags do not fit
+                cut = -1
+        if cut == -1:
+            cut, is_line_cut = self._scan_cut(message, start, available, open_tags)
+            part_open_tags = self._get_open_tags_after(open_tags, message, start, cut)
+            if not is_line_cut:
+                return cut, cut, part_open_tags
+        if part_open_tags:
+            safe_cut = self._find_safe_cut(message, start, cut, open_tags)
+            if safe_cut != -1:
+                return safe_cut, safe_cut + 1, []
+        return cut, cut + 1, part_open_tags
+
+    def _find_hard_cut(self, message: str, start: int, available: int, open_tags: List[Tuple[str, str]]):
+        """
+        Returns the cut of a part without line boundaries that leaves room for the tags that are open
+        at the beginning of the part, and the tags open at the cut, or -1 if the tags opened in the part
+        do not fit too
+        """
+        limit = start + available - self._get_closing_length(open_tags)
+        for _ in range(self.HARD_CUT_ATTEMPTS):
+            cut = limit
+            tag_start = message.rfind('<', start, cut)
+            if tag_start != -1 and message.find('>', tag_start, cut) == -1:
+                cut = tag_start
+            cut = self._skip_incomplete_token(message, start, cut, tag_end=False)
+            if cut <= start:
+                break
+            if not open_tags:
+                top_level_cut = self._find_top_level_cut(message, start, cut)
+                if top_level_cut != -1:
+                    return top_level_cut, []
+            part_open_tags = self._get_open_tags_after(open_tags, message, start, cut)
+            overflow = cut - start + self._get_closing_length(part_open_tags) - available
+            if overflow <= 0:
+                return cut, part_open_tags
+            # Room is made for the closing tags, and the tags open at the new cut are checked again
+            limit = cut - overflow
+        return -1, open_tags
+
+    @staticmethod
+    def _find_top_level_cut(message: str, start: int, cut: int) -> int:
+        """
+        Returns the cut, or the beginning of the outermost tag that is open at it, for a part that
+        begins with no open tags, or -1. Well formed parts are told by counting their tags,
+        so only the tags open at the cut are walked back instead of parsing the whole part
+        """
+        opened = message.count('<', start, cut) - 2 * message.count('</', start, cut)
+        if opened < 0:
+            return -1
+        position = cut
+        while opened > 0:
+            position = message.rfind('<', start, position)
+            if position == -1:
+                return -1
+            opened += 1 if message.startswith('</', position) else -1
+        return position if position > start else -1
+
+    def _scan_cut(self, message: str, start: int, available: int, open_tags: List[Tuple[str, str]]):
+        """
+        Returns the last cut of the part where it fits along with its closing tags, and whether it is
+        a line boundary. Line boundaries are preferred, and the other cuts are between tags and entities
+        """
+        limit = start + available
+        open_names = [name for name, _ in open_tags]
+        closing_length = self._get_closing_length(open_tags)
+        line_cut = hard_cut = -1
+        text_start = start
+        for match in itertools.chain(self.TAG_REGEX.finditer(message, start, limit), [None]):
+            text_end = match.start() if match is not None else limit
+            # The text before the tag, where the open tags do not change
+            end = min(text_end, limit - closing_length)
+            if end >= text_start and end > start:
+                line_break = message.rfind('\n', max(text_start, start + 1), end + 1)
+                if line_break != -1:
+                    line_cut = line_break
+                cut = end
+                if match is None:
+                    # Not inside an entity nor a tag that does not end before the limit
+                    cut = self._skip_incomplete_token(message, text_start, cut)
+                else:
+                    cut = self._skip_incomplete_token(message, text_start, cut, tag_end=False)
+                if cut > start:
+                    hard_cut = cut
+            if match is None or text_end > limit - closing_length:
+                break
+            is_closing, name = match.group(1, 2)
+            if not is_closing:
+                open_names.append(name)
+                closing_length += len(name) + 3
+            elif name in open_names:
+                del open_names[len(open_names) - 1 - open_names[::-1].index(name)]
+                closing_length -= len(name) + 3
+            text_start = match.end()
+        if line_cut != -1:
+            return line_cut, True
+        if hard_cut != -1:
+            return hard_cut, False
+        # A tag or an entity longer than a part is cut as it is
+        return start + max(1, available - self._get_closing_length(open_tags)), False
+
+    @staticmethod
+    def _skip_incomplete_token(message: str, text_start: int, cut: int, tag_end: bool = True) -> int:
+        """Moves the cut before the entity, or the tag, that it would cut"""
+        entity_start = message.rfind('&', text_start, cut)
+        if entity_start != -1 and message.find(';', entity_start, cut) == -1:
+            cut = entity_start
+        if tag_end:
+            tag_start = message.rfind('<', text_start, cut)
+            if tag_start != -1:
+                cut = tag_start
+        return cut
+
+    @staticmethod
+    def _get_closing_length(open_tags: List[Tuple[str, str]]) -> int:
+        return sum(len(name) + 3 for name, _ in open_tags)
+
+    def _find_safe_cut(self, message: str, start: int, end: int, open_tags: List[Tuple[str, str]]) -> int:
+        """Returns the last line boundary of the part with no open tags, or -1"""
+        open_names = [name for name, _ in open_tags]
+        empty_from = start if not open_names else -1
+        safe_cut = -1
+        for match in self.TAG_REGEX.finditer(message, start, end):
+            is_closing, name = match.group(1, 2)
+            if not is_closing:
+                if not open_names:
+                    line_break = message.rfind('\n', empty_from, match.start())
+                    if line_break > start:
+                        safe_cut = line_break
+                open_names.append(name)
+            elif name in open_names:
+                del open_names[len(open_names) - 1 - open_names[::-1].index(name)]
+                if not open_names:
+                    empty_from = match.end()
+        return safe_cut
+
+    @classmethod
+    def _get_open_tags_after(cls, open_tags: List[Tuple[str, str]], message: str, start: int, end: int):
+        if not open_tags:
+            # Well formed lines open as many tags as they close
+            opened = message.count('<', start, end)
+            if opened == 0 or opened == 2 * message.count('</', start, end):
+                return open_tags
+        tags = cls.TAG_REGEX.findall(message, start, end)
+        if not tags:
+            return open_tags
+        open_tags = list(open_tags)
+        opened = []
+        for is_closing, name, attributes in tags:
+            if not is_closing:
+                opened.append((name, attributes))
+            elif opened and opened[-1][0] == name:
+                opened.pop()
+            else:
+                for index in range(len(open_tags) - 1, -1, -1):
+                    if open_tags[index][0] == name:
+                        del open_tags[index]
+                        break
+        open_tags.extend((name, f'<{name}{attributes}>') for name, attributes in opened)
+        return open_tags
+
+
 class ReplyMixin:
     MAX_RESPONSE_LENGTH = 4096
 
+    # Telegram file ids of the audios sent by url, by url
+    _audio_file_ids = PersistentLRUCache(
+        os.path.join(CACHE_DIR, 'audio_file_ids.json'),
+        max_entries=int(getenv('AUDIO_FILE_IDS_CACHE_SIZE', 20000)),
+    )
+
     async def reply(
             self, update, context, message, reply_type=ReplyType.TEXT,
             reply_markup=None, audio=None, title=None, performer=None,
             image=None, disable_web_page_preview=False
     ):
         if reply_type == ReplyType.TEXT:
-            await self._reply_text(update, message, reply_markup,
-                                   disable_web_page_preview)
+            return await self._reply_text(update, message, reply_markup,
+                                          disable_web_page_preview)
         if reply_type == ReplyType.AUDIO:
-            await self._reply_audio(update, context, audio, message, performer,
-                                    title, reply_markup)
+            return await self._reply_audio(update, context, audio, message, performer,
+                                           title, reply_markup)
         if reply_type == ReplyType.IMAGE:
-            await self._reply_image(update, context, image, message,
-                                    reply_markup)
+            return await self._reply_image(update, context, image, message,
+                                           reply_markup)
 
     async def _reply_text(self, update, message, reply_markup=None,
                           disable_web_page_preview=True):
         """
         Replies the message to the original chat
-        splitting the message if necessary
+        splitting the message if necessary.
+        Returns the sent message, if it was sent in a single one
         """
 
         # For some reason, can occur that message is None at this point
         if not message:
             return
 
+        # The message can be given as its lines, to be split without being joined first
+        if not isinstance(message, str):
+            parts = self._split_message_in_parts(message)
+            if not parts:
+                return
+            if len(parts) == 1:
+                message = parts[0]
+
         # If text can be sent in a single message
-        if len(message) <= self.MAX_RESPONSE_LENGTH:
-            await update.message.reply_text(
+        if isinstance(message, str) and len(message) <= self.MAX_RESPONSE_LENGTH:
+            return await self._send(update, lambda: update.message.reply_text(
                 message,
                 disable_web_page_preview=disable_web_page_preview,
                 parse_mode=ParseMode.HTML,
                 reply_markup=reply_markup
-            )
-            return
+            ))
 
-        # If the text is too large that has to be splitted into many messages
-        parts = self._split_message_in_parts(message)
+        # If the text is too large that has to be splitted into many messages.
+        # The scheduler spaces them out according to the chat rate limit
+        if isinstance(message, str):
+            parts = self._split_message_in_parts(message)
 
         for part in parts:
-            await update.message.reply_text(
+            await self._send(update, lambda: update.message.reply_text(
                 part,
                 disable_web_page_preview=True,
                 parse_mode=ParseMode.HTML
-            )
-            time.sleep(1)
+            ))
         return
 
-    def _split_message_in_parts(self, message) -> List[str]:
-        """Splits the message into parts if necessary"""
-        parts = []
-        while len(message) > 0:
-            if len(message) > self.MAX_RESPONSE_LENGTH:
-                part = message[:self.MAX_RESPONSE_LENGTH]
-                first_lnbr = part.rfind('\n')
-                if first_lnbr != -1:
-                    parts.append(part[:first_lnbr])
-                    message = message[(first_lnbr + 1):]
-                else:
-                    parts.append(part)
-                    message = message[self.MAX_RESPONSE_LENGTH:]
-            else:
-                parts.append(message)
-                break
-        return parts
+    def _split_message_in_parts(self, message: Union[str, Iterable[str]]) -> List[str]:
+        """Splits the message, or its lines, into parts of up to MAX_RESPONSE_LENGTH characters"""
+        return MessageSplitter(self.MAX_RESPONSE_LENGTH).split(message)
 
-    @staticmethod
-    async def _reply_image(update, context, image, caption, reply_markup=None):
+    @classmethod
+    async def _reply_image(cls, update, context, image, caption, reply_markup=None):
         chat_id = update.message.chat_id
-        await context.bot.send_photo(
-            chat_id,
-            image,
-            caption=caption,
-            parse_mode=ParseMode.HTML,
-            reply_markup=reply_markup
-        )
 
-    @staticmethod
-    async def _reply_audio(update, context, audio, caption, performer, title,
+        def send_photo():
+            if hasattr(image, 'seek'):
+                # A retried send has to read the file from the beginning again
+                image.seek(0)
+            return context.bot.send_photo(
+                chat_id,
+                image,
+                caption=caption,
+                parse_mode=ParseMode.HTML,
+                reply_markup=reply_markup
+            )
+
+        return await cls._send(update, send_photo)
+
+    @classmethod
+    async def _reply_audio(cls, update, context, audio, caption, performer, title,
                            reply_markup=None):
+        """
+        Replies an audio. Telegram file ids of the audios sent by url are cached,
+        so Telegram does not have to download them again when they are sent again
+        """
+        file_id = cls._audio_file_ids.get(audio) if isinstance(audio, str) else None
+        if file_id:
+            try:
+                return await cls._send_audio(update, context, file_id, caption, performer, title, reply_markup)
+            except BadRequest:
+                log.warning(f'Audio file id "{file_id}" rejected. Sending the audio "{audio}" instead')
+                cls._audio_file_ids.pop(audio)
+        message = await cls._send_audio(update, context, audio, caption, performer, title, reply_markup)
+        if isinstance(audio, str) and message and message.audio:
+            cls._audio_file_ids.set(audio, message.audio.file_id)
+        return message
+
+    @classmethod
+    async def _send_audio(cls, update, context, audio, caption, performer, title,
+                          reply_markup=None):
         chat_id = update.message.chat_id
         reply_to_message_id = update.message.message_id
-        await context.bot.send_audio(
+        return await cls._send(update, lambda: context.bot.send_audio(
             chat_id, audio, title=title,
             performer=performer, caption=caption,
             reply_to_message_id=reply_to_message_id,
             parse_mode=ParseMode.HTML,
             reply_markup=reply_markup
-        )
+        ))
+
+    @staticmethod
+    async def _send(update, send):
+        """Sends a message to the chat of the update through the send scheduler"""
+        chat = update.effective_chat
+        return await send_scheduler.send(chat.id, chat.type != ChatType.PRIVATE, send)
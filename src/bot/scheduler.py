@@ -0,0 +1,94 @@
+import asyncio
+import logging
+import time
+from typing import Any, Awaitable, Callable, Hashable, Optional
+
+from telegram.error import RetryAfter
+
+from bot.cache import LRUCache
+from bot.metrics import metrics
+
+log = logging.getLogger(__name__)
+
+
+class TokenBucket:
+    """Allows `rate` acquisitions per second on average, with bursts of up to `capacity`"""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated_at = time.monotonic()
+        self._lock: Optional[asyncio.Lock] = None
+
+    async def acquire(self):
+        # Created on first use, inside the loop of the bot,
+        # as on Python 3.9 it binds to the loop that is current when it is created
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        # The lock makes the waiters acquire their tokens in order
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated_at) * self.rate)
+                self._updated_at = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+class _ChatQueue:
+
+    def __init__(self, rate: float, capacity: float):
+        self.lock = asyncio.Lock()
+        self.bucket = TokenBucket(rate, capacity)
+
+
+class SendScheduler:
+    """
+    Sends the messages to Telegram respecting its rate limits:
+    about 30 messages per second overall, one per second in a private chat and 20 per minute in a group.
+    The messages of a chat are sent one at a time and in order,
+    so a RetryAfter error only delays the chat that got it
+    """
+    GLOBAL_RATE = 30
+    PRIVATE_CHAT_RATE = 1
+    GROUP_CHAT_RATE = 20 / 60
+    CHAT_BURST = 3
+    MAX_RETRIES = 3
+    MAX_CHATS = 10000
+
+    def __init__(self):
+        self._global_bucket = TokenBucket(self.GLOBAL_RATE, self.GLOBAL_RATE)
+        self._chats = LRUCache(max_entries=self.MAX_CHATS)
+
+    async def send(self, chat_id: Hashable, is_group: bool, send: Callable[[], Awaitable[Any]]) -> Any:
+        """Calls `send` when the chat and the global rate limits allow it and returns its result"""
+        chat = self._get_chat_queue(chat_id, is_group)
+        start = time.monotonic()
+        async with chat.lock:
+            for retry in range(self.MAX_RETRIES + 1):
+                await chat.bucket.acquire()
+                await self._global_bucket.acquire()
+                metrics.observe('send_scheduler.wait', time.monotonic() - start)
+                try:
+                    return await send()
+                except RetryAfter as e:
+                    if retry == self.MAX_RETRIES:
+                        raise
+                    metrics.increment('send_scheduler.retry_after')
+                    log.warning(f'Chat "{chat_id}" is rate limited. Retrying after {e.retry_after} seconds')
+                    await asyncio.sleep(e.retry_after)
+                    start = time.monotonic()
+
+    def _get_chat_queue(self, chat_id: Hashable, is_group: bool) -> _ChatQueue:
+        chat = self._chats.get(chat_id)
+        if chat is None:
+            rate = self.GROUP_CHAT_RATE if is_group else self.PRIVATE_CHAT_RATE
+            chat = _ChatQueue(rate, self.CHAT_BURST)
+            self._chats.set(chat_id, chat)
+        return chat
+
+
+send_scheduler = SendScheduler()
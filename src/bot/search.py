@@ -1,11 +1,18 @@
+import asyncio
 import logging
+from os import getenv
+from typing import Dict, List
 
 from telegram import InlineQueryResultArticle, InputTextMessageContent, Update
 from telegram.ext import CallbackContext
 
 from bot.api_client.spotify_api_client import SpotifyAPIClient
+from bot.autocomplete import AutocompleteEntry, autocomplete_index, normalize
+from bot.cache import LRUCache
 from bot.logger import LoggerMixin
+from bot.metrics import metrics
 from bot.music.music import EntityType
+from bot.single_flight import SingleFlight
 
 log = logging.getLogger(__name__)
 
@@ -13,65 +20,180 @@ log = logging.getLogger(__name__)
 class SearchInline(LoggerMixin):
     INLINE = 'search'
 
+    # Seconds that a search waits for the user to stop typing before it calls the backend
+    DEBOUNCE_DELAY = float(getenv('INLINE_SEARCH_DEBOUNCE_DELAY', 0.3))
+    # In-flight search of every user. Telegram sends an inline query on almost every keystroke,
+    # so a newer query of the user supersedes it
+    _searches: Dict[int, asyncio.Future] = {}
+
+    # Results of the searches by (entity type, normalized query), to answer the popular ones
+    # and the next pages of a search without searching again
+    _results_cache = LRUCache(
+        max_entries=int(getenv('INLINE_SEARCH_CACHE_SIZE', 2000)),
+        ttl=int(getenv('INLINE_SEARCH_CACHE_TTL', 60 * 60)),
+    )
+    RESULTS_PAGE_SIZE = 10
+    # Entities of the chosen results that are being created in the backend, by (entity type, spotify id)
+    _prefetches = SingleFlight()
+    # Shorter queries are only answered with the known entities
+    MIN_QUERY_LENGTH = 3
+    # Seconds that Telegram caches the answer of a query in its servers
+    TELEGRAM_CACHE_TIME = int(getenv('INLINE_SEARCH_TELEGRAM_CACHE_TIME', 5 * 60))
+
     @classmethod
     async def perform_search(cls, update: Update, context: CallbackContext):
         cls.log_inline(cls.INLINE, update)
+        user_id = update.inline_query.from_user.id
+        search = asyncio.ensure_future(cls._search(update))
+        previous_search = cls._searches.get(user_id)
+        if previous_search is not None and not previous_search.done():
+            previous_search.cancel()
+        cls._searches[user_id] = search
+        try:
+            # Unlike awaiting it, waiting for it does not raise if it is superseded
+            await asyncio.wait([search])
+        finally:
+            if not search.done():
+                search.cancel()
+            if cls._searches.get(user_id) is search:
+                del cls._searches[user_id]
+        if not search.cancelled():
+            search.result()
+
+    @classmethod
+    async def prefetch_chosen_result(cls, update: Update, context: CallbackContext):
+        """
+        Creates the entity of a chosen result in the backend, as its link is about to be sent
+        to the chat, so the link is saved without creating everything from scratch
+        """
+        entity_type, _, spotify_id = update.chosen_inline_result.result_id.partition(':')
         spotify_api_client = SpotifyAPIClient()
+        create_entity = {
+            EntityType.ARTIST.value: spotify_api_client.create_artist,
+            EntityType.ALBUM.value: spotify_api_client.create_album,
+            EntityType.TRACK.value: spotify_api_client.create_track,
+        }.get(entity_type)
+        if create_entity is None or not spotify_id:
+            return
+        metrics.increment('inline_search.prefetches')
+        await cls._prefetches.do((entity_type, spotify_id), lambda: create_entity(spotify_id))
+
+    @classmethod
+    async def wait_for_prefetch(cls, entity_type: str, spotify_id: str):
+        """
+        Waits for the entity if it is being prefetched, so it is not created twice at the same time.
+        Only the prefetches of this process are seen. With the sharded webhook, the chosen results
+        of a group chat go to the worker of the user, so its links do not wait for them
+        and the entity creation in the backend, by Spotify id, has to be idempotent
+        """
+        try:
+            await cls._prefetches.wait((entity_type, spotify_id))
+        except Exception:
+            log.warning(f'Prefetch of the {entity_type} "{spotify_id}" failed', exc_info=True)
+
+    @classmethod
+    async def _search(cls, update: Update):
         user_input = update.inline_query.query
         entity_type = cls._get_entity_type(user_input)
         if not entity_type:
             return
 
-        query = user_input.replace(entity_type, '').strip()
-        results = []
-        if len(query) >= 3:
-            pass
-            search_results = spotify_api_client.search(query, entity_type)
-            results = await cls._build_results(
-                search_results.get('results'), entity_type
-            )
-        await cls._show_search_results(results, update)
+        query = normalize(user_input.replace(entity_type, ''))
+        offset = int(update.inline_query.offset or 0)
+        cache_key = (entity_type, query)
+        results = cls._results_cache.get(cache_key)
+        if results is None:
+            # The backend results are indexed too, so the results of the queries that this one extends
+            # are reused from the index, filtered by this one
+            known_results = autocomplete_index.search(entity_type, query, cls.RESULTS_PAGE_SIZE)
+            if len(query) < cls.MIN_QUERY_LENGTH or (not offset and len(known_results) == cls.RESULTS_PAGE_SIZE):
+                # Answered right away from the known entities. Scrolling gets the backend results
+                if known_results:
+                    metrics.increment('inline_search.autocomplete_answers')
+                has_more = len(query) >= cls.MIN_QUERY_LENGTH
+                await cls._show_search_results(known_results, update, str(len(known_results)) if has_more else '')
+                return
+            # Scrolling asks for the next page of a query that the user has already stopped typing
+            if not offset:
+                await cls._debounce()
+            search_results = await cls._search_results(query, entity_type)
+            known_ids = {result.spotify_id for result in known_results}
+            results = known_results + [result for result in search_results if result.spotify_id not in known_ids]
+            cls._results_cache.set(cache_key, results)
+        page = results[offset:offset + cls.RESULTS_PAGE_SIZE]
+        next_offset = offset + cls.RESULTS_PAGE_SIZE
+        await cls._show_search_results(page, update, str(next_offset) if next_offset < len(results) else '')
+
+    @classmethod
+    async def _debounce(cls):
+        try:
+            await asyncio.sleep(cls.DEBOUNCE_DELAY)
+        except asyncio.CancelledError:
+            metrics.increment('inline_search.debounced')
+            raise
+
+    @classmethod
+    async def _search_results(cls, query: str, entity_type: str) -> List[AutocompleteEntry]:
+        try:
+            metrics.increment('inline_search.searches')
+            search_results = await SpotifyAPIClient().search(query, entity_type)
+        except asyncio.CancelledError:
+            # Only the answer is dropped. The single flight of the API client shields the request,
+            # so the backend search goes on. The searches that are avoided are the debounced ones
+            metrics.increment('inline_search.abandoned')
+            raise
+        results = [cls._get_result_entry(result, entity_type) for result in search_results.get('results')]
+        for result in results:
+            # Known, although not shared
+            autocomplete_index.add(result, weight=0)
+        return results
+
+    @classmethod
+    async def _show_search_results(cls, results: List[AutocompleteEntry], update: Update, next_offset: str = ''):
+        # The results do not depend on the user, so Telegram can show them to everyone
+        await update.inline_query.answer(
+            [cls._build_result(result) for result in results],
+            cache_time=cls.TELEGRAM_CACHE_TIME,
+            is_personal=False,
+            next_offset=next_offset,
+        )
 
     @staticmethod
-    async def _show_search_results(results: list, update: Update):
-        await update.inline_query.answer(results)
+    def _get_result_entry(result: Dict, entity_type: str) -> AutocompleteEntry:
+        thumb_url = ''
+        description = ''
+
+        if entity_type == EntityType.TRACK.value:
+            album = result['album']
+            artists = result['artists']
+            thumb_url = album['images'][0]['url']
+            description = '{} - {}'.format(
+                ', '.join(artist['name'] for artist in artists),
+                album['name'])
+        elif entity_type == EntityType.ALBUM.value:
+            thumb_url = result['images'][0]['url'] if result[
+                'images'] else ''
+            artists = result['artists']
+            description = ', '.join(artist['name'] for artist in artists)
+        elif entity_type == EntityType.ARTIST.value:
+            thumb_url = result['images'][0]['url'] if result[
+                'images'] else ''
+            description = ', '.join(result['genres'])
+
+        return AutocompleteEntry(
+            entity_type, result['id'], result['name'], description, result['external_urls']['spotify'], thumb_url
+        )
 
     @staticmethod
-    async def _build_results(search_results: [], entity_type: str) -> []:
-        results = []
-        for result in search_results:
-            thumb_url = ''
-            description = ''
-
-            if entity_type == EntityType.TRACK.value:
-                album = result['album']
-                artists = result['artists']
-                thumb_url = album['images'][0]['url']
-                description = '{} - {}'.format(
-                    ', '.join(artist['name'] for artist in artists),
-                    album['name'])
-            elif entity_type == EntityType.ALBUM.value:
-                thumb_url = result['images'][0]['url'] if result[
-                    'images'] else ''
-                artists = result['artists']
-                description = ', '.join(artist['name'] for artist in artists)
-            elif entity_type == EntityType.ARTIST.value:
-                thumb_url = result['images'][0]['url'] if result[
-                    'images'] else ''
-                description = ', '.join(result['genres'])
-
-            results.append(
-                InlineQueryResultArticle(
-                    id=result['id'],
-                    thumb_url=thumb_url,
-                    title=result['name'],
-                    description=description,
-                    input_message_content=InputTextMessageContent(
-                        result['external_urls']['spotify']
-                    )
-                )
-            )
-        return results
+    def _build_result(result: AutocompleteEntry) -> InlineQueryResultArticle:
+        return InlineQueryResultArticle(
+            # The entity type tells which entity to prefetch when the result is chosen
+            id=f'{result.entity_type}:{result.spotify_id}',
+            thumb_url=result.thumb_url,
+            title=result.name,
+            description=result.description,
+            input_message_content=InputTextMessageContent(result.url)
+        )
 
     @staticmethod
     def _get_entity_type(user_input: str) -> str:
@@ -0,0 +1,290 @@
+import asyncio
+import hmac
+import json
+import logging
+import os
+import secrets
+import signal
+from os import getenv
+from typing import Dict, List, Optional
+
+import aiohttp
+from aiohttp import web
+from telegram import Bot, Update
+from telegram.ext import Application
+
+from bot.cache import CACHE_DIR
+from bot.metrics import metrics
+from bot.webhook import WebhookServer
+
+log = logging.getLogger(__name__)
+
+
+def get_update_shard_key(data: Dict) -> int:
+    """
+    The chat of an update, from its JSON, which decides the worker that handles it.
+    Updates without a chat, like the inline queries and the chosen inline results, are sharded
+    by their user, which is the chat id of the private chat with the user
+    """
+    for value in data.values():
+        if not isinstance(value, dict):
+            continue
+        chat = value.get('chat') or (value.get('message') or {}).get('chat')
+        if chat:
+            return chat['id']
+        user = value.get('from') or value.get('user')
+        if user:
+            return user['id']
+    return data.get('update_id', 0)
+
+
+class ShardRouter:
+    """
+    Maps the chats to the shards by their id, so a chat is always handled by the same worker
+    and its caches stay hot. The chats of a shard that is down are spread among the live ones
+    until it is back, and the chats of the live shards do not move
+    """
+
+    def __init__(self, shards: int):
+        self.shards = shards
+        self._alive = [False] * shards
+
+    def set_alive(self, shard: int, alive: bool):
+        self._alive[shard] = alive
+
+    def is_alive(self, shard: int) -> bool:
+        return self._alive[shard]
+
+    def get_shard(self, key: int) -> Optional[int]:
+        """Returns the shard of the key, or None if every shard is down"""
+        shard = key % self.shards
+        if self._alive[shard]:
+            return shard
+        alive_shards = [shard for shard, alive in enumerate(self._alive) if alive]
+        if not alive_shards:
+            return None
+        return alive_shards[key % len(alive_shards)]
+
+
+class _Worker:
+
+    def __init__(self, shard: int, port: int):
+        self.shard = shard
+        self.port = port
+        self.url = f'http://127.0.0.1:{port}/'
+        self.process: Optional[asyncio.subprocess.Process] = None
+
+
+class ShardedWebhookServer:
+    """
+    Front process of the webhook that routes the updates by chat to N worker processes,
+    each of them running the whole bot application behind a WebhookServer on a local port.
+    Workers that exit are restarted, and their chats go to the live workers in the meantime.
+    Workers that are not reachable are probed until they are, in case they did not exit.
+    Every worker keeps its persistent caches in its own folder
+    """
+    WORKERS = int(getenv('WEBHOOK_WORKERS') or os.cpu_count() or 1)
+    WORKERS_PORT = int(getenv('WEBHOOK_WORKERS_PORT', 8500))
+    WORKER_RESTART_DELAY = 1
+    WORKER_START_TIMEOUT = 60
+    WORKER_STOP_TIMEOUT = 30
+    WORKER_PROBE_INTERVAL = 5
+
+    def __init__(self, worker_command: List[str], workers: int = WORKERS, workers_port: int = WORKERS_PORT,
+                 listen: str = WebhookServer.LISTEN, port: int = WebhookServer.PORT, path: str = WebhookServer.PATH,
+                 secret_token: Optional[str] = WebhookServer.SECRET_TOKEN):
+        """
+        :param worker_command: command that runs the bot, which is run in worker mode
+        """
+        self.worker_command = worker_command
+        self.listen = listen
+        self.port = port
+        self.path = path
+        self.secret_token = secret_token
+        self.router = ShardRouter(workers)
+        self._workers = [_Worker(shard, workers_port + shard) for shard in range(workers)]
+        # Secret of the requests from the front to the workers
+        self._workers_secret_token = secrets.token_urlsafe(32)
+        self._stopping = False
+        self._supervisors: List[asyncio.Task] = []
+        self._prober: Optional[asyncio.Task] = None
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._runner: Optional[web.AppRunner] = None
+
+    @staticmethod
+    def build_worker(application: Application) -> WebhookServer:
+        """The webhook of a worker process, with the settings that the front passes to it"""
+        return WebhookServer(
+            application,
+            listen='127.0.0.1',
+            port=int(getenv('WORKER_PORT')),
+            path='/',
+            secret_token=getenv('WORKER_SECRET_TOKEN'),
+        )
+
+    def build_app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post(self.path, self.handle_update)
+        if WebhookServer.METRICS_PATH:
+            # The metrics of the front. Every worker serves its own on its port
+            app.router.add_get(WebhookServer.METRICS_PATH, WebhookServer.handle_metrics)
+        return app
+
+    async def handle_update(self, request: web.Request) -> web.Response:
+        if self.secret_token is not None:
+            secret_token = request.headers.get(WebhookServer.SECRET_TOKEN_HEADER, '')
+            if not hmac.compare_digest(secret_token, self.secret_token):
+                metrics.increment('webhook.forbidden')
+                return web.Response(status=403)
+        body = await request.read()
+        try:
+            key = get_update_shard_key(json.loads(body))
+        except (ValueError, TypeError, KeyError, AttributeError):
+            metrics.increment('webhook.bad_request')
+            return web.Response(status=400)
+        return await self._forward(key, body)
+
+    async def _forward(self, key: int, body: bytes) -> web.Response:
+        is_retry = False
+        while True:
+            shard = self.router.get_shard(key)
+            if shard is None:
+                # Telegram retries the update later
+                metrics.increment('sharding.unavailable')
+                return web.Response(status=503)
+            worker = self._workers[shard]
+            try:
+                async with self._session.post(worker.url, data=body, headers={
+                    WebhookServer.SECRET_TOKEN_HEADER: self._workers_secret_token,
+                    'Content-Type': 'application/json',
+                }) as response:
+                    metrics.increment(f'sharding.worker_{shard}.updates')
+                    return web.Response(status=response.status)
+            except aiohttp.ClientConnectorError:
+                if not is_retry:
+                    # A worker with its accept backlog full refuses connections for a moment too
+                    is_retry = True
+                    continue
+                # The worker is down before its supervisor knows it, so its chats are rerouted now,
+                # until the probes find it listening again
+                log.warning(f'Worker {shard} is not reachable')
+                self.router.set_alive(shard, False)
+                is_retry = False
+            except aiohttp.ClientConnectionError:
+                # The worker got the update and the connection was lost handling it. It is not rerouted,
+                # as it could take the next worker down too, and Telegram retries it later
+                log.warning(f'Worker {shard} disconnected')
+                if not await self._is_listening(worker):
+                    self.router.set_alive(shard, False)
+                return web.Response(status=503)
+
+    async def start(self, set_webhook: bool = True):
+        self._session = aiohttp.ClientSession()
+        self._supervisors = [asyncio.create_task(self._supervise(worker)) for worker in self._workers]
+        self._prober = asyncio.create_task(self._probe())
+        metrics.start_logging()
+        self._runner = web.AppRunner(self.build_app())
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.listen, self.port).start()
+        log.info(f'Webhook listening on {self.listen}:{self.port}{self.path} with {len(self._workers)} workers')
+        if set_webhook:
+            async with Bot(getenv('TOKEN')) as bot:
+                await bot.set_webhook(
+                    url=f'{WebhookServer.URL.rstrip("/")}{self.path}',
+                    secret_token=self.secret_token,
+                    max_connections=WebhookServer.MAX_CONNECTIONS,
+                    allowed_updates=Update.ALL_TYPES,
+                )
+
+    async def stop(self):
+        """Stops receiving updates, and then lets the workers finish theirs and save their caches"""
+        self._stopping = True
+        metrics.stop_logging()
+        if self._prober is not None:
+            self._prober.cancel()
+            self._prober = None
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+        for worker in self._workers:
+            if worker.process is not None and worker.process.returncode is None:
+                worker.process.terminate()
+        if self._supervisors:
+            await asyncio.wait(self._supervisors, timeout=self.WORKER_STOP_TIMEOUT)
+        for worker in self._workers:
+            if worker.process is not None and worker.process.returncode is None:
+                log.warning(f'Worker {worker.shard} did not stop in time')
+                worker.process.kill()
+        for supervisor in self._supervisors:
+            supervisor.cancel()
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    async def _supervise(self, worker: _Worker):
+        """Runs the worker process, and restarts it every time it exits"""
+        while not self._stopping:
+            worker.process = await asyncio.create_subprocess_exec(*self.worker_command, env=dict(
+                os.environ,
+                RUN_MODE='worker',
+                WORKER_PORT=str(worker.port),
+                WORKER_SECRET_TOKEN=self._workers_secret_token,
+                CACHE_DIR=os.path.join(CACHE_DIR, f'worker_{worker.shard}'),
+            ))
+            if await self._wait_until_listening(worker):
+                # Its chats come back from the workers that had them while it was down
+                log.info(f'Worker {worker.shard} is up')
+                self.router.set_alive(worker.shard, True)
+            returncode = await worker.process.wait()
+            self.router.set_alive(worker.shard, False)
+            if not self._stopping:
+                metrics.increment('sharding.worker_restarts')
+                log.warning(f'Worker {worker.shard} exited with code {returncode}. Restarting it')
+                await asyncio.sleep(self.WORKER_RESTART_DELAY)
+
+    async def _probe(self):
+        """Brings back the workers that are running but were taken for down when an update was forwarded"""
+        while not self._stopping:
+            await asyncio.sleep(self.WORKER_PROBE_INTERVAL)
+            for worker in self._workers:
+                if self.router.is_alive(worker.shard) or worker.process is None or \
+                        worker.process.returncode is not None:
+                    continue
+                if await self._is_listening(worker):
+                    log.info(f'Worker {worker.shard} is reachable again')
+                    self.router.set_alive(worker.shard, True)
+
+    async def _wait_until_listening(self, worker: _Worker) -> bool:
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.WORKER_START_TIMEOUT
+        while worker.process.returncode is None and loop.time() < deadline:
+            if await self._is_listening(worker):
+                return True
+            await asyncio.sleep(0.1)
+        return False
+
+    @staticmethod
+    async def _is_listening(worker: _Worker) -> bool:
+        try:
+            _, writer = await asyncio.open_connection('127.0.0.1', worker.port)
+        except OSError:
+            return False
+        writer.close()
+        return True
+
+    def run(self):
+        """Serves the webhook until the process gets a stop signal, like Application.run_polling"""
+        if not WebhookServer.URL:
+            raise ValueError('WEBHOOK_URL is required to run the bot in webhook mode')
+        asyncio.run(self._serve())
+
+    async def _serve(self):
+        stop_event = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM, signal.SIGABRT):
+            loop.add_signal_handler(sig, stop_event.set)
+        try:
+            await self.start()
+            await stop_event.wait()
+        finally:
+            await self.stop()
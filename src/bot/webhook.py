@@ -0,0 +1,117 @@
+import asyncio
+import hmac
+import json
+import logging
+import signal
+from os import getenv
+from typing import Optional
+
+from aiohttp import web
+from telegram import Update
+from telegram.ext import Application
+
+from bot.metrics import metrics
+
+log = logging.getLogger(__name__)
+
+
+class WebhookServer:
+    """
+    Receives the updates that Telegram posts to the bot webhook, with an aiohttp app,
+    and puts them in the application update queue, as the polling does.
+    Telegram only posts to HTTPS urls, so the server is meant to be behind a TLS reverse proxy
+    """
+    LISTEN = getenv('WEBHOOK_LISTEN', '0.0.0.0')
+    PORT = int(getenv('WEBHOOK_PORT', 8443))
+    PATH = getenv('WEBHOOK_PATH', '/telegram')
+    # Public url of the webhook, without the path
+    URL = getenv('WEBHOOK_URL')
+    SECRET_TOKEN = getenv('WEBHOOK_SECRET_TOKEN') or None
+    MAX_CONNECTIONS = int(getenv('WEBHOOK_MAX_CONNECTIONS', 40))
+    # Path of the metrics snapshot, which is not served if it is empty
+    METRICS_PATH = getenv('WEBHOOK_METRICS_PATH', '/metrics')
+    SECRET_TOKEN_HEADER = 'X-Telegram-Bot-Api-Secret-Token'
+
+    def __init__(self, application: Application, listen: str = LISTEN, port: int = PORT, path: str = PATH,
+                 secret_token: Optional[str] = SECRET_TOKEN):
+        self.application = application
+        self.listen = listen
+        self.port = port
+        self.path = path
+        self.secret_token = secret_token
+        self._runner: Optional[web.AppRunner] = None
+
+    def build_app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post(self.path, self.handle_update)
+        if self.METRICS_PATH:
+            app.router.add_get(self.METRICS_PATH, self.handle_metrics)
+        return app
+
+    async def handle_update(self, request: web.Request) -> web.Response:
+        if self.secret_token is not None:
+            secret_token = request.headers.get(self.SECRET_TOKEN_HEADER, '')
+            if not hmac.compare_digest(secret_token, self.secret_token):
+                metrics.increment('webhook.forbidden')
+                return web.Response(status=403)
+        try:
+            data = await request.json()
+            update = Update.de_json(data, self.application.bot)
+        except (json.JSONDecodeError, TypeError, KeyError, ValueError):
+            metrics.increment('webhook.bad_request')
+            log.warning('Invalid update received in the webhook')
+            return web.Response(status=400)
+        metrics.increment('webhook.updates')
+        await self.application.update_queue.put(update)
+        # Telegram only waits for the update to be received, the handlers reply through the Bot API
+        return web.Response()
+
+    @staticmethod
+    async def handle_metrics(request: web.Request) -> web.Response:
+        return web.json_response(metrics.snapshot())
+
+    async def start(self, set_webhook: bool = True):
+        """Starts the application and the server, and sets the webhook in Telegram"""
+        await self.application.initialize()
+        if self.application.post_init:
+            await self.application.post_init(self.application)
+        await self.application.start()
+        self._runner = web.AppRunner(self.build_app())
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.listen, self.port).start()
+        log.info(f'Webhook listening on {self.listen}:{self.port}{self.path}')
+        if set_webhook:
+            await self.application.bot.set_webhook(
+                url=f'{self.URL.rstrip("/")}{self.path}',
+                secret_token=self.secret_token,
+                max_connections=self.MAX_CONNECTIONS,
+                allowed_updates=Update.ALL_TYPES,
+            )
+
+    async def stop(self):
+        """Stops the server first, so no update is received once the application is stopped"""
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+        if self.application.running:
+            await self.application.stop()
+        await self.application.shutdown()
+        if self.application.post_shutdown:
+            await self.application.post_shutdown(self.application)
+
+    def run(self, set_webhook: bool = True):
+        """Serves the webhook until the process gets a stop signal, like Application.run_polling"""
+        if set_webhook and not self.URL:
+            raise ValueError('WEBHOOK_URL is required to run the bot in webhook mode')
+        asyncio.run(self._serve(set_webhook))
+
+    async def _serve(self, set_webhook: bool):
+        stop_event = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM, signal.SIGABRT):
+            loop.add_signal_handler(sig, stop_event.set)
+        try:
+            await self.start(set_webhook)
+            await stop_event.wait()
+        finally:
+            await self.stop()
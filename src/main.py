@@ -1,14 +1,22 @@
 import sentry_sdk
 
 from telegram.ext import CommandHandler, MessageHandler, \
-    InlineQueryHandler, CallbackQueryHandler, ApplicationBuilder, filters
+    InlineQueryHandler, ChosenInlineResultHandler, CallbackQueryHandler, Application, ApplicationBuilder, filters
 from dotenv import load_dotenv
 from os import getenv
+from typing import Optional
 import logging
+import os
+import sys
 
+from bot.api_client.api_client import BaseAPIClient
+from bot.cache import PersistentLRUCache
+from bot.executor import update_executor
+from bot.metrics import metrics
 from bot.buttons import SaveLinkButton, DeleteSavedLinkButton, \
     UnfollowArtistButton
 from bot.messages import MessageProcessor
+from bot.pagination import PageButton
 from bot.commands import CommandFactory, MusicCommand, \
     MusicFromBeginningCommand, MyMusicCommand, NowPlayingCommand, \
     LastFMSetCommand, SavedLinksCommand, DeleteSavedLinksCommand, StatsCommand, \
@@ -17,6 +25,8 @@ from bot.commands import CommandFactory, MusicCommand, \
     CheckArtistsNewMusicReleasesCommand, \
     TopAlbumsCommand, TopArtistsCommand, TopTracksCommand, CollageCommand
 from bot.search import SearchInline
+from bot.sharding import ShardedWebhookServer
+from bot.webhook import WebhookServer
 
 load_dotenv()
 
@@ -27,6 +37,10 @@ logging.basicConfig(
 
 log = logging.getLogger(__name__)
 
+# How the updates are received: 'polling', 'webhook', or 'sharded' to route them by chat
+# to several worker processes. 'worker' is the mode of those processes
+RUN_MODE = getenv('RUN_MODE', 'polling')
+
 
 def _setup_sentry():
     public_key = getenv('SENTRY_PUBLIC_KEY', None)
@@ -36,14 +50,32 @@ def _setup_sentry():
         sentry_sdk.init(f"https://{public_key}@sentry.io/{project_id}")
 
 
-def main():
-    # Init app
-    _setup_sentry()
+async def _post_init(application):
+    await BaseAPIClient.open_session()
+    metrics.start_logging()
 
-    # Bot start
-    application = ApplicationBuilder().token(
+
+async def _post_shutdown(application):
+    metrics.stop_logging()
+    PersistentLRUCache.save_all()
+    await BaseAPIClient.close_session()
+
+
+def build_application(base_url: Optional[str] = None) -> Application:
+    """
+    Builds the bot application with all its handlers.
+    :param base_url: url of the Bot API, if it is not the Telegram one
+    """
+    builder = ApplicationBuilder().token(
         getenv("TOKEN")
-    ).concurrent_updates(True).build()
+    ).concurrent_updates(True).post_init(
+        _post_init
+    ).post_shutdown(
+        _post_shutdown
+    )
+    if base_url:
+        builder = builder.base_url(base_url)
+    application = builder.build()
 
     # Register commands
     application.add_handler(
@@ -178,6 +210,12 @@ def main():
             block=False
         )
     )
+    application.add_handler(
+        ChosenInlineResultHandler(
+            SearchInline.prefetch_chosen_result,
+            block=False
+        )
+    )
     application.add_handler(
         CallbackQueryHandler(
             SaveLinkButton.handle,
@@ -199,6 +237,13 @@ def main():
             block=False
         )
     )
+    application.add_handler(
+        CallbackQueryHandler(
+            PageButton.handle,
+            pattern=f'{PageButton.CALLBACK_NAME}',
+            block=False
+        )
+    )
 
     # Non command handlers
     application.add_handler(
@@ -209,8 +254,31 @@ def main():
         )
     )
 
-    # Start the bot
-    application.run_polling()
+    # Per chat order and concurrency caps of the handlers
+    update_executor.install(application, heavy_callbacks=[
+        CommandFactory.run_collage_command,
+        CommandFactory.run_my_music_command,
+        CommandFactory.run_check_artist_new_music_releases_command,
+    ])
+
+    return application
+
+
+def main():
+    # Init app
+    _setup_sentry()
+
+    # Bot start
+    if RUN_MODE == 'sharded':
+        ShardedWebhookServer([sys.executable, os.path.abspath(__file__)]).run()
+        return
+    application = build_application()
+    if RUN_MODE == 'webhook':
+        WebhookServer(application).run()
+    elif RUN_MODE == 'worker':
+        ShardedWebhookServer.build_worker(application).run(set_webhook=False)
+    else:
+        application.run_polling()
 
 
 if __name__ == '__main__':
@@ -1,3 +1,129 @@
+import asyncio
+
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+from bot.api_client.api_client import BaseAPIClient
+from bot.cache import PersistentLRUCache
+from bot.music.spotify import SpotifyLink, SpotifyUtils
+from bot.single_flight import SingleFlight
+
+TRACK_URL = 'https://open.spotify.com/track/4uLU6hMCjMI75M1A2tKUQC'
+
+
 def test_search():
     # TODO: Not implemented
     pass
+
+
+def test_parse_url():
+    link = SpotifyUtils.parse_url('Listen https://open.spotify.com/intl-es/track/4uLU6hMCjMI75M1A2tKUQC?si=abc')
+    assert link == SpotifyLink(
+        service='SPOTIFY',
+        link_type='track',
+        entity_id='4uLU6hMCjMI75M1A2tKUQC',
+        url='https://open.spotify.com/track/4uLU6hMCjMI75M1A2tKUQC',
+    )
+
+
+def test_parse_url_does_not_misclassify_ids():
+    link = SpotifyUtils.parse_url('https://open.spotify.com/track/0albumartist0')
+    assert link.link_type == 'track'
+    assert link.entity_id == '0albumartist0'
+
+
+def test_parse_uri():
+    link = SpotifyUtils.parse_url('spotify:album:1DFixLWuPkv3KT3TnV35m3')
+    assert link.link_type == 'album'
+    assert link.url == 'https://open.spotify.com/album/1DFixLWuPkv3KT3TnV35m3'
+
+
+def test_parse_shortcut_url():
+    link = SpotifyUtils.parse_url('https://spotify.link/AbC123')
+    assert link.is_shortcut
+    assert link.url == 'https://spotify.link/AbC123'
+
+
+def test_parse_invalid_urls():
+    assert SpotifyUtils.parse_url('https://open.spotify.com/playlist/37i9dQZF1DXcBWIGoYBM5M') is None
+    assert SpotifyUtils.parse_url('https://example.com/track/abc') is None
+
+
+def _build_shortcut_app(requests):
+    """Redirect service whose requests are recorded as (method, path)"""
+
+    @web.middleware
+    async def record(request, handler):
+        requests.append((request.method, request.path))
+        return await handler(request)
+
+    async def redirect_to_track(request):
+        return web.Response(status=302, headers={'Location': TRACK_URL})
+
+    async def redirect_to_hop(request):
+        return web.Response(status=302, headers={'Location': '/hop'})
+
+    async def method_not_allowed(request):
+        return web.Response(status=405)
+
+    app = web.Application(middlewares=[record])
+    app.router.add_route('HEAD', '/get-only', method_not_allowed)
+    app.router.add_get('/get-only', redirect_to_track, allow_head=False)
+    app.router.add_get('/relative', redirect_to_hop)
+    app.router.add_get('/hop', redirect_to_track)
+    return app
+
+
+def _resolve_shortcut_urls(monkeypatch, cache_path, paths):
+    """
+    Resolves the shortcut urls of the paths, one after another, against a local redirect service.
+    Returns the (shortcut url, url) pairs and the requests of the service
+    """
+    requests = []
+    monkeypatch.setattr(PersistentLRUCache, '_instances', [])
+    monkeypatch.setattr(SpotifyUtils, '_shortcut_urls', PersistentLRUCache(str(cache_path), save_every=1))
+    monkeypatch.setattr(SpotifyUtils, '_shortcut_urls_single_flight', SingleFlight())
+
+    async def run():
+        async with TestServer(_build_shortcut_app(requests)) as server:
+            try:
+                resolved = []
+                for path in paths:
+                    shortcut_url = str(server.make_url(path))
+                    resolved.append((shortcut_url, await SpotifyUtils.get_url_from_shortcut_url(shortcut_url)))
+                return resolved
+            finally:
+                await BaseAPIClient.close_session()
+
+    return asyncio.run(run()), requests
+
+
+def test_shortcut_urls_are_resolved_with_get_when_head_has_no_redirect(monkeypatch, tmp_path):
+    resolved, requests = _resolve_shortcut_urls(monkeypatch, tmp_path / 'urls.json', ['/get-only'])
+    assert [url for _, url in resolved] == [TRACK_URL]
+    assert requests == [('HEAD', '/get-only'), ('GET', '/get-only')]
+
+
+def test_shortcut_urls_follow_relative_redirects(monkeypatch, tmp_path):
+    resolved, requests = _resolve_shortcut_urls(monkeypatch, tmp_path / 'urls.json', ['/relative'])
+    assert [url for _, url in resolved] == [TRACK_URL]
+    assert requests == [('HEAD', '/relative'), ('HEAD', '/hop')]
+
+
+def test_resolved_shortcut_urls_are_cached_across_restarts(monkeypatch, tmp_path):
+    cache_path = tmp_path / 'urls.json'
+    resolved, requests = _resolve_shortcut_urls(monkeypatch, cache_path, ['/relative', '/relative'])
+    assert [url for _, url in resolved] == [TRACK_URL, TRACK_URL]
+    # The second one is a cache hit
+    assert requests == [('HEAD', '/relative'), ('HEAD', '/hop')]
+
+    shortcut_url = resolved[0][0]
+    assert PersistentLRUCache(str(cache_path)).get(shortcut_url) == TRACK_URL
+
+
+def test_unresolvable_shortcut_urls_are_not_cached(monkeypatch, tmp_path):
+    resolved, requests = _resolve_shortcut_urls(monkeypatch, tmp_path / 'urls.json', ['/dead', '/dead'])
+    # The shortcut url is returned as it is
+    assert [url for url, _ in resolved] == [url for _, url in resolved]
+    assert requests == [('HEAD', '/dead'), ('GET', '/dead')] * 2
+    assert len(SpotifyUtils._shortcut_urls) == 0
@@ -0,0 +1,150 @@
+import asyncio
+import time
+
+import pytest
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+from bot.api_client.api_client import BaseAPIClient, SpooledResponseFile
+from bot.api_client.lastfm_api_client import LastfmAPIClient
+from bot.cache import LRUCache
+from bot.metrics import metrics
+
+IMAGE = bytes(range(256)) * 1024
+
+
+async def _get_image(request):
+    return web.Response(body=IMAGE, content_type='image/png')
+
+
+async def _get_truncated_image(request):
+    response = web.StreamResponse(headers={'Content-Type': 'image/png', 'Content-Length': str(len(IMAGE))})
+    await response.prepare(request)
+    await response.write(IMAGE[:len(IMAGE) // 2])
+    request.transport.close()
+    return response
+
+
+def _stream(monkeypatch, path, memory_threshold):
+    """Streams the response of the path with a client that keeps up to `memory_threshold` bytes in memory"""
+    monkeypatch.setattr(BaseAPIClient, 'STREAM_MEMORY_THRESHOLD', memory_threshold)
+    monkeypatch.setattr(BaseAPIClient, 'token', None)
+    metrics.reset()
+
+    async def run():
+        app = web.Application()
+        app.router.add_get('/image', _get_image)
+        app.router.add_get('/truncated_image', _get_truncated_image)
+        async with TestServer(app) as server:
+            try:
+                return await BaseAPIClient().process_request(str(server.make_url(path)), stream=True)
+            finally:
+                await BaseAPIClient.close_session()
+
+    return asyncio.run(run())
+
+
+def test_small_responses_are_spooled_in_memory(monkeypatch):
+    with _stream(monkeypatch, '/image', memory_threshold=len(IMAGE)) as spooled_file:
+        assert not spooled_file._rolled
+        assert spooled_file.name == 'file.png'
+        assert spooled_file.read() == IMAGE
+    assert spooled_file.closed
+    assert metrics.timings['api_client.stream.spooled_memory_bytes']['max'] == len(IMAGE)
+
+
+def test_big_responses_are_spooled_to_disk(monkeypatch):
+    with _stream(monkeypatch, '/image', memory_threshold=64 * 1024) as spooled_file:
+        assert spooled_file._rolled
+        assert spooled_file.read() == IMAGE
+    assert spooled_file.closed
+    assert 64 * 1024 < metrics.timings['api_client.stream.spooled_memory_bytes']['max'] < len(IMAGE)
+
+
+def test_the_spooled_file_is_closed_when_the_download_fails(monkeypatch):
+    spooled_files = []
+    init = SpooledResponseFile.__init__
+
+    def spooled_response_file(self, *args, **kwargs):
+        init(self, *args, **kwargs)
+        spooled_files.append(self)
+
+    monkeypatch.setattr(SpooledResponseFile, '__init__', spooled_response_file)
+
+    with pytest.raises(Exception):
+        _stream(monkeypatch, '/truncated_image', memory_threshold=64 * 1024)
+    assert len(spooled_files) == 1
+    assert spooled_files[0].closed
+
+
+def _run_with_lastfm_api(monkeypatch, test):
+    """Runs the test with a local Last.fm API, and returns the paths that the API got requests for"""
+    requested_paths = []
+
+    async def get_top(request):
+        requested_paths.append(request.path)
+        return web.json_response({'period': request.query.get('period')})
+
+    async def set_lastfm_user(request):
+        requested_paths.append(request.path)
+        return web.json_response({'username': 'username'})
+
+    monkeypatch.setattr(BaseAPIClient, 'token', None)
+    monkeypatch.setattr(BaseAPIClient, 'cache', LRUCache())
+
+    async def run():
+        app = web.Application()
+        app.router.add_get('/lastfm/users/{user_id}/{top}/', get_top)
+        app.router.add_post('/lastfm/users/set-lastfm-user/', set_lastfm_user)
+        app.router.add_get('/lastfm/now-playing/{user_id}/', get_top)
+        async with TestServer(app) as server:
+            monkeypatch.setattr(BaseAPIClient, 'url', str(server.make_url('/')))
+            try:
+                await test(LastfmAPIClient())
+            finally:
+                await BaseAPIClient.close_session()
+
+    asyncio.run(run())
+    return requested_paths
+
+
+def test_tops_are_cached_for_the_ttl_of_their_period(monkeypatch):
+    async def test(client):
+        for period in LastfmAPIClient.PERIODS:
+            assert await client.get_top_albums('1', period) == {'period': period}
+            assert await client.get_top_albums('1', period) == {'period': period}
+        # Endpoints without a TTL are not cached
+        await client.get_now_playing('1')
+        await client.get_now_playing('1')
+        now = time.monotonic()
+        for (url, params, _, _), (_, expires_at, _) in BaseAPIClient.cache._entries.items():
+            ttl = LastfmAPIClient.PERIOD_CACHE_TTLS[dict(params)['period']]
+            assert now < expires_at <= now + ttl
+
+    requested_paths = _run_with_lastfm_api(monkeypatch, test)
+    assert requested_paths == ['/lastfm/users/1/top-albums/'] * len(LastfmAPIClient.PERIODS) + \
+        ['/lastfm/now-playing/1/'] * 2
+
+
+def test_setting_the_lastfm_user_only_drops_the_cached_tops_of_the_user(monkeypatch):
+    async def test(client):
+        for user_id in ('1', '2'):
+            await client.get_top_artists(user_id)
+        await client.set_lastfm_user('1', 'username')
+        for user_id in ('1', '2'):
+            await client.get_top_artists(user_id)
+
+    requested_paths = _run_with_lastfm_api(monkeypatch, test)
+    assert requested_paths == [
+        '/lastfm/users/1/top-artists/',
+        '/lastfm/users/2/top-artists/',
+        '/lastfm/users/set-lastfm-user/',
+        '/lastfm/users/1/top-artists/',
+    ]
+
+
+def test_cache_and_single_flight_stats_are_in_the_metrics():
+    snapshot = metrics.snapshot()
+
+    assert snapshot['sources']['api_client.cache'] == BaseAPIClient.cache.stats()
+    assert snapshot['sources']['api_client.single_flight'] == BaseAPIClient.single_flight.stats()
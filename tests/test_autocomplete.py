@@ -0,0 +1,61 @@
+from bot.autocomplete import AutocompleteEntry, AutocompleteIndex, get_link_entry
+
+
+def _entry(spotify_id, name, entity_type='artist'):
+    return AutocompleteEntry(entity_type, spotify_id, name, '', f'https://open.spotify.com/{entity_type}/{spotify_id}')
+
+
+def test_names_are_found_by_any_of_their_words():
+    index = AutocompleteIndex()
+    index.add(_entry('1', 'Bad Bunny'))
+    index.add(_entry('2', 'The Bad Plus'))
+    index.add(_entry('3', 'Bad Bunny', entity_type='album'))
+    assert [entry.spotify_id for entry in index.search('artist', 'bad', 10)] == ['1', '2']
+    assert [entry.spotify_id for entry in index.search('artist', 'BUN', 10)] == ['1']
+    assert [entry.spotify_id for entry in index.search('artist', 'bad bunny', 10)] == ['1']
+    assert index.search('artist', 'unny', 10) == []
+
+
+def test_most_shared_entities_come_first():
+    index = AutocompleteIndex()
+    index.add(_entry('1', 'Rosalía'))
+    index.add(_entry('2', 'Rosa Linn'))
+    index.add(_entry('2', 'Rosa Linn'))
+    assert [entry.spotify_id for entry in index.search('artist', 'ros', 1)] == ['2']
+
+
+def test_renamed_entities_are_found_by_their_new_name():
+    index = AutocompleteIndex()
+    index.add(_entry('1', 'Old name'))
+    index.add(_entry('1', 'New name'))
+    assert index.search('artist', 'old', 10) == []
+    assert [entry.name for entry in index.search('artist', 'name', 10)] == ['New name']
+
+
+def test_compaction_drops_the_least_shared_entities():
+    index = AutocompleteIndex(max_entries=10)
+    for number in range(10):
+        index.add(_entry(str(number), f'Artist {number}'), weight=number + 1)
+    index.add(_entry('10', 'Artist 10'), weight=100)
+    assert len(index) == 9
+    assert index.search('artist', 'artist 0', 10) == []
+    assert index.search('artist', 'artist 1', 10)[0].spotify_id == '10'
+
+
+def test_link_entry():
+    link = {
+        'link_type': 'track',
+        'url': 'https://open.spotify.com/track/abc',
+        'track': {'name': 'Song', 'artists': [{'name': 'Artist'}], 'album': {'name': 'Album'}},
+    }
+    assert get_link_entry(link) == AutocompleteEntry('track', 'abc', 'Song', 'Artist - Album', link['url'])
+
+
+def test_updates_keep_the_fields_that_the_entry_lacks():
+    index = AutocompleteIndex()
+    index.add(_entry('1', 'Bad Bunny')._replace(description='reggaeton', thumb_url='https://i.scdn.co/1'))
+    index.add(_entry('1', 'Bad Bunny'))
+
+    entry, = index.search('artist', 'bad', 10)
+    assert entry.description == 'reggaeton'
+    assert entry.thumb_url == 'https://i.scdn.co/1'
@@ -0,0 +1,57 @@
+import time
+
+from bot.cache import LRUCache, PersistentLRUCache
+
+
+def test_lru_eviction_by_entries():
+    cache = LRUCache(max_entries=2)
+    cache.set('a', 1)
+    cache.set('b', 2)
+    cache.get('a')
+    cache.set('c', 3)
+    assert 'a' in cache
+    assert 'b' not in cache
+    assert cache.evictions == 1
+
+
+def test_lru_eviction_by_bytes():
+    cache = LRUCache(max_entries=10, max_bytes=10)
+    cache.set('a', 1, size=6)
+    cache.set('b', 2, size=6)
+    assert 'a' not in cache
+    assert cache.size_bytes == 6
+    cache.set('c', 3, size=11)
+    assert 'c' not in cache
+
+
+def test_ttl_expiration():
+    cache = LRUCache()
+    cache.set('a', 1, ttl=0.01)
+    assert cache.get('a') == 1
+    time.sleep(0.02)
+    assert cache.get('a') is None
+    assert cache.stats()['hits'] == 1
+    assert cache.stats()['misses'] == 1
+
+
+def test_invalidate():
+    cache = LRUCache()
+    cache.set(('url/a', 1), 1)
+    cache.set(('url/b', 1), 2)
+    assert cache.invalidate(lambda key: key[0].startswith('url/a')) == 1
+    assert len(cache) == 1
+
+
+def test_persistent_cache_survives_restarts(tmp_path):
+    path = str(tmp_path / 'cache.json')
+    cache = PersistentLRUCache(path, max_entries=2)
+    cache.set('a', 'x')
+    cache.set('b', 'y')
+    cache.get('a')
+    cache.save()
+
+    cache = PersistentLRUCache(path, max_entries=2)
+    assert cache.get('a') == 'x'
+    cache.set('c', 'z')
+    # b was the least recently used entry before the restart
+    assert 'b' not in cache
@@ -0,0 +1,87 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+from telegram.error import BadRequest
+
+from bot import commands as commands_module
+from bot.api_client.telegram_api_client import TelegramAPIClient
+from bot.commands import CollageCommand, MusicCommand, MusicFromBeginningCommand, MyMusicCommand, SavedLinksCommand
+from bot.pagination import SentLinksPageView
+from bot.reply import ReplyType
+
+
+def _sent_link(number):
+    return {
+        'sent_at': '2023-05-01T10:00:00+00:00',
+        'sent_by': {'username': f'user{number % 2}', 'first_name': 'User'},
+        'chat': {'name': 'Chat'},
+        'link': {
+            'id': number,
+            'link_type': 'artist',
+            'url': f'https://open.spotify.com/artist/{number}',
+            'artist': {'name': f'Artist {number}', 'genres': []},
+        },
+    }
+
+
+@pytest.mark.parametrize('command', [MusicCommand, MusicFromBeginningCommand, MyMusicCommand])
+def test_sent_links_commands_render_a_page(monkeypatch, command):
+    async def iter_sent_links(self, page_size, offset=0, **filters):
+        for number in range(offset, min(3, offset + page_size)):
+            yield _sent_link(number)
+
+    monkeypatch.setattr(TelegramAPIClient, 'iter_sent_links', iter_sent_links)
+
+    async def run():
+        return await SentLinksPageView({}, command._build_page_message).get_page(0)
+
+    message, reply_markup = asyncio.run(run())
+    assert all(f'Artist {number}' in message for number in range(3))
+    assert reply_markup is None
+
+
+def test_saved_links_rows_keep_the_parentheses_without_genres():
+    saved_link = {'saved_at': '2023-05-01T10:00:00+00:00', 'link': _sent_link(1)['link']}
+
+    message = SavedLinksCommand._build_message([saved_link])
+
+    assert '<a href="https://open.spotify.com/artist/1">Artist 1</a> (). Saved at: 2023/05/01' in message.build()
+
+
+def _build_collage_command(*args):
+    update = SimpleNamespace(message=SimpleNamespace(from_user=SimpleNamespace(id=5)))
+    return CollageCommand(update, SimpleNamespace(args=list(args)))
+
+
+def test_collage_cache_key(monkeypatch):
+    monkeypatch.setattr(commands_module.time, 'time', lambda: 10 * 60 * 60 + 15 * 60)
+
+    cache_key, ttl = _build_collage_command('3', '4', '1month')._get_cache_key()
+
+    # The 3 hours bucket that began at 9:00 ends at 12:00
+    assert cache_key == (5, 3, 4, '1month', 3)
+    assert ttl == 105 * 60
+    assert _build_collage_command()._get_cache_key()[0] == (5, 5, 5, '7day', 10)
+    assert _build_collage_command('a')._get_cache_key() == (None, None)
+    assert _build_collage_command('3', '3', 'forever')._get_cache_key() == (None, None)
+
+
+@pytest.mark.parametrize('error, is_replied', [(None, True), (BadRequest('Wrong file identifier'), False)])
+def test_reply_cached_collage(monkeypatch, error, is_replied):
+    replies = []
+
+    async def reply(self, update, context, message, reply_type=ReplyType.TEXT, image=None, **kwargs):
+        replies.append((reply_type, image))
+        if error:
+            raise error
+
+    monkeypatch.setattr(CollageCommand, 'reply', reply)
+    CollageCommand._collages.clear()
+    command = _build_collage_command()
+    CollageCommand._collages.set(('key',), 'file_id')
+
+    assert asyncio.run(command._reply_cached_collage(('missing',))) is False
+    assert asyncio.run(command._reply_cached_collage(('key',))) is is_replied
+    assert replies == [(ReplyType.IMAGE, 'file_id')]
+    assert (CollageCommand._collages.get(('key',)) == 'file_id') is is_replied
@@ -0,0 +1,77 @@
+import asyncio
+
+from bot.executor import UpdateExecutor
+from bot.metrics import metrics
+
+
+def test_handlers_of_a_chat_run_in_order():
+    finished = []
+
+    async def run():
+        executor = UpdateExecutor(max_concurrency=10, heavy_max_concurrency=1)
+
+        async def handler(chat_id, index, delay):
+            await asyncio.sleep(delay)
+            finished.append((chat_id, index))
+
+        await asyncio.gather(*[
+            executor.run(executor._light, chat_id, lambda c=chat_id, i=index: handler(c, i, 0.02 / (i + 1)))
+            for index in range(3) for chat_id in (1, 2)
+        ])
+        assert executor._chats == {}
+
+    asyncio.run(run())
+    assert [index for chat_id, index in finished if chat_id == 1] == [0, 1, 2]
+    assert [index for chat_id, index in finished if chat_id == 2] == [0, 1, 2]
+
+
+def test_heavy_handlers_are_capped_apart():
+    running = {'light': 0, 'heavy': 0}
+    max_running = {'light': 0, 'heavy': 0}
+
+    async def run():
+        executor = UpdateExecutor(max_concurrency=3, heavy_max_concurrency=1)
+
+        async def handler(name):
+            running[name] += 1
+            max_running[name] = max(max_running[name], running[name])
+            await asyncio.sleep(0.01)
+            running[name] -= 1
+
+        await asyncio.gather(*(
+            [executor.run(executor._heavy, None, lambda: handler('heavy')) for _ in range(4)] +
+            [executor.run(executor._light, None, lambda: handler('light')) for _ in range(6)]
+        ))
+
+    asyncio.run(run())
+    assert max_running == {'light': 3, 'heavy': 1}
+    assert metrics.gauges['update_executor.heavy.queued'] == 0
+    assert metrics.timings['update_executor.heavy.wait']['max'] > 0
+
+
+def test_handlers_waiting_for_their_chat_do_not_hold_slots():
+    started = []
+
+    async def run():
+        executor = UpdateExecutor(max_concurrency=2, heavy_max_concurrency=1)
+
+        async def handler(chat_id):
+            started.append(chat_id)
+            await asyncio.sleep(0.01)
+
+        chat_1_handlers = [executor.run(executor._light, 1, lambda: handler(1)) for _ in range(4)]
+        await asyncio.gather(*chat_1_handlers, executor.run(executor._light, 2, lambda: handler(2)))
+
+    asyncio.run(run())
+    assert started[:2] == [1, 2]
+
+
+def test_executor_can_be_created_outside_the_loop():
+    # Like the executor of the module, created on import
+    executor = UpdateExecutor(max_concurrency=1, heavy_max_concurrency=1)
+
+    async def run():
+        await asyncio.gather(*[executor.run(executor._light, None, lambda: asyncio.sleep(0.001)) for _ in range(3)])
+        return executor._light.running
+
+    assert asyncio.run(run()) == 0
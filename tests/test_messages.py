@@ -0,0 +1,191 @@
+import asyncio
+from types import SimpleNamespace
+
+from bot import messages as messages_module
+from bot.autocomplete import AutocompleteEntry, AutocompleteIndex
+from bot.messages import MessageProcessor, UrlProcessor
+from bot.music.spotify import SpotifyLink
+
+URL = 'https://open.spotify.com/artist/1'
+
+
+def _sent_link():
+    return {
+        'link': {
+            'id': 1,
+            'link_type': 'artist',
+            'url': URL,
+            'artist': {'spotify_id': '1', 'name': 'Bad Bunny', 'genres': [{'name': 'reggaeton'}]},
+        },
+    }
+
+
+def _build_url_processor(monkeypatch, saved_links, replies, save_delay=0):
+    async def save_user(self, user):
+        return {'id': user.id}
+
+    async def save_chat(self, chat):
+        return {'id': chat.id}
+
+    async def save_link(url, user_id, chat_id):
+        await asyncio.sleep(save_delay)
+        saved_links.append(url)
+        return _sent_link()
+
+    async def build_message(self, sent_link, send_preview=True):
+        replies.append(send_preview)
+
+    monkeypatch.setattr(UrlProcessor, 'save_user', save_user)
+    monkeypatch.setattr(UrlProcessor, 'save_chat', save_chat)
+    monkeypatch.setattr(UrlProcessor, 'save_link', staticmethod(save_link))
+    monkeypatch.setattr(UrlProcessor, '_build_message', build_message)
+    message = SimpleNamespace(chat_id=10, from_user=SimpleNamespace(id=5), chat=SimpleNamespace(id=10))
+    update = SimpleNamespace(message=message, effective_user=message.from_user, effective_chat=message.chat)
+    return UrlProcessor(update, None, [SpotifyLink('spotify', 'artist', '1', URL)])
+
+
+def test_saved_links_are_added_to_the_autocomplete_index(monkeypatch):
+    index = AutocompleteIndex()
+    index.add(AutocompleteEntry('artist', '1', 'Bad Bunny', '', URL, 'https://i.scdn.co/1'), weight=0)
+    monkeypatch.setattr(messages_module, 'autocomplete_index', index)
+    monkeypatch.setattr(UrlProcessor, 'log_url_processing', lambda *args: None)
+    UrlProcessor._recent_links.clear()
+
+    asyncio.run(_build_url_processor(monkeypatch, [], []).process())
+
+    entry, = index.search('artist', 'bad', 10)
+    assert entry == AutocompleteEntry('artist', '1', 'Bad Bunny', 'reggaeton', URL, 'https://i.scdn.co/1')
+    assert index._weights[('artist', '1')] == 1
+
+
+def test_links_sent_again_in_the_window_reply_without_waiting_nor_preview(monkeypatch):
+    monkeypatch.setattr(messages_module, 'autocomplete_index', AutocompleteIndex())
+    monkeypatch.setattr(UrlProcessor, 'log_url_processing', lambda *args: None)
+    UrlProcessor._recent_links.clear()
+    saved_links = []
+    replies = []
+
+    async def run():
+        await _build_url_processor(monkeypatch, saved_links, replies).process()
+        await _build_url_processor(monkeypatch, saved_links, replies, save_delay=0.05).process()
+        # The repeated link is recorded in the background
+        assert saved_links == [URL]
+        await asyncio.gather(*UrlProcessor._background_tasks)
+
+    asyncio.run(run())
+    assert saved_links == [URL, URL]
+    assert replies == [True, False]
+
+
+def test_links_are_not_repeated_out_of_the_window(monkeypatch):
+    monkeypatch.setattr(messages_module, 'autocomplete_index', AutocompleteIndex())
+    monkeypatch.setattr(UrlProcessor, 'log_url_processing', lambda *args: None)
+    UrlProcessor._recent_links.clear()
+    saved_links = []
+    replies = []
+
+    async def run():
+        await _build_url_processor(monkeypatch, saved_links, replies).process()
+        UrlProcessor._recent_links.clear()
+        await _build_url_processor(monkeypatch, saved_links, replies).process()
+
+    asyncio.run(run())
+    assert saved_links == [URL, URL]
+    assert replies == [True, True]
+
+
+def _artist_sent_link(url):
+    artist_id = url.rsplit('/', 1)[-1]
+    return {
+        'link': {
+            'id': artist_id,
+            'link_type': 'artist',
+            'url': url,
+            'artist': {'spotify_id': artist_id, 'name': f'Simon & <Garfunkel> {artist_id}', 'genres': []},
+        },
+    }
+
+
+def _process_message(monkeypatch, text, failing_urls=()):
+    """Processes a message and returns the urls that were saved, the most saved at the same time and the replies"""
+    saved_urls = []
+    saving = []
+    max_saving = []
+    replies = []
+
+    async def save_user(self, user):
+        return {'id': user.id}
+
+    async def save_chat(self, chat):
+        return {'id': chat.id}
+
+    async def save_link(url, user_id, chat_id):
+        saving.append(url)
+        max_saving.append(len(saving))
+        await asyncio.sleep(0.001)
+        saving.remove(url)
+        if url in failing_urls:
+            raise ValueError('The backend failed')
+        saved_urls.append(url)
+        return _artist_sent_link(url)
+
+    async def reply(self, update, context, message, **kwargs):
+        replies.append(message)
+
+    monkeypatch.setattr(messages_module, 'autocomplete_index', AutocompleteIndex())
+    monkeypatch.setattr(UrlProcessor, 'log_url_processing', lambda *args: None)
+    monkeypatch.setattr(UrlProcessor, 'save_user', save_user)
+    monkeypatch.setattr(UrlProcessor, 'save_chat', save_chat)
+    monkeypatch.setattr(UrlProcessor, 'save_link', staticmethod(save_link))
+    monkeypatch.setattr(UrlProcessor, 'reply', reply)
+    UrlProcessor._recent_links.clear()
+    message = SimpleNamespace(
+        text=text, chat_id=10, from_user=SimpleNamespace(id=5), chat=SimpleNamespace(id=10)
+    )
+    update = SimpleNamespace(message=message, effective_user=message.from_user, effective_chat=message.chat)
+    asyncio.run(MessageProcessor.process_message(update, None))
+    return saved_urls, max(max_saving, default=0), replies
+
+
+def test_links_of_a_message_are_extracted_without_duplicates():
+    text = 'https://open.spotify.com/artist/1 spotify:artist:2 https://open.spotify.com/artist/1?si=a'
+
+    links = UrlProcessor.extract_links_from_message(text)
+
+    assert [link.entity_id for link in links] == ['1', '2']
+    assert len(UrlProcessor.extract_links_from_message(
+        ' '.join(f'spotify:artist:{number}' for number in range(30))
+    )) == UrlProcessor.MAX_LINKS_PER_MESSAGE
+
+
+def test_links_of_a_message_get_a_single_reply(monkeypatch):
+    text = 'https://open.spotify.com/artist/1 https://open.spotify.com/artist/2 https://open.spotify.com/artist/1'
+
+    saved_urls, _, replies = _process_message(monkeypatch, text)
+
+    assert sorted(saved_urls) == ['https://open.spotify.com/artist/1', 'https://open.spotify.com/artist/2']
+    reply, = replies
+    # The names are escaped for the HTML parse mode
+    assert 'Simon &amp; &lt;Garfunkel&gt; 1' in reply
+    assert 'Simon &amp; &lt;Garfunkel&gt; 2' in reply
+
+
+def test_links_of_a_message_are_saved_with_a_concurrency_cap(monkeypatch):
+    text = ' '.join(f'https://open.spotify.com/artist/{number}' for number in range(12))
+
+    saved_urls, max_saving, replies = _process_message(monkeypatch, text)
+
+    assert len(saved_urls) == 12
+    assert max_saving == UrlProcessor.MAX_CONCURRENT_LINKS
+    assert len(replies) == 1
+
+
+def test_links_that_fail_are_skipped(monkeypatch):
+    text = ' '.join(f'https://open.spotify.com/artist/{number}' for number in range(3))
+
+    saved_urls, _, replies = _process_message(monkeypatch, text, failing_urls=['https://open.spotify.com/artist/1'])
+
+    assert sorted(saved_urls) == ['https://open.spotify.com/artist/0', 'https://open.spotify.com/artist/2']
+    reply, = replies
+    assert 'Garfunkel&gt; 0' in reply and 'Garfunkel&gt; 2' in reply
+    assert 'Garfunkel&gt; 1' not in reply
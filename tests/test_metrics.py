@@ -0,0 +1,36 @@
+import asyncio
+import logging
+
+from bot.metrics import Metrics
+
+
+def test_snapshot_reads_the_sources():
+    metrics = Metrics()
+    hits = []
+    metrics.add_source('cache', lambda: {'hits': len(hits)})
+    metrics.increment('updates')
+    metrics.observe('wait', 2)
+    metrics.observe('wait', 4)
+    hits.append(1)
+
+    assert metrics.snapshot() == {
+        'counters': {'updates': 1},
+        'gauges': {},
+        'timings': {'wait': {'count': 2, 'total': 6.0, 'max': 4, 'avg': 3.0}},
+        'sources': {'cache': {'hits': 1}},
+    }
+
+
+def test_snapshots_are_logged_periodically(caplog):
+    metrics = Metrics()
+    metrics.increment('updates')
+
+    async def run():
+        metrics.start_logging(interval=0.01)
+        await asyncio.sleep(0.05)
+        metrics.stop_logging()
+
+    with caplog.at_level(logging.INFO, logger='bot.metrics'):
+        asyncio.run(run())
+    assert caplog.records
+    assert all('"updates": 1' in record.getMessage() for record in caplog.records)
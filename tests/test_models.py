@@ -0,0 +1,28 @@
+import asyncio
+from types import SimpleNamespace
+
+from bot.api_client.telegram_api_client import TelegramAPIClient
+from bot.models import SaveTelegramEntityMixin
+
+
+def test_users_are_only_posted_again_when_they_change(monkeypatch):
+    posted_users = []
+
+    async def create_user(self, user):
+        posted_users.append(user.username)
+        return {'id': user.id, 'username': user.username}
+
+    monkeypatch.setattr(TelegramAPIClient, 'create_user', create_user)
+    SaveTelegramEntityMixin._known_entities.clear()
+
+    async def run():
+        responses = []
+        for username in ('user', 'user', 'renamed_user'):
+            user = SimpleNamespace(id=1, username=username, first_name='User')
+            responses.append(await SaveTelegramEntityMixin.save_user(user))
+        return responses
+
+    responses = asyncio.run(run())
+    assert posted_users == ['user', 'renamed_user']
+    assert responses[1] is responses[0]
+    assert responses[2] == {'id': 1, 'username': 'renamed_user'}
@@ -0,0 +1,67 @@
+import asyncio
+
+from bot.api_client.telegram_api_client import TelegramAPIClient
+from bot.pagination import PageButton, SentLinksPageView
+from bot.rendering import MessageBuilder
+
+
+def test_keyboard_markup():
+    assert PageButton.get_keyboard_markup(0, False) is None
+    first_page = PageButton.get_keyboard_markup(0, True).inline_keyboard[0]
+    assert [button.callback_data for button in first_page] == ['sent_links_page:1']
+    middle_page = PageButton.get_keyboard_markup(1, True).inline_keyboard[0]
+    assert [button.callback_data for button in middle_page] == ['sent_links_page:0', 'sent_links_page:2']
+
+
+def _mock_sent_links(monkeypatch, count):
+    fetches = []
+
+    async def iter_sent_links(self, page_size, offset=0, **filters):
+        fetches.append((offset, filters))
+        for sent_link in range(offset, min(count, offset + page_size)):
+            yield sent_link
+
+    monkeypatch.setattr(TelegramAPIClient, 'iter_sent_links', iter_sent_links)
+    monkeypatch.setattr(SentLinksPageView, 'PAGE_SIZE', 20)
+    return fetches
+
+
+def test_pages_are_fetched_once(monkeypatch):
+    fetches = _mock_sent_links(monkeypatch, 45)
+
+    def render(sent_links):
+        return MessageBuilder(f'{sent_links[0]}-{sent_links[-1]}')
+
+    async def run():
+        view = SentLinksPageView({'user_id': 1}, render)
+        pages = [await view.get_page(page) for page in (0, 1, 2, 0)]
+        return pages, view.has_next_page(2)
+
+    pages, has_next_page = asyncio.run(run())
+
+    assert [message for message, _ in pages] == [
+        '0-19\n<i>Page 1</i>', '20-39\n<i>Page 2</i>', '40-44\n<i>Page 3</i>', '0-19\n<i>Page 1</i>'
+    ]
+    assert not has_next_page
+    assert fetches == [(0, {'user_id': 1}), (20, {'user_id': 1}), (40, {'user_id': 1})]
+
+
+def test_rows_that_do_not_fit_go_to_the_next_page(monkeypatch):
+    _mock_sent_links(monkeypatch, 20)
+
+    def render(sent_links):
+        message = MessageBuilder()
+        for sent_link in sent_links:
+            message.add_line(f'{sent_link}'.ljust(1000))
+        return message
+
+    async def run():
+        view = SentLinksPageView({}, render)
+        first_page, _ = await view.get_page(0)
+        second_page, _ = await view.get_page(1)
+        return first_page, second_page
+
+    first_page, second_page = asyncio.run(run())
+
+    assert first_page.split()[:4] == ['0', '1', '2', '3']
+    assert second_page.split()[0] == '4'
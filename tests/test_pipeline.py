@@ -0,0 +1,60 @@
+import asyncio
+
+import pytest
+
+from bot.pipeline import Pipeline
+
+
+def test_independent_steps_run_concurrently():
+    events = []
+
+    async def step(name):
+        events.append(f'start {name}')
+        await asyncio.sleep(0.01)
+        events.append(f'end {name}')
+        return name
+
+    async def join(a, b):
+        return a + b
+
+    pipeline = Pipeline('test').add_step(
+        'a', lambda: step('a')
+    ).add_step(
+        'b', lambda: step('b')
+    ).add_step(
+        'ab', join, depends_on=('a', 'b')
+    )
+    results = asyncio.run(pipeline.run())
+
+    assert results['ab'] == 'ab'
+    assert events[:2] == ['start a', 'start b']
+    assert set(pipeline.timings) == {'a', 'b', 'ab', 'total'}
+
+
+def test_unknown_dependency():
+    async def step():
+        pass
+
+    with pytest.raises(ValueError):
+        Pipeline('test').add_step('b', step, depends_on=('a',))
+
+
+def test_failing_step_cancels_the_pipeline():
+    async def fail():
+        raise RuntimeError
+
+    async def slow():
+        await asyncio.sleep(10)
+
+    async def dependent(failing):
+        pass
+
+    pipeline = Pipeline('test').add_step(
+        'failing', fail
+    ).add_step(
+        'slow', slow
+    ).add_step(
+        'dependent', dependent, depends_on=('failing',)
+    )
+    with pytest.raises(RuntimeError):
+        asyncio.run(asyncio.wait_for(pipeline.run(), 1))
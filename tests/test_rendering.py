@@ -0,0 +1,59 @@
+import pytest
+
+from bot.rendering import MessageBuilder, RowTemplate, format_date, get_link_fields, get_link_fragments
+
+
+def test_row_template_escapes_fields():
+    row = RowTemplate('<a href="{url}">{name}</a> {count}')
+
+    assert row.render({'url': 'https://x.y/?a=1&b="2"', 'name': 'Rock & <Roll>', 'count': 3}) == \
+        '<a href="https://x.y/?a=1&amp;b=&quot;2&quot;">Rock &amp; &lt;Roll&gt;</a> 3'
+
+
+def test_row_template_rejects_format_specs():
+    with pytest.raises(ValueError):
+        RowTemplate('{count:>5}')
+
+
+def test_format_date():
+    assert format_date('2023-05-01T10:00:00+00:00') == '2023/05/01'
+    assert format_date('2023') == '2023'
+
+
+def test_get_link_fields():
+    link = {
+        'link_type': 'artist',
+        'url': 'https://open.spotify.com/artist/1',
+        'artist': {'name': 'Simon & Garfunkel', 'genres': [{'name': 'folk'}, {'name': 'rock'}]},
+    }
+
+    fields = get_link_fields(link)
+
+    assert fields['name'] == 'Simon &amp; Garfunkel'
+    assert fields['genres'] == '(folk, rock)'
+
+
+def test_message_builder():
+    message = MessageBuilder('<strong>Title</strong>')
+    message.add_row(RowTemplate('- {name}'), name='a<b').add_line()
+
+    assert list(message) == ['<strong>Title</strong>', '- a&lt;b', '']
+    assert message.build() == '<strong>Title</strong>\n- a&lt;b\n'
+
+
+def test_link_fragments_are_rendered_once_per_update():
+    link = {
+        'id': 1,
+        'updated_at': '2023-05-01T10:00:00',
+        'link_type': 'artist',
+        'url': 'https://open.spotify.com/artist/1',
+        'artist': {'name': 'Simon & Garfunkel', 'genres': []},
+    }
+    fragments = get_link_fragments(link)
+
+    assert get_link_fragments(dict(link)) is fragments
+    assert fragments.fields['name'] == 'Simon &amp; Garfunkel'
+    assert RowTemplate('{name}').render(fragments.fields) == 'Simon &amp; Garfunkel'
+
+    updated_link = dict(link, updated_at='2023-05-02T10:00:00', artist={'name': 'Simon', 'genres': []})
+    assert get_link_fragments(updated_link).name == 'Simon'
@@ -0,0 +1,119 @@
+import asyncio
+from types import SimpleNamespace
+
+from telegram.error import BadRequest
+
+from bot.cache import LRUCache
+from bot.reply import MessageSplitter, ReplyMixin
+
+
+def test_split_at_line_boundaries():
+    parts = MessageSplitter(10).split('aaaa\nbbbb\ncccc')
+
+    assert parts == ['aaaa\nbbbb', 'cccc']
+
+
+def test_split_lines_without_joining_them_first():
+    consumed = []
+
+    def lines():
+        for number in range(1000):
+            consumed.append(number)
+            yield 'x' * 9
+
+    splitter = MessageSplitter(100)
+    chunks = splitter._iter_chunks(lines())
+
+    assert len(next(chunks)) <= 100 * splitter.CHUNK_PARTS + 10
+    assert len(consumed) < 1000
+    assert splitter.split(lines()) == ['\n'.join(['x' * 9] * 10)] * 100
+
+
+def test_split_outside_open_tags_when_possible():
+    parts = MessageSplitter(22).split('aaaa\n<b>bbbb\ncccc\ndddd</b>\neeee')
+
+    assert parts == ['aaaa', '<b>bbbb\ncccc\ndddd</b>', 'eeee']
+
+
+def test_split_closes_and_reopens_tags():
+    parts = MessageSplitter(30).split('<a href="url">aaaaaaaaaaa\nbbbbbbbbbbb</a>')
+
+    assert parts == ['<a href="url">aaaaaaaaaaa</a>', '<a href="url">bbbbbbbbbbb</a>']
+
+
+def test_split_long_line_between_tags_and_entities():
+    parts = MessageSplitter(12).split('<b>aaaa&amp;bbbbbb</b>')
+
+    assert parts == ['<b>aaaa</b>', '<b>&amp;</b>', '<b>bbbbb</b>', '<b>b</b>']
+
+
+def test_split_lines():
+    parts = MessageSplitter(10).split(iter(['aaaa', 'bbbb', 'cccc']))
+
+    assert parts == ['aaaa\nbbbb', 'cccc']
+
+
+def test_split_drops_unclosed_tags_that_pile_up():
+    message = ('<strong>' + 'x' * 50 + '\n') * 2000
+
+    parts = MessageSplitter(4096).split(message)
+
+    assert all(len(part) <= 4096 for part in parts)
+    assert len(parts) < 50
+    assert all(part.count('<strong>') == part.count('</strong>') for part in parts)
+
+
+def test_split_parts_fit_in_the_max_length():
+    messages = [
+        '<b>' * 5000 + 'x' * 10000,
+        '<a href="' + 'u' * 9000 + '">x</a>',
+        '&amp;' * 3000,
+        ('<i>' + 'y' * 30) * 3000,
+        '<a href="url">' + 'x' * 10000 + '</a>',
+    ]
+
+    for message in messages:
+        parts = MessageSplitter(4096).split(message)
+
+        assert parts
+        assert all(len(part) <= 4096 for part in parts)
+
+
+def _reply_audio(monkeypatch, audio_file_ids, rejected_file_ids=()):
+    """Replies the audio of a url, and returns the audios that were sent to Telegram"""
+    sent_audios = []
+
+    async def send_audio(chat_id, audio, **kwargs):
+        sent_audios.append(audio)
+        if audio in rejected_file_ids:
+            raise BadRequest('Wrong file identifier')
+        return SimpleNamespace(audio=SimpleNamespace(file_id=f'file_id_{len(sent_audios)}'))
+
+    async def send(update, send):
+        return await send()
+
+    monkeypatch.setattr(ReplyMixin, '_audio_file_ids', audio_file_ids)
+    monkeypatch.setattr(ReplyMixin, '_send', staticmethod(send))
+    update = SimpleNamespace(message=SimpleNamespace(chat_id=1, message_id=2))
+    context = SimpleNamespace(bot=SimpleNamespace(send_audio=send_audio))
+    asyncio.run(ReplyMixin._reply_audio(update, context, 'https://p.scdn.co/1', 'caption', 'performer', 'title'))
+    return sent_audios
+
+
+def test_reply_audio_reuses_the_file_id_of_the_url(monkeypatch):
+    audio_file_ids = LRUCache()
+
+    assert _reply_audio(monkeypatch, audio_file_ids) == ['https://p.scdn.co/1']
+    assert audio_file_ids.get('https://p.scdn.co/1') == 'file_id_1'
+    assert _reply_audio(monkeypatch, audio_file_ids) == ['file_id_1']
+
+
+def test_reply_audio_sends_the_url_when_the_file_id_is_rejected(monkeypatch):
+    audio_file_ids = LRUCache()
+    audio_file_ids.set('https://p.scdn.co/1', 'expired_file_id')
+
+    sent_audios = _reply_audio(monkeypatch, audio_file_ids, rejected_file_ids=['expired_file_id'])
+
+    assert sent_audios == ['expired_file_id', 'https://p.scdn.co/1']
+    # The rejected file id is evicted, and the one of the new upload is cached
+    assert audio_file_ids.get('https://p.scdn.co/1') == 'file_id_2'
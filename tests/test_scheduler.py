@@ -0,0 +1,61 @@
+import asyncio
+import time
+
+from telegram.error import RetryAfter
+
+from bot.scheduler import SendScheduler, TokenBucket
+
+
+def test_token_bucket_rate():
+    async def run():
+        bucket = TokenBucket(rate=100, capacity=1)
+        start = time.monotonic()
+        for _ in range(5):
+            await bucket.acquire()
+        return time.monotonic() - start
+
+    assert asyncio.run(run()) >= 0.035
+
+
+def test_retry_after_only_delays_its_chat():
+    sent = []
+
+    async def run():
+        scheduler = SendScheduler()
+        retried = []
+
+        async def rate_limited_send():
+            if not retried:
+                retried.append(1)
+                raise RetryAfter(0.05)
+            sent.append('rate limited chat')
+
+        async def send():
+            sent.append('other chat')
+
+        await asyncio.gather(
+            scheduler.send(1, False, rate_limited_send),
+            scheduler.send(2, False, send),
+        )
+
+    asyncio.run(run())
+    assert sent == ['other chat', 'rate limited chat']
+
+
+def test_scheduler_can_be_created_outside_the_loop():
+    # Like the scheduler of the module, created on import
+    scheduler = SendScheduler()
+    sent = []
+
+    async def send():
+        sent.append(1)
+
+    async def run():
+        # More than the burst of the global bucket, so its lock is waited on
+        await asyncio.gather(
+            *[scheduler._global_bucket.acquire() for _ in range(SendScheduler.GLOBAL_RATE + 2)],
+            scheduler.send(1, False, send),
+        )
+
+    asyncio.run(run())
+    assert sent == [1]
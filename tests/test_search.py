@@ -0,0 +1,188 @@
+import asyncio
+from types import SimpleNamespace
+
+from bot import search as search_module
+from bot.api_client.spotify_api_client import SpotifyAPIClient
+from bot.autocomplete import AutocompleteEntry, AutocompleteIndex
+from bot.metrics import metrics
+from bot.search import SearchInline
+
+
+def _build_update(query, answers, offset=''):
+    """Inline query update whose answers are appended to `answers` as (query, results, kwargs)"""
+    async def answer(results, **kwargs):
+        answers.append((query, results, kwargs))
+
+    inline_query = SimpleNamespace(
+        query=query,
+        offset=offset,
+        from_user=SimpleNamespace(id=1, username='user'),
+        answer=answer,
+    )
+    return SimpleNamespace(inline_query=inline_query)
+
+
+def _build_chosen_result_update(result_id):
+    return SimpleNamespace(chosen_inline_result=SimpleNamespace(result_id=result_id))
+
+
+def _artists_search_response(names):
+    """Spotify search response with an artist per name, whose id is its position"""
+    return {'results': [
+        {
+            'id': str(index),
+            'name': name,
+            'images': [],
+            'genres': [],
+            'external_urls': {'spotify': f'https://open.spotify.com/artist/{index}'},
+        }
+        for index, name in enumerate(names)
+    ]}
+
+
+def test_newer_queries_supersede_the_in_flight_search(monkeypatch):
+    searches = []
+    answers = []
+    debounces = []
+    cancelled_debounces = []
+
+    async def search(self, query, entity_type):
+        searches.append(query)
+        return {'results': []}
+
+    monkeypatch.setattr(SpotifyAPIClient, 'search', search)
+    SearchInline._results_cache.clear()
+    monkeypatch.setattr(search_module, 'autocomplete_index', AutocompleteIndex())
+
+    async def run():
+        # The debounce delay ends when the test says so
+        delay_elapsed = asyncio.Event()
+
+        async def debounce():
+            debounces.append(len(debounces))
+            try:
+                await delay_elapsed.wait()
+            except asyncio.CancelledError:
+                cancelled_debounces.append(debounces[-1])
+                raise
+
+        monkeypatch.setattr(SearchInline, '_debounce', staticmethod(debounce))
+        tasks = []
+        for query in ('track bad', 'track bad b', 'track bad bunny'):
+            tasks.append(asyncio.ensure_future(SearchInline.perform_search(_build_update(query, answers), None)))
+            while len(debounces) < len(tasks):
+                await asyncio.sleep(0)
+        delay_elapsed.set()
+        await asyncio.gather(*tasks)
+        assert SearchInline._searches == {}
+
+    asyncio.run(run())
+    assert searches == ['bad bunny']
+    assert [query for query, _, _ in answers] == ['track bad bunny']
+    assert len(cancelled_debounces) == 2
+
+
+def test_searches_cancelled_while_debouncing_are_counted(monkeypatch):
+    monkeypatch.setattr(SearchInline, 'DEBOUNCE_DELAY', 60)
+    metrics.reset()
+
+    async def run():
+        debounce = asyncio.ensure_future(SearchInline._debounce())
+        await asyncio.sleep(0)
+        debounce.cancel()
+        await asyncio.wait([debounce])
+
+    asyncio.run(run())
+    assert metrics.counters['inline_search.debounced'] == 1
+
+
+def test_results_are_cached_and_paginated(monkeypatch):
+    searches = []
+    answers = []
+
+    async def search(self, query, entity_type):
+        searches.append(query)
+        return _artists_search_response([f'Artist {index}' for index in range(15)])
+
+    monkeypatch.setattr(SpotifyAPIClient, 'search', search)
+    monkeypatch.setattr(SearchInline, 'DEBOUNCE_DELAY', 0)
+    SearchInline._results_cache.clear()
+    monkeypatch.setattr(search_module, 'autocomplete_index', AutocompleteIndex())
+
+    async def run():
+        await SearchInline.perform_search(_build_update('artist Bad  Bunny', answers), None)
+        await SearchInline.perform_search(_build_update('artist bad bunny', answers, offset='10'), None)
+
+    asyncio.run(run())
+    assert searches == ['bad bunny']
+    (_, first_page, first_kwargs), (_, second_page, second_kwargs) = answers
+    assert [result.id for result in first_page] == [f'artist:{index}' for index in range(10)]
+    assert first_kwargs['next_offset'] == '10'
+    assert first_kwargs['is_personal'] is False
+    assert [result.id for result in second_page] == [f'artist:{index}' for index in range(10, 15)]
+    assert second_kwargs['next_offset'] == ''
+
+
+def test_known_entities_are_answered_without_the_backend(monkeypatch):
+    answers = []
+
+    async def search(self, query, entity_type):
+        raise AssertionError('The backend is not searched')
+
+    index = AutocompleteIndex()
+    for number in range(SearchInline.RESULTS_PAGE_SIZE):
+        index.add(AutocompleteEntry('artist', str(number), f'Bad Bunny {number}', '', 'https://open.spotify.com'))
+    monkeypatch.setattr(search_module, 'autocomplete_index', index)
+    monkeypatch.setattr(SpotifyAPIClient, 'search', search)
+    SearchInline._results_cache.clear()
+
+    asyncio.run(SearchInline.perform_search(_build_update('artist bun', answers), None))
+    assert [(len(results), kwargs['next_offset']) for _, results, kwargs in answers] == [
+        (SearchInline.RESULTS_PAGE_SIZE, str(SearchInline.RESULTS_PAGE_SIZE))
+    ]
+
+
+def test_longer_queries_reuse_the_results_of_the_shorter_ones(monkeypatch):
+    searches = []
+    answers = []
+
+    async def search(self, query, entity_type):
+        searches.append(query)
+        return _artists_search_response(['Bad Bunny'] * 12 + ['Bad Religion'] * 3)
+
+    monkeypatch.setattr(SpotifyAPIClient, 'search', search)
+    monkeypatch.setattr(SearchInline, 'DEBOUNCE_DELAY', 0)
+    monkeypatch.setattr(search_module, 'autocomplete_index', AutocompleteIndex())
+    SearchInline._results_cache.clear()
+
+    async def run():
+        await SearchInline.perform_search(_build_update('artist bad', answers), None)
+        await SearchInline.perform_search(_build_update('artist bad bun', answers), None)
+
+    asyncio.run(run())
+    assert searches == ['bad']
+    _, results, _ = answers[1]
+    assert len(results) == SearchInline.RESULTS_PAGE_SIZE
+    assert all(result.title.startswith('Bad Bunny') for result in results)
+
+
+def test_chosen_results_are_prefetched_once(monkeypatch):
+    created = []
+
+    async def create_album(self, album_id):
+        created.append(album_id)
+        await asyncio.sleep(0.01)
+        return {'spotify_id': album_id}
+
+    monkeypatch.setattr(SpotifyAPIClient, 'create_album', create_album)
+
+    async def run():
+        update = _build_chosen_result_update('album:abc')
+        prefetch = asyncio.ensure_future(SearchInline.prefetch_chosen_result(update, None))
+        await asyncio.sleep(0)
+        await SearchInline.wait_for_prefetch('album', 'abc')
+        await prefetch
+        await SearchInline.prefetch_chosen_result(_build_chosen_result_update('abc'), None)
+
+    asyncio.run(run())
+    assert created == ['abc']
@@ -0,0 +1,105 @@
+import asyncio
+import socket
+from types import SimpleNamespace
+
+import aiohttp
+from aiohttp import web
+
+from bot.sharding import ShardedWebhookServer, ShardRouter, get_update_shard_key
+
+
+def test_update_shard_key():
+    message = {'message_id': 1, 'chat': {'id': -10}, 'from': {'id': 5}}
+    assert get_update_shard_key({'update_id': 1, 'message': message}) == -10
+    assert get_update_shard_key({'update_id': 2, 'callback_query': {'from': {'id': 5}, 'message': message}}) == -10
+    assert get_update_shard_key({'update_id': 3, 'inline_query': {'id': '1', 'from': {'id': 5}}}) == 5
+    chosen_inline_result = {'result_id': 'artist:1', 'from': {'id': 5}, 'query': 'artist a'}
+    assert get_update_shard_key({'update_id': 4, 'chosen_inline_result': chosen_inline_result}) == 5
+    assert get_update_shard_key({'update_id': 5}) == 5
+
+
+def test_chats_of_a_shard_that_is_down_move_to_the_live_ones():
+    router = ShardRouter(3)
+    for shard in range(3):
+        router.set_alive(shard, True)
+    shards = {key: router.get_shard(key) for key in range(-30, 30)}
+    assert shards == {key: key % 3 for key in range(-30, 30)}
+
+    router.set_alive(1, False)
+    for key, shard in shards.items():
+        if shard == 1:
+            assert router.get_shard(key) in (0, 2)
+        else:
+            assert router.get_shard(key) == shard
+
+    router.set_alive(1, True)
+    assert {key: router.get_shard(key) for key in shards} == shards
+
+
+def test_no_shard_when_every_one_is_down():
+    assert ShardRouter(2).get_shard(1) is None
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def _build_worker_app(received, shard):
+    async def receive(request):
+        received.append(shard)
+        return web.Response()
+
+    app = web.Application()
+    app.router.add_post('/', receive)
+    return app
+
+
+def _run_with_workers(test, workers_listening):
+    """Runs the test with a front of two workers, of which only the listening ones have a server"""
+    async def run():
+        server = ShardedWebhookServer(['true'], workers=2, workers_port=_free_port(), secret_token=None)
+        server._session = aiohttp.ClientSession()
+        # Shards of the updates that the workers received
+        received = []
+        runners = []
+        for worker in server._workers:
+            server.router.set_alive(worker.shard, True)
+            worker.process = SimpleNamespace(returncode=None)
+            if worker.shard in workers_listening:
+                runner = web.AppRunner(_build_worker_app(received, worker.shard))
+                await runner.setup()
+                await web.TCPSite(runner, '127.0.0.1', worker.port).start()
+                runners.append(runner)
+        try:
+            return await test(server, received)
+        finally:
+            await server._session.close()
+            for runner in runners:
+                await runner.cleanup()
+
+    return asyncio.run(run())
+
+
+def test_updates_of_a_worker_that_is_not_reachable_are_rerouted():
+    async def test(server, received):
+        response = await server._forward(1, b'{}')
+        return response.status, received, server.router.is_alive(1)
+
+    status, received, is_alive = _run_with_workers(test, workers_listening=[0])
+    assert status == 200
+    assert received == [0]
+    assert not is_alive
+
+
+def test_workers_taken_for_down_are_probed_back():
+    async def test(server, received):
+        server.router.set_alive(0, False)
+        server.WORKER_PROBE_INTERVAL = 0.01
+        prober = asyncio.create_task(server._probe())
+        await asyncio.sleep(0.1)
+        prober.cancel()
+        return server.router.is_alive(0), server.router.is_alive(1)
+
+    assert _run_with_workers(test, workers_listening=[0, 1]) == (True, True)
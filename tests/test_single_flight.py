@@ -0,0 +1,20 @@
+import asyncio
+
+from bot.single_flight import SingleFlight
+
+
+def test_concurrent_calls_are_coalesced():
+    single_flight = SingleFlight()
+    calls = []
+
+    async def fetch():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return 'result'
+
+    async def run():
+        return await asyncio.gather(*[single_flight.do('key', fetch) for _ in range(3)])
+
+    assert asyncio.run(run()) == ['result'] * 3
+    assert len(calls) == 1
+    assert single_flight.stats() == {'in_flight': 0, 'calls': 1, 'coalesced': 2}
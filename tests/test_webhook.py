@@ -0,0 +1,61 @@
+import asyncio
+import json
+
+from aiohttp.test_utils import TestClient, TestServer
+from telegram.ext import ApplicationBuilder
+
+from bot.webhook import WebhookServer
+
+UPDATE = {
+    'update_id': 1,
+    'message': {
+        'message_id': 1,
+        'date': 0,
+        'chat': {'id': 1, 'type': 'private'},
+        'from': {'id': 1, 'is_bot': False, 'first_name': 'User'},
+        'text': '/help',
+    },
+}
+
+
+def _post(secret_token, body, headers=None):
+    async def run():
+        application = ApplicationBuilder().token('123:token').build()
+        server = WebhookServer(application, path='/telegram', secret_token=secret_token)
+        async with TestClient(TestServer(server.build_app())) as client:
+            response = await client.post('/telegram', data=body, headers=headers or {})
+        queued = [application.update_queue.get_nowait() for _ in range(application.update_queue.qsize())]
+        return response.status, queued
+
+    return asyncio.run(run())
+
+
+def test_update_is_queued():
+    status, queued = _post('secret', json.dumps(UPDATE), {WebhookServer.SECRET_TOKEN_HEADER: 'secret'})
+    assert status == 200
+    assert [update.message.text for update in queued] == ['/help']
+
+
+def test_wrong_secret_token_is_forbidden():
+    status, queued = _post('secret', json.dumps(UPDATE), {WebhookServer.SECRET_TOKEN_HEADER: 'wrong'})
+    assert status == 403
+    assert queued == []
+
+
+def test_invalid_update_is_rejected():
+    status, queued = _post(None, 'not json')
+    assert status == 400
+    assert queued == []
+
+
+def test_metrics_are_served():
+    async def run():
+        application = ApplicationBuilder().token('123:token').build()
+        server = WebhookServer(application, path='/telegram', secret_token='secret')
+        async with TestClient(TestServer(server.build_app())) as client:
+            response = await client.get(WebhookServer.METRICS_PATH)
+            return response.status, await response.json()
+
+    status, snapshot = asyncio.run(run())
+    assert status == 200
+    assert set(snapshot) == {'counters', 'gauges', 'timings', 'sources'}